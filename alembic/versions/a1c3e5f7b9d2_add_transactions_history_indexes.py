@@ -0,0 +1,39 @@
+"""Add transactions history indexes
+
+Revision ID: a1c3e5f7b9d2
+Revises: 96e44fff2db2
+Create Date: 2026-01-12 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c3e5f7b9d2'
+down_revision: Union[str, Sequence[str], None] = '96e44fff2db2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индексы строим CONCURRENTLY, чтобы не блокировать запись в transactions
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_transactions_from_created_id', 'transactions',
+            ['from_account_id', 'created_at', 'id'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_transactions_to_created_id', 'transactions',
+            ['to_account_id', 'created_at', 'id'],
+            unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_transactions_to_created_id', table_name='transactions', postgresql_concurrently=True)
+        op.drop_index('ix_transactions_from_created_id', table_name='transactions', postgresql_concurrently=True)
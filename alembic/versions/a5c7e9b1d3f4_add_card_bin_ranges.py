@@ -0,0 +1,32 @@
+"""Add card_bin_ranges for block-reserved card number allocation
+
+Revision ID: a5c7e9b1d3f4
+Revises: f4b6d8e0a2c3
+Create Date: 2026-02-27 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5c7e9b1d3f4'
+down_revision: Union[str, Sequence[str], None] = 'f4b6d8e0a2c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Строки BIN создаются при первом резерве (INSERT ... ON CONFLICT в app/core/cards.py)
+    op.create_table(
+        'card_bin_ranges',
+        sa.Column('bin', sa.String(length=8), nullable=False),
+        sa.Column('next_value', sa.BigInteger(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('bin'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('card_bin_ranges')
@@ -0,0 +1,137 @@
+"""Add spending analytics: categories, transaction dimensions, monthly rollups
+
+Revision ID: a7c9e1f3b5d6
+Revises: f6b8d0e2a4c5
+Create Date: 2026-02-09 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c9e1f3b5d6'
+down_revision: Union[str, Sequence[str], None] = 'f6b8d0e2a4c5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Совпадает с app/core/categories.py (копия, чтобы миграция не зависела от кода приложения)
+CATEGORIES = [
+        {'id': 1, 'code': 'transfer_out', 'name': 'Переводы', 'kind': 'expense'},
+        {'id': 2, 'code': 'transfer_in', 'name': 'Поступления от клиентов', 'kind': 'income'},
+        {'id': 3, 'code': 'external_transfer', 'name': 'Переводы в другие банки', 'kind': 'expense'},
+        {'id': 4, 'code': 'topup', 'name': 'Пополнения', 'kind': 'income'},
+        {'id': 5, 'code': 'mobile', 'name': 'Мобильная связь', 'kind': 'expense'},
+        {'id': 6, 'code': 'utilities', 'name': 'Коммунальные услуги', 'kind': 'expense'},
+        {'id': 7, 'code': 'transport', 'name': 'Транспорт', 'kind': 'expense'},
+        {'id': 8, 'code': 'internet', 'name': 'Интернет и ТВ', 'kind': 'expense'},
+        {'id': 9, 'code': 'education', 'name': 'Образование', 'kind': 'expense'},
+        {'id': 10, 'code': 'tickets', 'name': 'Билеты', 'kind': 'expense'},
+        {'id': 11, 'code': 'shopping', 'name': 'Покупки', 'kind': 'expense'},
+        {'id': 12, 'code': 'entertainment', 'name': 'Развлечения и подписки', 'kind': 'expense'},
+        {'id': 13, 'code': 'fines', 'name': 'Штрафы', 'kind': 'expense'},
+        {'id': 14, 'code': 'other', 'name': 'Другое', 'kind': 'expense'},
+        {'id': 15, 'code': 'eco', 'name': 'Eco Tree', 'kind': 'expense'},
+        {'id': 16, 'code': 'ortak', 'name': 'Ortak', 'kind': 'expense'},
+        {'id': 17, 'code': 'loan_payout', 'name': 'Кредиты: зачисление', 'kind': 'income'},
+        {'id': 18, 'code': 'loan_repayment', 'name': 'Кредиты: погашение', 'kind': 'expense'},
+        {'id': 19, 'code': 'deposit_open', 'name': 'Вклады: открытие', 'kind': 'internal'},
+        {'id': 20, 'code': 'deposit_close', 'name': 'Вклады: закрытие', 'kind': 'internal'},
+        {'id': 21, 'code': 'insurance', 'name': 'Страхование', 'kind': 'expense'},
+]
+
+# Старые строки: категория восстанавливается по тексту, который писали роутеры
+BACKFILL_CATEGORY_SQL = """
+UPDATE transactions SET category_id = CASE
+    WHEN category = 'Перевод клиенту' THEN 1
+    WHEN category LIKE 'Перевод на карту др. банка%' THEN 3
+    WHEN category = 'ATM Deposit' THEN 4
+    WHEN category LIKE 'Моб:%' THEN 5
+    WHEN category LIKE 'ЖКХ:%' THEN 6
+    WHEN category LIKE 'Транспорт:%' THEN 7
+    WHEN category LIKE 'Интернет:%' THEN 8
+    WHEN category LIKE 'Обучение:%' THEN 9
+    WHEN category LIKE 'Билеты:%' THEN 10
+    WHEN category LIKE 'Shop:%' THEN 11
+    WHEN category LIKE 'Подписка:%' THEN 12
+    WHEN category LIKE 'Штраф%' THEN 13
+    WHEN category LIKE 'Вклад в экологию%' THEN 15
+    WHEN category LIKE 'Ortak:%' THEN 16
+    WHEN category LIKE 'Зачисление:%' THEN 17
+    WHEN category LIKE 'Погашение кредита%' THEN 18
+    WHEN category LIKE 'Открытие вклада%' THEN 19
+    WHEN category LIKE 'Закрытие вклада%' THEN 20
+    WHEN category LIKE 'Страхование:%' THEN 21
+    WHEN from_account_id IS NOT NULL THEN 14
+END
+WHERE category_id IS NULL
+"""
+
+# Исходящие — владельцу счета списания; входящие переводы — получателю как transfer_in.
+# Служебные пользователи (расчетные счета провайдеров, phone srv_*) в свертки не попадают.
+BACKFILL_ROLLUPS_SQL = """
+INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+SELECT user_id, month, category_id, SUM(amount), COUNT(*)
+FROM (
+    SELECT a.user_id,
+           CAST(date_trunc('month', t.created_at AT TIME ZONE 'Asia/Almaty') AS DATE) AS month,
+           t.category_id, t.amount
+    FROM transactions t
+    JOIN accounts a ON a.id = t.from_account_id
+    JOIN users u ON u.id = a.user_id
+    WHERE t.category_id IS NOT NULL AND u.phone NOT LIKE 'srv\\_%'
+    UNION ALL
+    SELECT a.user_id,
+           CAST(date_trunc('month', t.created_at AT TIME ZONE 'Asia/Almaty') AS DATE),
+           CASE WHEN t.from_account_id IS NOT NULL THEN 2 ELSE t.category_id END,
+           t.amount
+    FROM transactions t
+    JOIN accounts a ON a.id = t.to_account_id
+    JOIN users u ON u.id = a.user_id
+    WHERE t.category_id IS NOT NULL AND u.phone NOT LIKE 'srv\\_%'
+) movements
+GROUP BY user_id, month, category_id
+"""
+
+
+def upgrade() -> None:
+    categories = op.create_table('transaction_categories',
+        sa.Column('id', sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column('code', sa.String(length=32), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('code')
+    )
+    op.bulk_insert(categories, CATEGORIES)
+
+    op.add_column('transactions', sa.Column('category_id', sa.SmallInteger(), nullable=True))
+    op.add_column('transactions', sa.Column('provider', sa.String(length=64), nullable=True))
+    op.add_column('transactions', sa.Column('merchant', sa.String(length=64), nullable=True))
+    op.create_foreign_key('fk_transactions_category_id', 'transactions', 'transaction_categories',
+                          ['category_id'], ['id'])
+
+    op.create_table('spending_rollups',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('category_id', sa.SmallInteger(), nullable=False),
+        sa.Column('total', sa.Numeric(precision=14, scale=2), nullable=False, server_default='0'),
+        sa.Column('tx_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['category_id'], ['transaction_categories.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'month', 'category_id')
+    )
+
+    op.execute(BACKFILL_CATEGORY_SQL)
+    op.execute(BACKFILL_ROLLUPS_SQL)
+
+
+def downgrade() -> None:
+    op.drop_table('spending_rollups')
+    op.drop_constraint('fk_transactions_category_id', 'transactions', type_='foreignkey')
+    op.drop_column('transactions', 'merchant')
+    op.drop_column('transactions', 'provider')
+    op.drop_column('transactions', 'category_id')
+    op.drop_table('transaction_categories')
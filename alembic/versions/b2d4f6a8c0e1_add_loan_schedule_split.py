@@ -0,0 +1,29 @@
+"""Add principal/interest split to loan schedules
+
+Revision ID: b2d4f6a8c0e1
+Revises: a1c3e5f7b9d2
+Create Date: 2026-01-14 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d4f6a8c0e1'
+down_revision: Union[str, Sequence[str], None] = 'a1c3e5f7b9d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Для старых графиков разбивки нет (NULL)
+    op.add_column('loan_schedules', sa.Column('principal_amount', sa.Numeric(precision=10, scale=2), nullable=True))
+    op.add_column('loan_schedules', sa.Column('interest_amount', sa.Numeric(precision=10, scale=2), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('loan_schedules', 'interest_amount')
+    op.drop_column('loan_schedules', 'principal_amount')
@@ -0,0 +1,27 @@
+"""Add per-user Telegram chat for notifications
+
+Revision ID: b6d8f0a2c4e7
+Revises: a5c7e9b1d3f4
+Create Date: 2026-02-28 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6d8f0a2c4e7'
+down_revision: Union[str, Sequence[str], None] = 'a5c7e9b1d3f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Заполняется клиентом (PATCH /settings/me); до этого уведомления ему не уходят
+    op.add_column('users', sa.Column('telegram_chat_id', sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'telegram_chat_id')
@@ -0,0 +1,49 @@
+"""Add outstanding aggregates to loans
+
+Revision ID: c3e5a7b9d1f2
+Revises: b2d4f6a8c0e1
+Create Date: 2026-01-15 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e5a7b9d1f2'
+down_revision: Union[str, Sequence[str], None] = 'b2d4f6a8c0e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('loans', sa.Column('outstanding_principal', sa.Numeric(precision=12, scale=2), nullable=True))
+    op.add_column('loans', sa.Column('remaining_amount', sa.Numeric(precision=12, scale=2), nullable=True))
+    op.add_column('loans', sa.Column('remaining_installments', sa.Integer(), nullable=True))
+
+    # Заполняем агрегаты для существующих кредитов одним GROUP BY
+    op.execute("""
+        UPDATE loans l
+        SET remaining_amount = COALESCE(s.remaining_amount, 0),
+            remaining_installments = COALESCE(s.remaining_installments, 0),
+            outstanding_principal = s.outstanding_principal
+        FROM loans l2
+        LEFT JOIN (
+            SELECT loan_id,
+                   SUM(amount) AS remaining_amount,
+                   COUNT(*) AS remaining_installments,
+                   SUM(principal_amount) AS outstanding_principal
+            FROM loan_schedules
+            WHERE is_paid IS NOT TRUE
+            GROUP BY loan_id
+        ) s ON s.loan_id = l2.id
+        WHERE l.id = l2.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('loans', 'remaining_installments')
+    op.drop_column('loans', 'remaining_amount')
+    op.drop_column('loans', 'outstanding_principal')
@@ -0,0 +1,33 @@
+"""Add settlement sweeps for provider shard balances
+
+Revision ID: c7e9a1b3d5f8
+Revises: b6d8f0a2c4e7
+Create Date: 2026-03-01 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e9a1b3d5f8'
+down_revision: Union[str, Sequence[str], None] = 'b6d8f0a2c4e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('settlement_sweeps',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('account_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=18, scale=2), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('settlement_sweeps')
@@ -0,0 +1,42 @@
+"""Add scheduled payments (loan autopay, monthly insurance billing)
+
+Revision ID: c9e1a3b5d7f8
+Revises: b8d0f2a4c6e7
+Create Date: 2026-02-23 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e1a3b5d7f8'
+down_revision: Union[str, Sequence[str], None] = 'b8d0f2a4c6e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('loans', sa.Column('autopay', sa.Boolean(), server_default=sa.text('true'), nullable=False))
+    op.add_column('loan_schedules', sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_loan_schedules_unpaid_due', 'loan_schedules', ['due_date'], unique=False,
+                    postgresql_where=sa.text('is_paid IS NOT TRUE'))
+
+    # Действующие полисы оплачены при оформлении — для них ничего не меняется
+    op.add_column('insurances', sa.Column('payment_mode', sa.String(length=16), server_default='upfront', nullable=False))
+    op.add_column('insurances', sa.Column('next_billing_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('insurances', sa.Column('billing_retry_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_insurances_billing_due', 'insurances', ['next_billing_at'], unique=False,
+                    postgresql_where=sa.text("payment_mode = 'monthly' AND is_active IS TRUE"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_insurances_billing_due', table_name='insurances')
+    op.drop_column('insurances', 'billing_retry_at')
+    op.drop_column('insurances', 'next_billing_at')
+    op.drop_column('insurances', 'payment_mode')
+    op.drop_index('ix_loan_schedules_unpaid_due', table_name='loan_schedules')
+    op.drop_column('loan_schedules', 'next_attempt_at')
+    op.drop_column('loans', 'autopay')
@@ -0,0 +1,56 @@
+"""Add deposit interest accrual and maturity processing
+
+Revision ID: d1f3a5c7e9b0
+Revises: c9e1a3b5d7f8
+Create Date: 2026-02-24 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1f3a5c7e9b0'
+down_revision: Union[str, Sequence[str], None] = 'c9e1a3b5d7f8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Та же формула, что app/core/deposit_interest.py: полные дни, actual/365, половина вверх
+BACKFILL_ACCRUAL_SQL = """
+UPDATE deposits d
+SET accrued_interest = round(d.amount * d.rate * e.days / 365, 2),
+    accrued_through = d.start_date + e.days * interval '1 day'
+FROM (
+    SELECT id, GREATEST(floor(extract(epoch FROM LEAST(now(), end_date) - start_date) / 86400), 0) AS days
+    FROM deposits
+    WHERE is_active IS TRUE
+) e
+WHERE d.id = e.id
+"""
+
+
+def upgrade() -> None:
+    op.execute(
+        "INSERT INTO transaction_categories (id, code, name, kind) "
+        "VALUES (22, 'deposit_interest', 'Вклады: проценты', 'income') ON CONFLICT (id) DO NOTHING"
+    )
+    op.add_column('deposits', sa.Column('accrued_interest', sa.Numeric(precision=12, scale=2), server_default='0', nullable=False))
+    op.add_column('deposits', sa.Column('accrued_through', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('deposits', sa.Column('on_maturity', sa.String(length=16), server_default='payout', nullable=False))
+    op.add_column('deposits', sa.Column('account_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_deposits_account_id', 'deposits', 'accounts', ['account_id'], ['id'])
+    op.create_index('ix_deposits_active_end_date', 'deposits', ['end_date'], unique=False,
+                    postgresql_where=sa.text('is_active IS TRUE'))
+    op.execute(BACKFILL_ACCRUAL_SQL)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deposits_active_end_date', table_name='deposits')
+    op.drop_constraint('fk_deposits_account_id', 'deposits', type_='foreignkey')
+    op.drop_column('deposits', 'account_id')
+    op.drop_column('deposits', 'on_maturity')
+    op.drop_column('deposits', 'accrued_through')
+    op.drop_column('deposits', 'accrued_interest')
+    # Категория 22 остается: на нее уже ссылаются проводки, а справочник только дополняется
@@ -0,0 +1,29 @@
+"""Add insurance lifecycle indexes (expiry sweep, per-user reads)
+
+Revision ID: e3a5c7e9b1d2
+Revises: d1f3a5c7e9b0
+Create Date: 2026-02-25 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a5c7e9b1d2'
+down_revision: Union[str, Sequence[str], None] = 'd1f3a5c7e9b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_insurances_active_end_date', 'insurances', ['end_date'], unique=False,
+                    postgresql_where=sa.text('is_active IS TRUE'))
+    op.create_index('ix_insurances_user_active', 'insurances', ['user_id', 'is_active'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_insurances_user_active', table_name='insurances')
+    op.drop_index('ix_insurances_active_end_date', table_name='insurances')
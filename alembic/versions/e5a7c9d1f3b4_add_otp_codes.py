@@ -0,0 +1,35 @@
+"""Add otp_codes (unlogged)
+
+Revision ID: e5a7c9d1f3b4
+Revises: d4f6b8c0e2a3
+Create Date: 2026-01-26 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c9d1f3b4'
+down_revision: Union[str, Sequence[str], None] = 'd4f6b8c0e2a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('otp_codes',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('code_hash', sa.LargeBinary(), nullable=False),
+        sa.Column('attempts', sa.SmallInteger(), nullable=False, server_default='0'),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('key'),
+        prefixes=['UNLOGGED'],
+    )
+    op.create_index('ix_otp_codes_expires_at', 'otp_codes', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_otp_codes_expires_at', table_name='otp_codes')
+    op.drop_table('otp_codes')
@@ -0,0 +1,85 @@
+"""Add canonical E.164 phone column to users
+
+Revision ID: f4b6d8e0a2c3
+Revises: e3a5c7e9b1d2
+Create Date: 2026-02-26 10:00:00.000000
+
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import phonenumbers
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b6d8e0a2c3'
+down_revision: Union[str, Sequence[str], None] = 'e3a5c7e9b1d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+# Копия app/core/phones.to_e164 (чтобы миграция не зависела от кода приложения)
+_SEPARATORS_RE = re.compile(r"[\s()\-.]+")
+_LOCAL_RE = re.compile(r"(?:\+7|8|7)?(\d{10})")
+
+
+def to_e164(raw: str | None) -> str | None:
+    if not raw:
+        return None
+    compact = _SEPARATORS_RE.sub("", raw)
+    match = _LOCAL_RE.fullmatch(compact)
+    if match:
+        return "+7" + match.group(1)
+    try:
+        number = phonenumbers.parse(compact, "KZ")
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(number):
+        return None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+BACKFILL_SQL = sa.text("""
+UPDATE users u
+SET phone_e164 = b.phone_e164
+FROM unnest(CAST(:ids AS INTEGER[]), CAST(:phones AS VARCHAR[])) AS b(id, phone_e164)
+WHERE u.id = b.id
+""")
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('phone_e164', sa.String(length=16), nullable=True))
+
+    # Один номер в разных написаниях ("8777...", "+7 777 ...") — за ним остается самый старый
+    # пользователь, остальным phone_e164 не ставится (войти по номеру они не смогут — разбирать вручную)
+    conn = op.get_bind()
+    seen: set[str] = set()
+    skipped: list[int] = []
+    batch_ids, batch_phones = [], []
+    for user_id, phone in conn.execute(sa.text("SELECT id, phone FROM users ORDER BY id")).all():
+        canonical = to_e164(phone)
+        if canonical is None:
+            continue  # Служебные пользователи (srv_*) и мусор
+        if canonical in seen:
+            skipped.append(user_id)
+            continue
+        seen.add(canonical)
+        batch_ids.append(user_id)
+        batch_phones.append(canonical)
+        if len(batch_ids) >= BATCH_SIZE:
+            conn.execute(BACKFILL_SQL, {"ids": batch_ids, "phones": batch_phones})
+            batch_ids, batch_phones = [], []
+    if batch_ids:
+        conn.execute(BACKFILL_SQL, {"ids": batch_ids, "phones": batch_phones})
+    if skipped:
+        print(f"phone_e164: duplicate numbers left empty for user ids {skipped}")
+
+    op.create_index('ix_users_phone_e164', 'users', ['phone_e164'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_phone_e164', table_name='users')
+    op.drop_column('users', 'phone_e164')
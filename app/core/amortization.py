@@ -0,0 +1,116 @@
+"""
+Аннуитетный график платежей, посчитанный целиком в NumPy.
+Все суммы внутри — в тиынах (int64), поэтому остаток долга сходится в ноль
+без накопления ошибок округления.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+CENT = Decimal("0.01")
+
+
+@dataclass
+class AmortizationSchedule:
+    payment: Decimal           # Ежемесячный платеж (кроме последнего, он добивает остаток)
+    due_dates: list[datetime]
+    payments: np.ndarray       # Все суммы ниже — в тиынах
+    interest: np.ndarray
+    principal: np.ndarray
+    balance: np.ndarray        # Остаток основного долга после платежа
+
+    @property
+    def total_amount(self) -> Decimal:
+        return _money(int(self.payments.sum()))
+
+    @property
+    def total_interest(self) -> Decimal:
+        return _money(int(self.interest.sum()))
+
+    def rows(self, loan_id: int) -> list[dict]:
+        """Строки для bulk INSERT в loan_schedules"""
+        return [
+            {
+                "loan_id": loan_id,
+                "due_date": due,
+                "amount": _money(pay),
+                "principal_amount": _money(princ),
+                "interest_amount": _money(intr),
+                "is_paid": False,
+            }
+            for due, pay, princ, intr in zip(
+                self.due_dates,
+                self.payments.tolist(),
+                self.principal.tolist(),
+                self.interest.tolist(),
+            )
+        ]
+
+
+def _money(cents: int) -> Decimal:
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def monthly_due_dates(start: datetime, term_months: int) -> list[datetime]:
+    """
+    Даты платежей: тот же день месяца, что и start, начиная со следующего месяца.
+    Если такого дня нет (31 -> февраль), берется последний день месяца.
+    """
+    months = np.datetime64(start.strftime("%Y-%m"), "M") + np.arange(1, term_months + 1)
+    first_days = months.astype("datetime64[D]")
+    days_in_month = ((months + 1).astype("datetime64[D]") - first_days).astype(np.int64)
+    offsets = np.minimum(start.day, days_in_month) - 1
+    dates = first_days + offsets
+
+    time_of_day = start - start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        datetime.combine(d, datetime.min.time(), tzinfo=start.tzinfo) + time_of_day
+        for d in dates.astype(object)
+    ]
+
+
+def build_schedule(amount: Decimal, annual_rate: float, term_months: int, start: datetime) -> AmortizationSchedule:
+    """Полный график: платеж, проценты/тело, остаток и даты за один проход"""
+    if term_months < 1:
+        raise ValueError("term_months must be >= 1")
+    if amount <= 0:
+        raise ValueError("amount must be > 0")
+
+    principal_cents = int((Decimal(amount) * 100).to_integral_value())
+    r = annual_rate / 12
+    k = np.arange(0, term_months + 1, dtype=np.float64)
+
+    if r > 0:
+        growth = (1 + r) ** k
+        payment_cents = round(principal_cents * r / (1 - (1 + r) ** -term_months))
+        # Остаток после k платежей в замкнутой форме
+        balance_f = principal_cents * growth - payment_cents * (growth - 1) / r
+    else:
+        # Округляем вниз: тиыны остатка уходят в последний платеж
+        payment_cents = principal_cents // term_months
+        balance_f = principal_cents - payment_cents * k
+
+    balance = np.rint(np.clip(balance_f, 0, None)).astype(np.int64)
+    balance[0] = principal_cents
+    balance[-1] = 0
+
+    # Тело долга — разница остатков, значит сумма тел точно равна сумме кредита
+    principal = balance[:-1] - balance[1:]
+    interest = np.rint(balance[:-1] * r).astype(np.int64)
+    payments = principal + interest
+
+    # Все платежи, кроме последнего, равны аннуитету; последний закрывает остаток
+    regular = np.full(term_months, payment_cents, dtype=np.int64)
+    regular[-1] = payments[-1]
+    interest[:-1] = regular[:-1] - principal[:-1]
+
+    return AmortizationSchedule(
+        payment=_money(payment_cents),
+        due_dates=monthly_due_dates(start, term_months),
+        payments=regular,
+        interest=interest,
+        principal=principal,
+        balance=balance[1:],
+    )
@@ -0,0 +1,42 @@
+"""
+Помесячные свертки трат по категориям (spending_rollups).
+
+Строка (user_id, month, category_id) обновляется инкрементально в той же транзакции,
+что и проводка: в CTE переводов и оплаты услуг (app/core/transfer_engine.py) или
+через add_to_rollup для ORM-путей (кредиты, вклады, страховки, пополнения).
+Отчет за месяц читает только строки пользователя за этот месяц — O(категорий).
+Месяц считается в часовом поясе ANALYTICS_TIMEZONE.
+"""
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+
+# Начало текущего месяца в часовом поясе отчетов (параметр :tz)
+CURRENT_MONTH_SQL = "CAST(date_trunc('month', now() AT TIME ZONE :tz) AS DATE)"
+# То же для момента :now — фоновые задачи считают время по своим часам (app/core/clock.py)
+MONTH_AT_SQL = "CAST(date_trunc('month', CAST(:now AS TIMESTAMPTZ) AT TIME ZONE :tz) AS DATE)"
+
+ROLLUP_CONFLICT_SQL = (
+    "ON CONFLICT (user_id, month, category_id) DO UPDATE "
+    "SET total = spending_rollups.total + EXCLUDED.total, "
+    "tx_count = spending_rollups.tx_count + EXCLUDED.tx_count"
+)
+
+ROLLUP_UPSERT_SQL = text(f"""
+INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+VALUES (:user_id, {CURRENT_MONTH_SQL}, :category_id, :amount, 1)
+{ROLLUP_CONFLICT_SQL}
+""")
+
+
+async def add_to_rollup(db: AsyncSession, *, user_id: int, category_id: int, amount: Decimal) -> None:
+    """Коммит делает вызывающий код (вместе с самой проводкой)"""
+    await db.execute(ROLLUP_UPSERT_SQL, {
+        "user_id": user_id,
+        "category_id": category_id,
+        "amount": Decimal(amount),
+        "tz": settings.ANALYTICS_TIMEZONE,
+    })
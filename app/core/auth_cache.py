@@ -0,0 +1,100 @@
+import hashlib
+import time
+from dataclasses import dataclass
+
+from cachetools import TLRUCache, TTLCache
+
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Отвязанный от сессии снимок пользователя (только для чтения)"""
+    id: int
+    phone: str
+    phone_e164: str
+    full_name: str | None
+    avatar_url: str | None
+    role: str
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        role = getattr(user.role, "value", user.role) or "user"
+        return cls(
+            id=user.id,
+            phone=user.phone,
+            phone_e164=user.phone_e164,
+            full_name=user.full_name,
+            avatar_url=user.avatar_url,
+            role=role,
+        )
+
+
+class AuthCache:
+    """
+    Быстрый путь аутентификации.
+    - claims: проверенные данные JWT по хешу токена, живут до `exp` токена
+    - principals: снимки пользователей по номеру телефона (E.164), живут AUTH_CACHE_TTL_SECONDS
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.ttl = ttl
+        # exp в JWT — это unix-время, поэтому таймер тоже wall-clock
+        self._claims = TLRUCache(maxsize=maxsize, ttu=self._claims_ttu, timer=time.time)
+        self._principals = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stats = {
+            "claims_hits": 0,
+            "claims_misses": 0,
+            "principal_hits": 0,
+            "principal_misses": 0,
+            "invalidations": 0,
+        }
+
+    def _claims_ttu(self, _key, claims: dict, now: float) -> float:
+        exp = claims.get("exp")
+        if exp is None:
+            return now + self.ttl
+        return float(exp)
+
+    @staticmethod
+    def _token_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    # --- CLAIMS ---
+    def get_claims(self, token: str) -> dict | None:
+        claims = self._claims.get(self._token_key(token))
+        if claims is None:
+            self.stats["claims_misses"] += 1
+        else:
+            self.stats["claims_hits"] += 1
+        return claims
+
+    def put_claims(self, token: str, claims: dict) -> None:
+        self._claims[self._token_key(token)] = claims
+
+    # --- PRINCIPALS ---
+    def get_principal(self, phone: str) -> Principal | None:
+        principal = self._principals.get(phone)
+        if principal is None:
+            self.stats["principal_misses"] += 1
+        else:
+            self.stats["principal_hits"] += 1
+        return principal
+
+    def put_principal(self, principal: Principal) -> None:
+        self._principals[principal.phone_e164] = principal
+
+    def invalidate_principal(self, phone: str) -> None:
+        """Вызывать после любой записи в users"""
+        self._principals.pop(phone, None)
+        self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self._claims.clear()
+        self._principals.clear()
+
+
+auth_cache = AuthCache(
+    maxsize=settings.AUTH_CACHE_MAXSIZE,
+    ttl=settings.AUTH_CACHE_TTL_SECONDS,
+)
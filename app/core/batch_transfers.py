@@ -0,0 +1,277 @@
+"""
+Массовые переводы (зарплатные ведомости, выплаты).
+
+Вместо N вызовов /transfers/p2p — фиксированное число запросов на всю пачку:
+1. RESOLVE_SQL — все получатели одним запросом (телефоны через users, карты через accounts).
+2. LOCK_SQL — счета отправителя и получателей блокируются одним запросом в порядке id,
+   как и в одиночном переводе (app/core/transfer_engine.py), поэтому встречные переводы
+   не ловят дедлок. Остаток отправителя проверяется уже под блокировкой.
+3. POST_SQL — одно выражение: одно списание на всю сумму, зачисления через unnest
+   (несколько строк на один счет складываются), все записи в transactions и свертки трат.
+
+Режимы:
+- atomic — все или ничего: любая ошибка в строке отменяет всю пачку;
+- best_effort — проводятся строки, прошедшие проверки, пока хватает остатка (в порядке пачки).
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import categories
+from app.core.analytics import CURRENT_MONTH_SQL, ROLLUP_CONFLICT_SQL
+from app.core.config import settings
+from app.core.transfer_engine import TransferRejected, run_with_retry
+
+ATOMIC = "atomic"
+BEST_EFFORT = "best_effort"
+
+# По телефону — как в p2p: незаблокированная карта, если есть, иначе первая
+RESOLVE_SQL = text("""
+SELECT 'phone' AS kind, u.phone_e164 AS value, u.id AS user_id, a.id AS account_id
+FROM users u
+LEFT JOIN LATERAL (
+    SELECT id FROM accounts
+    WHERE user_id = u.id
+    ORDER BY is_blocked IS TRUE, id
+    LIMIT 1
+) a ON TRUE
+WHERE u.phone_e164 = ANY(CAST(:phones AS VARCHAR[]))
+UNION ALL
+SELECT 'card', a.card_number, a.user_id, a.id
+FROM accounts a
+WHERE a.card_number = ANY(CAST(:cards AS VARCHAR[]))
+""")
+
+LOCK_SQL = text("""
+SELECT id, user_id, balance, is_blocked FROM accounts
+WHERE id = ANY(CAST(:ids AS INTEGER[])) OR user_id = :user_id
+ORDER BY id
+FOR UPDATE
+""")
+
+POST_SQL = text(f"""
+WITH lines AS (
+    SELECT * FROM unnest(CAST(:to_ids AS INTEGER[]), CAST(:amounts AS NUMERIC[])) AS l(to_id, amount)
+),
+debit AS (
+    UPDATE accounts
+    SET balance = balance - CAST(:total AS NUMERIC)
+    WHERE id = :sender_id AND balance >= CAST(:total AS NUMERIC)
+    RETURNING id, balance
+),
+credit AS (
+    UPDATE accounts a
+    SET balance = a.balance + c.amount
+    FROM (SELECT to_id, sum(amount) AS amount, count(*) AS lines FROM lines GROUP BY to_id) c
+    WHERE a.id = c.to_id AND EXISTS (SELECT 1 FROM debit)
+    RETURNING a.user_id, c.amount, c.lines
+),
+posted AS (
+    INSERT INTO transactions (from_account_id, to_account_id, amount, category, created_at,
+                              category_id, provider, merchant)
+    SELECT d.id, l.to_id, l.amount, :category, now(), CAST(:category_id AS SMALLINT), NULL, NULL
+    FROM lines l CROSS JOIN debit d
+    RETURNING id
+),
+rollup AS (
+    INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+    SELECT CAST(:user_id AS INTEGER), {CURRENT_MONTH_SQL}, CAST(:category_id AS SMALLINT),
+           CAST(:total AS NUMERIC), CAST(:line_count AS INTEGER)
+    FROM debit
+    UNION ALL
+    SELECT c.user_id, {CURRENT_MONTH_SQL}, CAST(:in_category_id AS SMALLINT), sum(c.amount), sum(c.lines)
+    FROM credit c
+    GROUP BY c.user_id
+    {ROLLUP_CONFLICT_SQL}
+)
+SELECT
+    (SELECT balance FROM debit) AS new_balance,
+    (SELECT count(*) FROM posted) AS posted
+""")
+
+
+@dataclass
+class BatchLine:
+    amount: Decimal
+    to_phone: str | None = None  # E.164 (app/core/phones.py)
+    to_card: str | None = None
+    reference: str | None = None  # Идентификатор строки у клиента (табельный номер и т.п.)
+
+
+@dataclass
+class LineResult:
+    index: int
+    reference: str | None
+    amount: Decimal
+    status: str = "pending"  # posted, failed, not_posted
+    error: str | None = None  # recipient_not_found, no_active_account, same_account, insufficient_funds
+    to_account_id: int | None = None
+    to_user_id: int | None = None
+
+
+@dataclass
+class BatchResult:
+    mode: str
+    sender_id: int
+    new_balance: Decimal
+    total_posted: Decimal
+    lines: list[LineResult] = field(default_factory=list)
+    attempts: int = 1
+
+    @property
+    def posted(self) -> list[LineResult]:
+        return [line for line in self.lines if line.status == "posted"]
+
+
+class BatchRejected(TransferRejected):
+    """Пачка не проведена целиком; lines — отчет по строкам"""
+
+    def __init__(self, reason: str, lines: list[LineResult]):
+        super().__init__(reason)
+        self.lines = lines
+
+
+async def resolve_recipients(db: AsyncSession, lines: list[BatchLine]) -> list[LineResult]:
+    phones = sorted({line.to_phone for line in lines if line.to_phone})
+    cards = sorted({line.to_card for line in lines if line.to_card})
+    found: dict[tuple[str, str], tuple[int, int | None]] = {}
+    if phones or cards:
+        rows = await db.execute(RESOLVE_SQL, {"phones": phones, "cards": cards})
+        for row in rows:
+            found[(row.kind, row.value)] = (row.user_id, row.account_id)
+
+    results = []
+    for index, line in enumerate(lines):
+        result = LineResult(index=index, reference=line.reference, amount=Decimal(line.amount))
+        if line.to_phone:
+            target = found.get(("phone", line.to_phone))
+        elif line.to_card:
+            target = found.get(("card", line.to_card))
+        else:
+            target = None  # Номер не распознан
+        if target is None:
+            result.status, result.error = "failed", "recipient_not_found"
+        elif target[1] is None:
+            result.status, result.error = "failed", "no_active_account"
+        else:
+            result.to_user_id, result.to_account_id = target
+        results.append(result)
+    return results
+
+
+def _pick_sender(accounts: list, user_id: int, from_account_id: int | None, total: Decimal):
+    """Тот же порядок, что в TRANSFER_SQL: указанная карта, потом первая, где хватает денег"""
+    own = [a for a in accounts if a.user_id == user_id]
+    if not own:
+        return None
+    return sorted(own, key=lambda a: (
+        a.id != from_account_id,
+        not (not a.is_blocked and a.balance >= total),
+        bool(a.is_blocked),
+        a.id,
+    ))[0]
+
+
+def _plan(results: list[LineResult], sender, mode: str) -> Decimal:
+    """Размечает строки; возвращает сумму к списанию"""
+    for result in results:
+        if result.status == "pending" and result.to_account_id == sender.id:
+            result.status, result.error = "failed", "same_account"
+
+    if mode == ATOMIC:
+        if any(r.status == "failed" for r in results):
+            for r in results:
+                if r.status == "pending":
+                    r.status = "not_posted"
+            raise BatchRejected("invalid_lines", results)
+        total = sum((r.amount for r in results), Decimal("0"))
+        if sender.balance < total:
+            for r in results:
+                r.status, r.error = "not_posted", "insufficient_funds"
+            raise BatchRejected("insufficient_funds", results)
+        for r in results:
+            r.status = "posted"
+        return total
+
+    available = sender.balance
+    total = Decimal("0")
+    for r in results:
+        if r.status != "pending":
+            continue
+        if r.amount <= available - total:
+            r.status = "posted"
+            total += r.amount
+        else:
+            r.status, r.error = "failed", "insufficient_funds"
+    if total == 0:
+        raise BatchRejected("nothing_posted", results)
+    return total
+
+
+async def batch_transfer(
+        db: AsyncSession,
+        *,
+        user_id: int,
+        lines: list[BatchLine],
+        mode: str = ATOMIC,
+        category: str,
+        from_account_id: int | None = None,
+        on_posted=None,
+) -> BatchResult:
+    """
+    Проводит пачку переводов со счета пользователя одной транзакцией.
+    on_posted(session, result) — как в transfer(): вызывается после проводки до коммита.
+    Бросает TransferRejected (no_account, blocked) или BatchRejected с отчетом по строкам.
+    """
+    resolved = await resolve_recipients(db, lines)
+    recipient_ids = sorted({r.to_account_id for r in resolved if r.to_account_id is not None})
+
+    async def operation(session: AsyncSession) -> BatchResult:
+        # Повтор после serialization failure начинается с чистой разметки
+        results = [
+            LineResult(index=r.index, reference=r.reference, amount=r.amount, status=r.status,
+                       error=r.error, to_account_id=r.to_account_id, to_user_id=r.to_user_id)
+            for r in resolved
+        ]
+        accounts = (await session.execute(LOCK_SQL, {"ids": recipient_ids, "user_id": user_id})).all()
+        requested = sum((r.amount for r in results), Decimal("0"))
+        sender = _pick_sender(accounts, user_id, from_account_id, requested)
+        if sender is None:
+            raise TransferRejected("no_account")
+        if sender.is_blocked:
+            raise TransferRejected("blocked")
+
+        total = _plan(results, sender, mode)
+        posted = [r for r in results if r.status == "posted"]
+        row = (await session.execute(POST_SQL, {
+            "user_id": user_id,
+            "sender_id": sender.id,
+            "to_ids": [r.to_account_id for r in posted],
+            "amounts": [r.amount for r in posted],
+            "total": total,
+            "line_count": len(posted),
+            "category": category,
+            "category_id": categories.TRANSFER_OUT,
+            "in_category_id": categories.TRANSFER_IN,
+            "tz": settings.ANALYTICS_TIMEZONE,
+        })).one()
+        if row.new_balance is None:
+            # Под блокировкой остаток уже проверен — сюда попадать не должны
+            raise TransferRejected("insufficient_funds")
+
+        result = BatchResult(
+            mode=mode,
+            sender_id=sender.id,
+            new_balance=row.new_balance,
+            total_posted=total,
+            lines=results,
+        )
+        if on_posted is not None:
+            await on_posted(session, result)
+        return result
+
+    result, attempts = await run_with_retry(db, operation)
+    result.attempts = attempts
+    return result
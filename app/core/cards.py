@@ -0,0 +1,158 @@
+"""
+Выпуск номеров карт (PAN): BIN + номер из последовательности + контрольная цифра Луна.
+
+Последовательность своя у каждого BIN (таблица card_bin_ranges). Процесс забирает из нее
+блок по CARD_BLOCK_SIZE номеров одним UPDATE в отдельной короткой транзакции и дальше
+выдает номера из памяти: ни запроса к БД, ни повтора на уникальном индексе. Блоки разных
+процессов не пересекаются, поэтому номера уникальны без проверок. Следующий блок подгружается
+фоном, когда в текущем остается меньше PREFETCH_AT; номера из недоиспользованного блока
+при перезапуске просто пропадают — пространства в BIN на миллиарды карт.
+
+BIN-ы из CARD_BIN_RANGES используются по порядку: исчерпался один — берется следующий.
+Старые карты выпускались случайными с префиксом 4000, поэтому BIN с таким префиксом запрещен.
+"""
+import asyncio
+import contextvars
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.metrics import CARD_BLOCK_REMAINING, CARD_BLOCKS_RESERVED, CARD_NUMBERS_ALLOCATED
+from app.db.database import engine
+
+PAN_LENGTH = 16
+LEGACY_PREFIX = "4000"
+PREFETCH_AT = 0.2  # Доля блока, при которой подгружается следующий
+# Номер внутри BIN перемешивается умножением по модулю 10^n (множитель взаимно прост с 10 —
+# это биекция), чтобы по номеру карты нельзя было прочитать, сколько карт выпущено
+SCRAMBLE_MULTIPLIER = 738_916_483
+
+RESERVE_SQL = text("""
+INSERT INTO card_bin_ranges (bin, next_value) VALUES (:bin, :block_size)
+ON CONFLICT (bin) DO UPDATE SET next_value = card_bin_ranges.next_value + :block_size
+RETURNING next_value
+""")
+
+
+class CardNumbersExhausted(Exception):
+    """Во всех BIN из CARD_BIN_RANGES закончились номера"""
+
+
+def luhn_check_digit(payload: str) -> str:
+    total = 0
+    for i, ch in enumerate(reversed(payload)):
+        digit = int(ch)
+        if i % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str((10 - total % 10) % 10)
+
+
+def is_luhn_valid(pan: str) -> bool:
+    return len(pan) > 1 and pan.isdigit() and luhn_check_digit(pan[:-1]) == pan[-1]
+
+
+@dataclass
+class _Block:
+    bin: str
+    next: int
+    end: int
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.next
+
+
+class CardAllocator:
+    def __init__(self, bins: list[str], block_size: int):
+        for bin_ in bins:
+            if not bin_.isdigit() or not 6 <= len(bin_) <= 8:
+                raise ValueError(f"BIN должен состоять из 6-8 цифр: {bin_!r}")
+            if bin_.startswith(LEGACY_PREFIX):
+                raise ValueError(f"BIN {bin_} пересекается со старыми случайными номерами {LEGACY_PREFIX}*")
+        self.bins = list(bins)
+        self.block_size = block_size
+        self._bin_index = 0
+        self._current: _Block | None = None
+        self._spare: _Block | None = None
+        self._refill: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.stats = {"allocated": 0, "blocks_reserved": 0, "sync_reservations": 0, "remaining": 0}
+
+    @staticmethod
+    def capacity(bin_: str) -> int:
+        return 10 ** (PAN_LENGTH - 1 - len(bin_))
+
+    @classmethod
+    def format_pan(cls, bin_: str, value: int) -> str:
+        capacity = cls.capacity(bin_)
+        body = bin_ + str(value * SCRAMBLE_MULTIPLIER % capacity).zfill(PAN_LENGTH - 1 - len(bin_))
+        return body + luhn_check_digit(body)
+
+    async def allocate(self) -> str:
+        block = self._current
+        if block is None or block.remaining <= 0:
+            block = await self._next_block()
+        value = block.next
+        block.next += 1
+
+        self.stats["allocated"] += 1
+        self.stats["remaining"] = block.remaining
+        CARD_NUMBERS_ALLOCATED.inc(block.bin)
+        CARD_BLOCK_REMAINING.set(value=block.remaining)
+        self._maybe_prefetch(block)
+        return self.format_pan(block.bin, value)
+
+    async def warm_up(self) -> None:
+        """При старте: первый блок, чтобы и первый счет не ждал БД"""
+        if self._current is None:
+            await self._next_block()
+
+    async def _next_block(self) -> _Block:
+        async with self._lock:
+            if self._current is not None and self._current.remaining > 0:
+                return self._current
+            if self._refill is not None:
+                await self._refill
+            if self._spare is not None:
+                self._current, self._spare = self._spare, None
+            else:
+                self._current = await self._reserve("sync")
+                self.stats["sync_reservations"] += 1
+            return self._current
+
+    def _maybe_prefetch(self, block: _Block) -> None:
+        if self._spare is not None or self._refill is not None:
+            return
+        if block.remaining > self.block_size * PREFETCH_AT:
+            return
+        # Пустой контекст: запрос к БД не засчитывается в бюджет HTTP-запроса, который выдал номер
+        self._refill = asyncio.create_task(self._prefetch(), context=contextvars.Context())
+
+    async def _prefetch(self) -> None:
+        try:
+            self._spare = await self._reserve("prefetch")
+        except Exception as e:
+            print(f"Card Allocator Error: {e}")
+        finally:
+            self._refill = None
+
+    async def _reserve(self, mode: str) -> _Block:
+        while self._bin_index < len(self.bins):
+            bin_ = self.bins[self._bin_index]
+            # Своя транзакция: откат запроса, выдавшего номер, не вернет блок в последовательность
+            async with engine.begin() as conn:
+                end = (await conn.execute(RESERVE_SQL, {"bin": bin_, "block_size": self.block_size})).scalar_one()
+            start, end = end - self.block_size, min(end, self.capacity(bin_))
+            if start < end:
+                self.stats["blocks_reserved"] += 1
+                CARD_BLOCKS_RESERVED.inc(bin_, mode)
+                return _Block(bin=bin_, next=start, end=end)
+            self._bin_index += 1
+        raise CardNumbersExhausted()
+
+
+card_allocator = CardAllocator(settings.CARD_BIN_RANGES, settings.CARD_BLOCK_SIZE)
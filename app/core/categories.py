@@ -0,0 +1,96 @@
+"""
+Нормализованные категории операций.
+
+Transaction.category остается человекочитаемым текстом для истории, а для аналитики
+каждая проводка получает category_id (small int) и, где есть, provider/merchant.
+Список совпадает с сидом таблицы transaction_categories (миграция add_spending_analytics):
+id менять нельзя, новые категории — только добавлять.
+
+kind: expense — траты, income — поступления, internal — перемещение своих денег (вклады).
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Category:
+    id: int
+    code: str
+    name: str
+    kind: str
+
+
+CATEGORIES = [
+    Category(1, "transfer_out", "Переводы", "expense"),
+    Category(2, "transfer_in", "Поступления от клиентов", "income"),
+    Category(3, "external_transfer", "Переводы в другие банки", "expense"),
+    Category(4, "topup", "Пополнения", "income"),
+    Category(5, "mobile", "Мобильная связь", "expense"),
+    Category(6, "utilities", "Коммунальные услуги", "expense"),
+    Category(7, "transport", "Транспорт", "expense"),
+    Category(8, "internet", "Интернет и ТВ", "expense"),
+    Category(9, "education", "Образование", "expense"),
+    Category(10, "tickets", "Билеты", "expense"),
+    Category(11, "shopping", "Покупки", "expense"),
+    Category(12, "entertainment", "Развлечения и подписки", "expense"),
+    Category(13, "fines", "Штрафы", "expense"),
+    Category(14, "other", "Другое", "expense"),
+    Category(15, "eco", "Eco Tree", "expense"),
+    Category(16, "ortak", "Ortak", "expense"),
+    Category(17, "loan_payout", "Кредиты: зачисление", "income"),
+    Category(18, "loan_repayment", "Кредиты: погашение", "expense"),
+    Category(19, "deposit_open", "Вклады: открытие", "internal"),
+    Category(20, "deposit_close", "Вклады: закрытие", "internal"),
+    Category(21, "insurance", "Страхование", "expense"),
+    Category(22, "deposit_interest", "Вклады: проценты", "income"),
+]
+BY_ID = {c.id: c for c in CATEGORIES}
+BY_CODE = {c.code: c for c in CATEGORIES}
+
+TRANSFER_OUT = BY_CODE["transfer_out"].id
+TRANSFER_IN = BY_CODE["transfer_in"].id
+EXTERNAL_TRANSFER = BY_CODE["external_transfer"].id
+TOPUP = BY_CODE["topup"].id
+OTHER = BY_CODE["other"].id
+LOAN_PAYOUT = BY_CODE["loan_payout"].id
+LOAN_REPAYMENT = BY_CODE["loan_repayment"].id
+DEPOSIT_OPEN = BY_CODE["deposit_open"].id
+DEPOSIT_CLOSE = BY_CODE["deposit_close"].id
+INSURANCE = BY_CODE["insurance"].id
+DEPOSIT_INTEREST = BY_CODE["deposit_interest"].id
+
+# Поле details, из которого берется provider / merchant для каждой услуги
+_SERVICE_PROVIDER_FIELDS = {
+    "mobile": "operator",
+    "utilities": "service_type",
+    "transport": "city",
+    "internet": "provider",
+    "education": "university",
+    "tickets": "ticket_service",
+    "entertainment": "service",
+}
+_SERVICE_MERCHANT_FIELDS = {
+    "shopping": "shop",
+    "other": "category",
+}
+_MAX_LABEL = 64
+
+
+def service_category(provider_code: str) -> int:
+    """Код провайдера услуги (app/core/settlement.py) -> category_id"""
+    category = BY_CODE.get(provider_code)
+    return category.id if category else OTHER
+
+
+def _label(value) -> str | None:
+    if not value:
+        return None
+    return str(value).strip().lower().replace(" ", "_")[:_MAX_LABEL] or None
+
+
+def service_counterparty(provider_code: str, details: dict) -> tuple[str | None, str | None]:
+    """(provider, merchant) для аналитики из details платежа"""
+    provider_field = _SERVICE_PROVIDER_FIELDS.get(provider_code)
+    merchant_field = _SERVICE_MERCHANT_FIELDS.get(provider_code)
+    provider = _label(details.get(provider_field)) if provider_field else None
+    merchant = _label(details.get(merchant_field)) if merchant_field else None
+    return provider, merchant
@@ -0,0 +1,34 @@
+"""
+Источник текущего времени для фоновых задач.
+
+Задачи получают clock параметром и передают clock.now() в SQL как :now вместо now(),
+поэтому их можно прогонять на фиксированном или сдвигаемом времени (FakeClock).
+"""
+from datetime import datetime, timedelta, timezone
+
+
+class SystemClock:
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+
+class FakeClock:
+    """Время стоит на месте, пока его не сдвинуть: clock.advance(days=31)"""
+
+    def __init__(self, start: datetime | None = None):
+        self._now = start or datetime.now(timezone.utc)
+        if self._now.tzinfo is None:
+            self._now = self._now.replace(tzinfo=timezone.utc)
+
+    def now(self) -> datetime:
+        return self._now
+
+    def advance(self, **delta) -> datetime:
+        self._now += timedelta(**delta)
+        return self._now
+
+    def set(self, moment: datetime) -> None:
+        self._now = moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+system_clock = SystemClock()
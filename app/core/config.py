@@ -12,13 +12,118 @@ class Settings(BaseSettings):
     DB_PORT: str | None = None
     DB_NAME: str | None = None
 
+    # --- ПУЛ СОЕДИНЕНИЙ ---
+    DB_ECHO: bool = False  # Логировать каждый SQL (только для отладки!)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 10.0  # Секунды ожидания свободного соединения
+    DB_POOL_RECYCLE: int = 1800  # Пересоздавать соединения старше N секунд
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 500  # Кэш prepared statements asyncpg на соединение
+    DB_POOL_WARMUP: bool = True  # Открыть пул и подготовить горячие запросы при старте
+
+    # --- БЮДЖЕТЫ ЗАПРОСОВ (app/core/query_budget.py) ---
+    QUERY_BUDGET_MODE: str = "off"  # "off", "warn" (лог + метрика) или "strict" (исключение, для тестов)
+    QUERY_REPEAT_LIMIT: int = 3  # Сколько раз один и тот же запрос может повториться за HTTP-запрос
+
     # --- ОСНОВНЫЕ ПЕРЕМЕННЫЕ ---
     SECRET_KEY: str = "dev_secret_key"  # Дефолт для локалки, в проде будет перезаписан
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # --- ПАРОЛИ (bcrypt) ---
+    BCRYPT_ROUNDS: int = 12  # При изменении старые хеши обновятся при следующем входе
+    PASSWORD_HASH_WORKERS: int = 4  # Потоков для bcrypt
+    PASSWORD_HASH_MAX_CONCURRENCY: int = 16  # Одновременно в работе + в очереди пула
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = 5.0  # Секунды ожидания слота, потом 503
+
+    # --- MFA (одноразовые коды) ---
+    OTP_STORE: str = "memory"  # "memory" (один воркер) или "postgres" (общий для всех воркеров)
+    OTP_TTL_SECONDS: int = 300
+    OTP_MAX_ATTEMPTS: int = 5  # После стольких неверных вводов код сгорает
+    OTP_STORE_CAPACITY: int = 100000  # Только для memory: больше — вытесняются старые
+    OTP_PURGE_INTERVAL_SECONDS: float = 60.0  # Только для postgres: очистка просроченных
+
+    # --- УВЕДОМЛЕНИЯ (outbox + диспетчер) ---
+    TELEGRAM_BOT_TOKEN: str = ""  # Если пусто — уведомления только печатаются в консоль
+    TELEGRAM_API_URL: str = "https://api.telegram.org"  # Для тестов — benchmarks/telegram_stub.py
+    NOTIFY_INTERVAL_SECONDS: float = 1.0
+    NOTIFY_BATCH_SIZE: int = 100
+    NOTIFY_CONCURRENCY: int = 10  # Одновременных отправок
+    NOTIFY_TIMEOUT_SECONDS: float = 5.0  # На одну отправку
+    NOTIFY_LEASE_MARGIN_SECONDS: float = 15.0  # Запас аренды сверх максимального времени отправки пачки
+    NOTIFY_MAX_ATTEMPTS: int = 8  # Потом status = 'dead'
+    NOTIFY_RETRY_BASE_DELAY: float = 2.0  # Секунды, удваивается на каждой попытке
+    NOTIFY_RETRY_MAX_DELAY: float = 600.0
+    NOTIFY_RETENTION_SECONDS: int = 86400  # Сколько хранить отправленные
+    NOTIFY_PURGE_INTERVAL_SECONDS: float = 600.0
+
+    # --- ИДЕМПОТЕНТНОСТЬ (заголовок Idempotency-Key) ---
+    IDEMPOTENCY_TTL_SECONDS: int = 86400  # Сколько повтор с тем же ключом вернет сохраненный ответ
+    IDEMPOTENCY_CACHE_SIZE: int = 10000  # LRU процесса перед запросом в idempotency_keys
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = 600.0
+
+    # --- КЭШ АУТЕНТИФИКАЦИИ ---
+    AUTH_CACHE_MAXSIZE: int = 10000
+    AUTH_CACHE_TTL_SECONDS: int = 60  # Сколько живет снимок пользователя без обращения к БД
+    PHONE_DEFAULT_REGION: str = "KZ"  # Регион для номеров без кода страны (app/core/phones.py)
+
+    # --- НОМЕРА КАРТ (app/core/cards.py) ---
+    CARD_BIN_RANGES: list[str] = ["440000"]  # По порядку; старые карты — 4000*, с ними не пересекаться
+    CARD_BLOCK_SIZE: int = 1000  # Номеров, которые процесс резервирует за один запрос к БД
+
+    # --- ПЕРЕВОДЫ ---
+    TRANSFER_MAX_RETRIES: int = 5  # Повторы при serialization failure / deadlock
+    TRANSFER_RETRY_BASE_DELAY: float = 0.01  # Секунды, удваивается на каждой попытке
+    BATCH_TRANSFER_MAX_ITEMS: int = 5000  # Строк в одном /transfers/batch
+
+    # --- РАСЧЕТЫ С ПРОВАЙДЕРАМИ УСЛУГ ---
+    SETTLEMENT_SHARDS: int = 8  # Под-счетов на одного провайдера
+    SETTLEMENT_INTERVAL_SECONDS: float = 5.0  # Как часто неттинг зачисляет накопленное
+    SETTLEMENT_BATCH_SIZE: int = 5000
+    # accounts.balance — Numeric(10, 2), до ~100 млн: шард, дошедший до порога, неттинг выводит в settlement_sweeps
+    SETTLEMENT_SWEEP_AT: int = 50_000_000
+
+    # --- АНАЛИТИКА ТРАТ ---
+    ANALYTICS_TIMEZONE: str = "Asia/Almaty"  # Границы месяца в свертках spending_rollups
+
+    # --- ВЫПИСКИ (/transactions/export) ---
+    STATEMENT_FETCH_SIZE: int = 1000  # Строк за одну выборку серверного курсора
+    STATEMENT_PDF_MAX_ROWS: int = 5000  # PDF строится в памяти; длиннее — только CSV / NDJSON
+    STATEMENT_PDF_WORKERS: int = 2  # Процессов для weasyprint
+    STATEMENT_PDF_TIMEOUT: float = 60.0
+
+    # --- ПЛАНОВЫЕ СПИСАНИЯ (автоплатеж кредитов, ежемесячная страховка) ---
+    SCHEDULER_INTERVAL_SECONDS: float = 60.0
+    SCHEDULER_BATCH_SIZE: int = 500  # Позиций за одну транзакцию
+    AUTOPAY_RETRY_SECONDS: int = 86400  # Не хватило денег — следующая попытка через сутки
+    INSURANCE_BILLING_PERIOD_DAYS: int = 30  # Как и срок полиса при оформлении (30 дней на месяц)
+    INSURANCE_GRACE_SECONDS: int = 7 * 86400  # Сколько полис ждет оплату после срока, потом прекращается
+    INSURANCE_EXPIRY_INTERVAL_SECONDS: float = 300.0
+    INSURANCE_EXPIRY_BATCH_SIZE: int = 1000  # Полисов на один UPDATE
+
+    # --- ВКЛАДЫ: НАЧИСЛЕНИЕ ПРОЦЕНТОВ И ОКОНЧАНИЕ СРОКА ---
+    DEPOSIT_ACCRUAL_INTERVAL_SECONDS: float = 3600.0  # Проценты растут раз в сутки; чаще — только догнать после простоя
+    DEPOSIT_ACCRUAL_CHUNK_SIZE: int = 50_000  # Вкладов на одну выборку / один UPDATE
+
+    # --- ФОНОВЫЕ ЗАДАЧИ ---
+    BACKGROUND_JOBS_ENABLED: bool = True  # Отключить, если задачи крутятся в отдельном процессе
+
     GROQ_API_KEY: str = ""  # Если пусто, то просто не будет работать AI, но приложение запустится
 
+    # --- AI ПРОВАЙДЕР ---
+    AI_PROVIDER: str = "groq"  # "groq" или "stub" (локальная заглушка для тестов)
+    AI_CHAT_MODEL: str = "llama-3.1-8b-instant"
+    AI_TRANSCRIBE_MODEL: str = "whisper-large-v3"
+    AI_TIMEOUT_SECONDS: float = 15.0  # На один вызов, включая ожидание слота
+    AI_MAX_CONCURRENCY: int = 8  # Одновременных вызовов провайдера на процесс
+    AI_BREAKER_FAILURES: int = 5  # Ошибок подряд до размыкания
+    AI_BREAKER_RESET_SECONDS: float = 30.0  # Через сколько пробуем снова
+    AI_STUB_LATENCY: float = 0.0
+    AI_STUB_FAILURE_RATE: float = 0.0
+    AI_CACHE_SIZE: int = 2048  # Записей в кэше ответов и в кэше распознавания
+    AI_VOICE_MAX_BYTES: int = 10 * 1024 * 1024  # Максимальный размер голосового сообщения
+
     # --- ГЛАВНАЯ ПЕРЕМЕННАЯ (Для продакшена/Railway) ---
     # Если Railway предоставит эту переменную, мы будем использовать её.
     # Если нет (локально), мы соберем её сами из кусков выше.
@@ -0,0 +1,46 @@
+"""
+Начисление процентов по вкладам: actual/365, простые проценты от даты открытия.
+
+Считается сразу весь объем за срок, а не прирост за день: accrued = amount * rate * days / 365,
+где days — полные дни с start_date до min(сейчас, end_date). Повторный прогон за тот же день
+дает тот же результат, пропущенный день догоняется сам, ошибки округления не копятся.
+
+Расчет целочисленный (копейки, ставка в 1/10000), поэтому numpy-версия для пачек
+(app/jobs/deposits.py) и скалярная для одного вклада совпадают до копейки.
+Округление — половина вверх.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+DAYS_IN_YEAR = 365
+SECONDS_IN_DAY = 86400
+RATE_SCALE = 10_000  # Numeric(5, 4): ставка хранится с точностью до 0.0001
+_DENOMINATOR = RATE_SCALE * DAYS_IN_YEAR
+CENT = Decimal("0.01")
+
+
+def accrue(amount_kopecks: np.ndarray, rate_units: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """Проценты в копейках для пачки вкладов; все массивы int64 одной длины"""
+    # Сумма до 10^10 коп., ставка до 10^4, срок до ~2*10^3 дней — в int64 помещается с запасом
+    numerator = amount_kopecks * rate_units * days
+    return (2 * numerator + _DENOMINATOR) // (2 * _DENOMINATOR)
+
+
+def elapsed_days(start_s: np.ndarray, end_s: np.ndarray, as_of_s: int) -> np.ndarray:
+    """Полные дни от открытия до момента as_of (не дальше окончания срока); время в секундах epoch"""
+    until = np.minimum(end_s, as_of_s)
+    return np.maximum(until - start_s, 0) // SECONDS_IN_DAY
+
+
+def interest_for(amount: Decimal, rate: Decimal, days: int) -> Decimal:
+    """То же для одного вклада — в тенге, два знака после запятой"""
+    kopecks = int(amount * 100)
+    rate_units = int(rate * RATE_SCALE)
+    numerator = kopecks * rate_units * max(days, 0)
+    return (Decimal((2 * numerator + _DENOMINATOR) // (2 * _DENOMINATOR)) / 100).quantize(CENT)
+
+
+def days_between(start: datetime, moment: datetime) -> int:
+    return max(int((moment - start).total_seconds()) // SECONDS_IN_DAY, 0)
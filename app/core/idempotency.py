@@ -0,0 +1,149 @@
+"""
+Идемпотентность денежных операций (заголовок Idempotency-Key).
+
+Мобильный клиент на плохой сети повторяет запрос с тем же ключом — проводка не должна задвоиться.
+1. До любой работы ключ ищется в LRU процесса, потом в idempotency_keys.
+   Нашелся — возвращаем сохраненный ответ (заголовок Idempotent-Replayed: true) и больше ничего не делаем.
+2. Ответ пишется в idempotency_keys в той же транзакции, что и проводка
+   (INSERT ... ON CONFLICT по первичному ключу (scope, key): истекшая, но еще не удаленная строка
+   перезаписывается, живая остается как есть).
+   Если параллельный запрос с тем же ключом закоммитил первым, вставка ничего не вернет —
+   IdempotencyConflict, наша проводка откатывается, клиент получает ответ первого.
+3. Ключ живет IDEMPOTENCY_TTL_SECONDS, потом строку удаляет app/jobs/idempotency.py.
+
+Сохраняются только успешные ответы: ошибка (например, нехватка средств) ничего не записала,
+и повтор честно выполнится заново. Сохраненные ответы не меняются, поэтому LRU не устаревает.
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from cachetools import LRUCache
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import IdempotencyKey
+
+
+class IdempotencyConflict(Exception):
+    """Ключ уже записал параллельный запрос — текущую транзакцию нужно откатить"""
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: dict
+    expires_at: datetime
+
+
+_cache: LRUCache = LRUCache(maxsize=settings.IDEMPOTENCY_CACHE_SIZE)
+
+
+def fingerprint(payload) -> str:
+    """Тот же ключ с другим телом запроса — ошибка клиента, а не повтор"""
+    canonical = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class IdempotencyGuard:
+    """
+    guard = IdempotencyGuard("transfers.p2p:<user_id>", idempotency_key, request)
+    if replay := await guard.replay(db): return replay
+    ... проводка; до коммита: await guard.save(session, body)
+    после коммита: guard.committed()
+    Без ключа все методы ничего не делают.
+    """
+
+    def __init__(self, scope: str, key: str | None, payload=None):
+        self.scope = scope
+        self.key = key or None
+        self.fingerprint = fingerprint(payload) if self.key else ""
+        self._pending: StoredResponse | None = None
+
+    async def replay(self, db: AsyncSession) -> JSONResponse | None:
+        if not self.key:
+            return None
+        stored = _cache.get((self.scope, self.key))
+        if stored is not None and stored.expires_at <= datetime.now(timezone.utc):
+            _cache.pop((self.scope, self.key), None)
+            stored = None
+
+        if stored is None:
+            q = select(
+                IdempotencyKey.fingerprint,
+                IdempotencyKey.status_code,
+                IdempotencyKey.response,
+                IdempotencyKey.expires_at,
+            ).where(
+                IdempotencyKey.scope == self.scope,
+                IdempotencyKey.key == self.key,
+                IdempotencyKey.expires_at > func.now(),
+            )
+            row = (await db.execute(q)).first()
+            if row is None:
+                return None
+            stored = StoredResponse(*row)
+            _cache[(self.scope, self.key)] = stored
+
+        if stored.fingerprint != self.fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key уже использован с другими параметрами")
+        return JSONResponse(
+            content=stored.body,
+            status_code=stored.status_code,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    async def save(self, db: AsyncSession, body: dict, status_code: int = 200) -> None:
+        """В транзакции проводки, до коммита; коммит делает вызывающий код"""
+        if not self.key:
+            return
+        body = jsonable_encoder(body)
+        stmt = pg_insert(IdempotencyKey).values(
+            scope=self.scope,
+            key=self.key,
+            fingerprint=self.fingerprint,
+            status_code=status_code,
+            response=body,
+            expires_at=func.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+        )
+        # Истекший ключ, который еще не удалила фоновая очистка, replay() не видит — его занимаем заново
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["scope", "key"],
+            set_={
+                "fingerprint": stmt.excluded.fingerprint,
+                "status_code": stmt.excluded.status_code,
+                "response": stmt.excluded.response,
+                "created_at": func.now(),
+                "expires_at": stmt.excluded.expires_at,
+            },
+            where=IdempotencyKey.expires_at <= func.now(),
+        ).returning(IdempotencyKey.expires_at)
+        expires_at = (await db.execute(stmt)).scalar_one_or_none()
+        if expires_at is None:
+            raise IdempotencyConflict()
+        self._pending = StoredResponse(self.fingerprint, status_code, body, expires_at)
+
+    def committed(self) -> None:
+        """После коммита: ближайшие повторы отвечаются из LRU, без БД"""
+        if self._pending is not None:
+            _cache[(self.scope, self.key)] = self._pending
+            self._pending = None
+
+    async def replay_after_conflict(self, db: AsyncSession) -> JSONResponse:
+        """Вызывать после отката транзакции, проигравшей гонку за ключ"""
+        self._pending = None
+        response = await self.replay(db)
+        if response is None:
+            raise HTTPException(status_code=409, detail="Запрос с этим Idempotency-Key уже обрабатывается")
+        return response
+
+
+def cache_stats() -> dict:
+    return {"size": len(_cache), "maxsize": _cache.maxsize}
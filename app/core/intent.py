@@ -0,0 +1,154 @@
+"""
+Локальный разбор простых команд перевода ("переведи 500 на 87471234567").
+
+Быстрый путь берет только фразы из белого списка: ровно один глагол перевода в повелительной
+форме (IMPERATIVE_VERBS), сумма цифрами (можно с "тг" / "₸" / "тенге"), один телефон и
+служебные слова из FILLER_WORDS. Любое другое слово — отрицание ("аударма", "не"), вопрос
+("переводил ли", "?"), другая валюта ("долларов"), сумма словами ("полторы тысячи"),
+передумывание ("передумал") — и фраза уходит в LLM: лучше лишний вызов модели, чем перевод,
+которого клиент не просил.
+
+Самопроверка разбора: python -m app.core.intent
+"""
+import re
+from dataclasses import dataclass
+
+# Только утвердительные повелительные формы; "аударма", "жіберме", "аудармаңыз" сюда не попадают
+IMPERATIVE_VERBS = {
+    "переведи", "переведите", "перекинь", "перекиньте", "отправь", "отправьте",
+    "скинь", "скиньте", "закинь", "закиньте", "кинь", "киньте",
+    "аудар", "аударшы", "аударыңыз", "жібер", "жіберші", "жіберіңіз", "жiбер",
+}
+FILLER_WORDS = {
+    "на", "номер", "номеру", "по", "пожалуйста",
+    "нөмір", "нөмірге", "нөміріне", "нөмерге", "өтінемін",
+}
+CURRENCY_WORDS = {"тенге", "тг", "₸", "теңге", "kzt"}
+MAX_AMOUNT_DIGITS = 9
+
+_SPACES_RE = re.compile(r"\s+")
+# Телефон в любом привычном написании: 87471234567, +7 (747) 123-45-67, 747 123 45 67
+_PHONE_RE = re.compile(r"(?<![\d+])(?:\+?[78][\s\-]*)?\(?\d{3}\)?[\s\-]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}(?!\d)")
+_TOKEN_RE = re.compile(r"#p|\d+|[^\W\d_]+|₸", re.UNICODE)
+# Между словами допускаются только пробелы и запятые; "$", "%", "?" и т.п. — в LLM
+_GAPS_RE = re.compile(r"[\s,:]*")
+
+
+@dataclass(frozen=True)
+class TransferIntent:
+    amount: int
+    phone: str
+
+    def as_response(self) -> dict:
+        return {
+            "reply": f"Хорошо, перевожу {self.amount} тенге на номер {self.phone}.",
+            "action": "transfer",
+            "data": {"amount": self.amount, "phone": self.phone},
+        }
+
+
+def normalize_text(text: str) -> str:
+    text = text.lower().replace("ё", "е").strip(" \t\n.!?")
+    return _SPACES_RE.sub(" ", text)
+
+
+def normalize_phone(digits: str) -> str | None:
+    """Приводит номер к формату 8XXXXXXXXXX (как ждет фронтенд и промпт)"""
+    digits = re.sub(r"\D", "", digits)
+    if len(digits) == 11 and digits[0] in "78":
+        return "8" + digits[1:]
+    if len(digits) == 10 and digits[0] == "7":
+        return "8" + digits
+    return None
+
+
+def parse_transfer(text: str) -> TransferIntent | None:
+    if "?" in text:
+        return None
+    text = normalize_text(text)
+
+    phones: list[str] = []
+
+    def mark(m: re.Match) -> str:
+        phones.append(normalize_phone(m.group(0)) or "")
+        return " #p "
+
+    marked = _PHONE_RE.sub(mark, text)
+    if len(phones) != 1 or not phones[0]:
+        return None
+    if not _GAPS_RE.fullmatch(_TOKEN_RE.sub(" ", marked)):
+        return None
+
+    verbs, amounts = 0, []
+    for tok in _TOKEN_RE.findall(marked):
+        if tok.isdigit():
+            amounts.append(tok)
+        elif tok in IMPERATIVE_VERBS:
+            verbs += 1
+        elif tok != "#p" and tok not in FILLER_WORDS and tok not in CURRENCY_WORDS:
+            return None
+
+    # Ровно одна сумма одной группой цифр: "5 5" или "5 000" — неоднозначно
+    if verbs != 1 or len(amounts) != 1 or len(amounts[0]) > MAX_AMOUNT_DIGITS:
+        return None
+    amount = int(amounts[0])
+    if amount <= 0:
+        return None
+    return TransferIntent(amount=amount, phone=phones[0])
+
+
+# Фраза -> ожидаемый результат; прогоняется self_check()
+_OK = TransferIntent(amount=500, phone="87471234567")
+SELF_CHECKS = [
+    ("переведи 500 на 87471234567", _OK),
+    ("Переведи 500 тг на +7 (747) 123-45-67.", _OK),
+    ("скинь 500₸ на 7471234567", _OK),
+    ("87471234567 нөміріне 500 теңге аудар", _OK),
+    ("аударыңыз 500 теңге 87471234567", _OK),
+    ("отправь 15000 на 8 747 123 45 67", TransferIntent(amount=15000, phone="87471234567")),
+    # Отрицание
+    ("не переводи 500 на 87471234567", None),
+    ("переведи 500 маме на 87471234567 не переводи", None),
+    ("87471234567 нөміріне 500 теңге аударма", None),
+    ("87471234567 бес жүз теңге жіберме", None),
+    ("аудармаңыз 500 теңге 87471234567", None),
+    ("87471234567 нөміріне 500 аударма емес", None),
+    # Отмена / передумал
+    ("переведи 500 на 87471234567, нет, отмена", None),
+    ("отмена перевода 500 на 87471234567", None),
+    ("переведи 500 на 87471234567, передумал", None),
+    # Вопросы
+    ("переводил ли я 500 на 87471234567", None),
+    ("перевод 500 на 87471234567 был вчера?", None),
+    ("сколько я перевел в этом месяце", None),
+    # Неоднозначная сумма
+    ("переведи полторы тысячи на 87471234567", None),
+    ("переведи пару тысяч на 87471234567", None),
+    ("переведи 5 5 на 87471234567", None),
+    ("переведи 500 долларов на 87471234567", None),
+    ("переведи 500$ на 87471234567", None),
+    ("отправь 5к на 87471234567", None),
+    ("переведи 500 или 600 на 87471234567", None),
+    ("переведи 0 на 87471234567", None),
+    # Телефон
+    ("переведи 500 на 87471234567 и 87011234567", None),
+    ("переведи 500 на 4400123412341234", None),
+]
+
+
+def self_check() -> list[str]:
+    """Список расхождений; пустой — разбор ведет себя как ожидается"""
+    failures = []
+    for phrase, expected in SELF_CHECKS:
+        actual = parse_transfer(phrase)
+        if actual != expected:
+            failures.append(f"{phrase!r}: expected {expected}, got {actual}")
+    return failures
+
+
+if __name__ == "__main__":
+    problems = self_check()
+    for problem in problems:
+        print(problem)
+    print(f"{len(SELF_CHECKS) - len(problems)}/{len(SELF_CHECKS)} ok")
+    raise SystemExit(1 if problems else 0)
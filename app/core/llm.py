@@ -0,0 +1,201 @@
+"""
+Слой AI-провайдера для /ai.
+
+- LLMProvider — асинхронный интерфейс (чат с JSON-ответом и распознавание речи)
+- GroqProvider — реальный провайдер (AsyncGroq, не блокирует event loop)
+- StubProvider — локальная заглушка для тестов и нагрузочных прогонов без сети
+- ResilientProvider — обертка: таймаут на вызов, лимит одновременных вызовов,
+  circuit breaker (при серии ошибок сразу отдаем запасной ответ, не ждем провайдера)
+"""
+import asyncio
+import json
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import IO
+
+from app.core.config import settings
+from app.core.metrics import track_external
+
+
+class LLMUnavailable(Exception):
+    """Провайдер не ответил: таймаут, ошибка, перегрузка или открыт breaker"""
+
+
+class LLMProvider(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def chat_json(self, system_prompt: str, user_text: str) -> str:
+        """Возвращает сырой JSON-ответ модели"""
+
+    @abstractmethod
+    async def transcribe(self, filename: str, audio: IO[bytes]) -> str:
+        """Возвращает распознанный текст (audio — файловый объект, читается провайдером без копий)"""
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, api_key: str):
+        from groq import AsyncGroq
+
+        # Таймауты и повторы делает ResilientProvider, здесь их отключаем
+        self.client = AsyncGroq(api_key=api_key, max_retries=0)
+
+    async def chat_json(self, system_prompt: str, user_text: str) -> str:
+        chat_completion = await self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_text}
+            ],
+            model=settings.AI_CHAT_MODEL,
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
+        return chat_completion.choices[0].message.content
+
+    async def transcribe(self, filename: str, audio: IO[bytes]) -> str:
+        transcription = await self.client.audio.transcriptions.create(
+            file=(filename, audio),
+            model=settings.AI_TRANSCRIBE_MODEL,
+            response_format="json",
+            language="ru"  # Или auto
+        )
+        return transcription.text
+
+
+class StubProvider(LLMProvider):
+    """
+    Офлайн-заглушка. Латентность и доля ошибок настраиваются,
+    чтобы проверять таймауты и breaker без реального провайдера.
+    """
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    async def _simulate(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("stub provider failure")
+
+    async def chat_json(self, system_prompt: str, user_text: str) -> str:
+        await self._simulate()
+        return json.dumps({"action": None, "reply": f"Заглушка: {user_text}"}, ensure_ascii=False)
+
+    async def transcribe(self, filename: str, audio: IO[bytes]) -> str:
+        await self._simulate()
+        # Для тестов "аудио" можно передавать обычным текстом в UTF-8
+        return audio.read().decode("utf-8", errors="ignore")
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold ошибок подряд) -> open
+    open -> (через reset_timeout) -> half_open: пропускаем один пробный вызов
+    half_open -> успех -> closed, ошибка -> open, отмена пробы -> следующий вызов снова пробный
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = self.clock()
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Пробный вызов отменен (клиент отключился): ни успех, ни ошибка — пропускаем следующий"""
+        self._probe_in_flight = False
+
+
+class ResilientProvider(LLMProvider):
+    def __init__(self, inner: LLMProvider, timeout: float, max_concurrency: int, breaker: CircuitBreaker):
+        self.inner = inner
+        self.name = inner.name
+        self.timeout = timeout
+        self.breaker = breaker
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0}
+
+    async def _call(self, method: str, *args):
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise LLMUnavailable("circuit open")
+
+        self.stats["calls"] += 1
+        try:
+            # Ожидание слота тоже входит в бюджет времени вызова
+            async with asyncio.timeout(self.timeout):
+                async with self._slots:
+                    with track_external(self.name):
+                        result = await getattr(self.inner, method)(*args)
+        except asyncio.CancelledError:
+            # BaseException: иначе проба в half_open так и осталась бы "в полете", и предохранитель
+            # отклонял бы все вызовы до перезапуска
+            self.breaker.release_probe()
+            raise
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            raise LLMUnavailable("timeout")
+        except Exception as e:
+            self.stats["failures"] += 1
+            self.breaker.record_failure()
+            raise LLMUnavailable(str(e)) from e
+
+        self.breaker.record_success()
+        return result
+
+    async def chat_json(self, system_prompt: str, user_text: str) -> str:
+        return await self._call("chat_json", system_prompt, user_text)
+
+    async def transcribe(self, filename: str, audio: IO[bytes]) -> str:
+        return await self._call("transcribe", filename, audio)
+
+
+def build_provider() -> ResilientProvider:
+    if settings.AI_PROVIDER == "stub":
+        inner = StubProvider(latency=settings.AI_STUB_LATENCY, failure_rate=settings.AI_STUB_FAILURE_RATE)
+    else:
+        inner = GroqProvider(api_key=settings.GROQ_API_KEY)
+
+    return ResilientProvider(
+        inner,
+        timeout=settings.AI_TIMEOUT_SECONDS,
+        max_concurrency=settings.AI_MAX_CONCURRENCY,
+        breaker=CircuitBreaker(
+            failure_threshold=settings.AI_BREAKER_FAILURES,
+            reset_timeout=settings.AI_BREAKER_RESET_SECONDS,
+        ),
+    )
+
+
+llm = build_provider()
@@ -0,0 +1,336 @@
+"""
+Метрики процесса в формате Prometheus (text exposition).
+
+- Histogram / Counter / Gauge — семейства с метками, память ограничена:
+  у гистограммы фиксированный набор бакетов, метки маршрута — это шаблон пути
+  ("/loans/{loan_id}/pay"), а не сырой URL
+- MetricsMiddleware — чистый ASGI: латентность по маршрутам, запросы в работе,
+  число SQL-запросов и время в БД на запрос
+- install_db_hooks — события SQLAlchemy before/after_cursor_execute
+- track_external — замер внешних вызовов (Groq, Telegram)
+- record_queries — ручной замер запросов (тесты, benchmarks/query_budgets.py)
+"""
+import time
+from bisect import bisect_left
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.core.query_budget import budget_for, enforce
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+# Опоздание фоновых списаний: от секунд до недели
+LAG_BUCKETS = (1, 10, 60, 300, 900, 3600, 4 * 3600, 86400, 3 * 86400, 7 * 86400)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, *label_values, value: float) -> None:
+        self._values[label_values] = value
+
+    def dec(self, *label_values, amount: float = 1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счетчики по бакетам..., +Inf, sum]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, *label_values, value: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.label_names, key)
+            inf = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> list[str]:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return lines
+
+
+def render_stats(prefix: str, stats: dict, help_text: str) -> list[str]:
+    """Экспорт готовых словарей-счетчиков (auth_cache.stats, llm.stats, ...) как gauge"""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+    return lines
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Время обработки запроса", ("method", "route"),
+))
+REQUESTS_TOTAL = registry.register(Counter(
+    "http_requests_total", "Количество запросов", ("method", "route", "status"),
+))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "Запросов в работе сейчас",
+))
+REQUEST_DB_STATEMENTS = registry.register(Histogram(
+    "http_request_db_statements", "SQL-запросов на один HTTP-запрос", ("route",), buckets=COUNT_BUCKETS,
+))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Суммарное время в БД на один HTTP-запрос", ("route",),
+))
+REQUEST_EXTERNAL_SECONDS = registry.register(Histogram(
+    "http_request_external_seconds", "Время внешних вызовов на один HTTP-запрос", ("route", "service"),
+))
+DB_STATEMENT_SECONDS = registry.register(Histogram(
+    "db_statement_duration_seconds", "Время одного SQL-запроса",
+))
+EXTERNAL_CALL_SECONDS = registry.register(Histogram(
+    "external_call_duration_seconds", "Время одного внешнего вызова", ("service", "outcome"),
+))
+QUERY_BUDGET_VIOLATIONS = registry.register(Counter(
+    "query_budget_violations_total", "Превышения бюджета запросов и N+1", ("route",),
+))
+SCHEDULER_ITEMS = registry.register(Counter(
+    "scheduler_items_total", "Обработано плановых списаний", ("job", "result"),
+))
+SCHEDULER_LAG_SECONDS = registry.register(Histogram(
+    "scheduler_lag_seconds", "Опоздание списания относительно срока", ("job",), buckets=LAG_BUCKETS,
+))
+SCHEDULER_RUN_SECONDS = registry.register(Histogram(
+    "scheduler_run_duration_seconds", "Длительность прогона фоновой задачи", ("job",),
+))
+SCHEDULER_THROUGHPUT = registry.register(Gauge(
+    "scheduler_items_per_second", "Пропускная способность последнего прогона", ("job",),
+))
+CARD_NUMBERS_ALLOCATED = registry.register(Counter(
+    "card_numbers_allocated_total", "Выдано номеров карт", ("bin",),
+))
+CARD_BLOCKS_RESERVED = registry.register(Counter(
+    "card_number_blocks_reserved_total", "Зарезервировано блоков номеров (prefetch — фоном, sync — в запросе)",
+    ("bin", "mode"),
+))
+CARD_BLOCK_REMAINING = registry.register(Gauge(
+    "card_number_block_remaining", "Номеров осталось в текущем блоке процесса",
+))
+
+
+@dataclass
+class RequestStats:
+    db_statements: int = 0
+    db_seconds: float = 0.0
+    external_seconds: dict[str, float] = field(default_factory=dict)
+    shapes: StatementCounter | None = None  # Текст запроса -> сколько раз (только при проверке бюджетов)
+    route: str | None = None
+    violations: list[str] = field(default_factory=list)
+
+
+def _new_request_stats() -> RequestStats:
+    if settings.QUERY_BUDGET_MODE == "off":
+        return RequestStats()
+    return RequestStats(shapes=StatementCounter())
+
+
+# Объект мутируется, а не переустанавливается — поэтому изменения видны из
+# greenlet-ов SQLAlchemy и дочерних задач, унаследовавших контекст
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+@contextmanager
+def record_queries():
+    """
+    with record_queries() as stats: await client.get(...)
+    Запрос внутри использует этот же объект, поэтому после выхода видно
+    stats.db_statements, stats.shapes и найденные нарушения бюджета.
+    """
+    stats = RequestStats(shapes=StatementCounter())
+    token = current_request.set(stats)
+    try:
+        yield stats
+    finally:
+        current_request.reset(token)
+
+
+@contextmanager
+def track_external(service: str):
+    """with track_external("groq"): await ... — работает и в sync, и в async коде"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_CALL_SECONDS.observe(service, outcome, value=elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.external_seconds[service] = stats.external_seconds.get(service, 0.0) + elapsed
+
+
+_SAVEPOINT_PREFIXES = ("SAVEPOINT ", "RELEASE SAVEPOINT ", "ROLLBACK TO SAVEPOINT ")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    if statement.startswith(_SAVEPOINT_PREFIXES):
+        return  # Savepoint-ы появляются только в тестовой обвязке (сессия внутри внешней транзакции)
+    DB_STATEMENT_SECONDS.observe(value=elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.db_statements += 1
+        stats.db_seconds += elapsed
+        if stats.shapes is not None:
+            stats.shapes[statement] += 1
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def install_db_hooks(sync_engine) -> None:
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """Чистый ASGI (без BaseHTTPMiddleware), чтобы не ломать стриминг и контекст"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # Если снаружи уже идет замер (record_queries), пишем в него
+        stats = current_request.get()
+        token = None
+        if stats is None:
+            stats = _new_request_stats()
+            token = current_request.set(stats)
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUESTS_IN_FLIGHT.dec()
+            if token is not None:
+                current_request.reset(token)
+
+            # Шаблон пути роутер кладет в scope; 404 и прочее — в одну корзину
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+
+            REQUEST_LATENCY.observe(method, route_path, value=elapsed)
+            REQUESTS_TOTAL.inc(method, route_path, str(status))
+            REQUEST_DB_STATEMENTS.observe(route_path, value=stats.db_statements)
+            REQUEST_DB_SECONDS.observe(route_path, value=stats.db_seconds)
+            for service, seconds in stats.external_seconds.items():
+                REQUEST_EXTERNAL_SECONDS.observe(route_path, service, value=seconds)
+
+            stats.route = route_path
+            if stats.shapes is not None and route is not None:
+                violations = enforce(route_path, budget_for(route), stats.db_statements, stats.shapes)
+                if violations:
+                    QUERY_BUDGET_VIOLATIONS.inc(route_path)
+                    stats.violations.extend(violations)
@@ -0,0 +1,82 @@
+"""
+Уведомления через transactional outbox.
+
+Обработчик запроса только пишет строку в notification_outbox — в той же транзакции,
+что и само событие (перевод, выдача кредита, оплата). Если транзакция откатилась,
+уведомления нет; если закоммитилась — его отправит диспетчер (app/jobs/notifications.py).
+Время ответа Telegram на время ответа API больше не влияет.
+
+Сообщение уходит в личный чат получателя (users.telegram_chat_id). Если чат не привязан,
+уведомление сразу становится dead: в квитанциях балансы и коды, общего чата для них нет.
+"""
+from abc import ABC, abstractmethod
+
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import track_external
+from app.db.models import NotificationOutbox
+
+
+class PermanentSendError(Exception):
+    """Повтор не поможет (например, 400 от Telegram) — сразу в dead"""
+
+
+async def enqueue_notifications(db: AsyncSession, items: list[dict]) -> None:
+    """items: [{"user_id": ..., "kind": ..., "body": ...}]; коммит делает вызывающий код"""
+    if items:
+        await db.execute(insert(NotificationOutbox), items)
+
+
+async def enqueue_notification(db: AsyncSession, *, user_id: int | None, kind: str, body: str) -> None:
+    await enqueue_notifications(db, [{"user_id": user_id, "kind": kind, "body": body}])
+
+
+class NotificationSender(ABC):
+    @abstractmethod
+    async def send(self, chat_id: str | None, text: str) -> None:
+        """chat_id — users.telegram_chat_id получателя; бросает исключение при ошибке (PermanentSendError — без повторов)"""
+
+    async def aclose(self) -> None:
+        pass
+
+
+class LogSender(NotificationSender):
+    """Telegram не настроен — печатаем в консоль, как раньше печатались коды"""
+
+    async def send(self, chat_id: str | None, text: str) -> None:
+        print(f"Notification: {text}")
+
+
+class TelegramSender(NotificationSender):
+    def __init__(self, api_url: str, token: str, timeout: float, transport=None):
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self._client = httpx.AsyncClient(timeout=timeout, transport=transport)
+
+    async def send(self, chat_id: str | None, text: str) -> None:
+        if not chat_id:
+            raise PermanentSendError("telegram chat is not linked")
+        with track_external("telegram"):
+            response = await self._client.post(self.url, json={"chat_id": chat_id, "text": text})
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RuntimeError(f"telegram status {response.status_code}")
+        if response.status_code >= 400:
+            raise PermanentSendError(f"telegram status {response.status_code}: {response.text[:200]}")
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+def build_sender() -> NotificationSender:
+    if settings.TELEGRAM_BOT_TOKEN:
+        return TelegramSender(
+            api_url=settings.TELEGRAM_API_URL,
+            token=settings.TELEGRAM_BOT_TOKEN,
+            timeout=settings.NOTIFY_TIMEOUT_SECONDS,
+        )
+    return LogSender()
+
+
+sender = build_sender()
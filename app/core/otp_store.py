@@ -0,0 +1,120 @@
+"""
+Хранилище одноразовых кодов MFA.
+
+- MemoryOTPStore — в процессе: TTL и ограничение по количеству (для одного воркера и тестов)
+- PostgresOTPStore — общее для всех воркеров: UNLOGGED-таблица otp_codes
+  (без WAL — коды не переживут падение БД, и это нормально)
+
+Код хранится только как HMAC (ключ — SECRET_KEY), сравнение — hmac.compare_digest.
+Каждая попытка увеличивает счетчик; после OTP_MAX_ATTEMPTS код сгорает.
+"""
+import hashlib
+import hmac
+import time
+from abc import ABC, abstractmethod
+
+from cachetools import TTLCache
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.db.database import engine
+
+# Результаты проверки
+OTP_OK = "ok"
+OTP_MISSING = "missing"  # Не запрашивался или истек
+OTP_INVALID = "invalid"
+OTP_LOCKED = "locked"  # Исчерпаны попытки, код удален
+
+
+def hash_code(key: str, code: str) -> bytes:
+    message = f"{key}:{code}".encode("utf-8")
+    return hmac.new(settings.SECRET_KEY.encode("utf-8"), message, hashlib.sha256).digest()
+
+
+class OTPStore(ABC):
+    def __init__(self, ttl: float, max_attempts: int):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    async def issue(self, key: str, code: str) -> None:
+        """Сохраняет новый код (старый для этого ключа заменяется)"""
+
+    @abstractmethod
+    async def verify(self, key: str, code: str) -> str:
+        """OTP_OK / OTP_MISSING / OTP_INVALID / OTP_LOCKED; при OTP_OK код удаляется"""
+
+
+class MemoryOTPStore(OTPStore):
+    def __init__(self, ttl: float, max_attempts: int, capacity: int, timer=time.monotonic):
+        super().__init__(ttl, max_attempts)
+        # key -> [hash, попыток]; при переполнении вытесняются самые старые
+        self._codes = TTLCache(maxsize=capacity, ttl=ttl, timer=timer)
+
+    async def issue(self, key: str, code: str) -> None:
+        self._codes[key] = [hash_code(key, code), 0]
+
+    async def verify(self, key: str, code: str) -> str:
+        entry = self._codes.get(key)
+        if entry is None:
+            return OTP_MISSING
+
+        entry[1] += 1
+        if hmac.compare_digest(entry[0], hash_code(key, code)):
+            del self._codes[key]
+            return OTP_OK
+        if entry[1] >= self.max_attempts:
+            del self._codes[key]
+            return OTP_LOCKED
+        return OTP_INVALID
+
+
+ISSUE_SQL = text("""
+    INSERT INTO otp_codes (key, code_hash, attempts, expires_at)
+    VALUES (:key, :code_hash, 0, now() + make_interval(secs => :ttl))
+    ON CONFLICT (key) DO UPDATE
+    SET code_hash = EXCLUDED.code_hash, attempts = 0, expires_at = EXCLUDED.expires_at
+""")
+
+# Попытка засчитывается до сравнения — параллельный перебор тоже упрется в лимит
+ATTEMPT_SQL = text("""
+    UPDATE otp_codes SET attempts = attempts + 1
+    WHERE key = :key AND expires_at > now()
+    RETURNING code_hash, attempts
+""")
+
+DELETE_SQL = text("DELETE FROM otp_codes WHERE key = :key")
+
+
+class PostgresOTPStore(OTPStore):
+    async def issue(self, key: str, code: str) -> None:
+        async with engine.begin() as conn:
+            await conn.execute(ISSUE_SQL, {"key": key, "code_hash": hash_code(key, code), "ttl": float(self.ttl)})
+
+    async def verify(self, key: str, code: str) -> str:
+        async with engine.begin() as conn:
+            row = (await conn.execute(ATTEMPT_SQL, {"key": key})).first()
+            if row is None:
+                return OTP_MISSING
+
+            code_hash, attempts = row
+            if attempts <= self.max_attempts and hmac.compare_digest(bytes(code_hash), hash_code(key, code)):
+                await conn.execute(DELETE_SQL, {"key": key})
+                return OTP_OK
+            if attempts >= self.max_attempts:
+                await conn.execute(DELETE_SQL, {"key": key})
+                return OTP_LOCKED
+            return OTP_INVALID
+
+
+def build_otp_store() -> OTPStore:
+    if settings.OTP_STORE == "postgres":
+        return PostgresOTPStore(ttl=settings.OTP_TTL_SECONDS, max_attempts=settings.OTP_MAX_ATTEMPTS)
+    return MemoryOTPStore(
+        ttl=settings.OTP_TTL_SECONDS,
+        max_attempts=settings.OTP_MAX_ATTEMPTS,
+        capacity=settings.OTP_STORE_CAPACITY,
+    )
+
+
+otp_store = build_otp_store()
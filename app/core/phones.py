@@ -0,0 +1,42 @@
+"""
+Канонический номер телефона (E.164, "+77771234567").
+
+users.phone хранит номер как его ввел клиент, users.phone_e164 — канонический, с уникальным
+индексом. Регистрация, вход, токен и поиск получателя переводов работают только через
+phone_e164, поэтому любое написание одного номера находится одним обращением к индексу.
+
+Быстрый путь — предкомпилированные регулярки для казахстанского плана нумерации
+(+7 / 8 / 7 и 10 цифр), это почти все входящие номера. Остальное разбирает phonenumbers
+с регионом PHONE_DEFAULT_REGION (международные номера, экзотические записи).
+"""
+import re
+from functools import lru_cache
+
+import phonenumbers
+
+from app.core.config import settings
+
+_SEPARATORS_RE = re.compile(r"[\s()\-.]+")
+_LOCAL_RE = re.compile(r"(?:\+7|8|7)?(\d{10})")
+
+
+def to_e164(raw: str | None) -> str | None:
+    """Номер в любом написании -> "+7XXXXXXXXXX"; None, если это не номер телефона"""
+    if not raw:
+        return None
+    compact = _SEPARATORS_RE.sub("", raw)
+    match = _LOCAL_RE.fullmatch(compact)
+    if match:
+        return "+7" + match.group(1)
+    return _parse(compact)
+
+
+@lru_cache(maxsize=4096)
+def _parse(compact: str) -> str | None:
+    try:
+        number = phonenumbers.parse(compact, settings.PHONE_DEFAULT_REGION)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(number):
+        return None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
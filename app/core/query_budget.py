@@ -0,0 +1,77 @@
+"""
+Бюджеты запросов к БД на эндпоинт и поиск N+1.
+
+    @router.get("/my")
+    @query_budget(2)          # auth + один SELECT
+    async def get_my_loans(...)
+
+MetricsMiddleware после каждого запроса сверяет число SQL-запросов с бюджетом
+маршрута и ищет одинаковые по форме запросы, повторенные в цикле.
+Режим задается QUERY_BUDGET_MODE: off (прод), warn (лог + метрика),
+strict (исключение — для тестов и прогона benchmarks/query_budgets.py).
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from app.core.config import settings
+
+# Номера параметров и развернутые IN-списки не меняют форму запроса
+_PARAMS_RE = re.compile(r"\$\d+(?:\s*::\s*\w+(?:\[\])?)?(?:\s*,\s*\$\d+(?:\s*::\s*\w+(?:\[\])?)?)*")
+_SPACES_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Эндпоинт сделал больше запросов, чем заявлено, или повторяет запрос в цикле"""
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    max_statements: int
+    max_repeats: int | None = None  # None — берется QUERY_REPEAT_LIMIT
+
+
+def query_budget(max_statements: int, *, max_repeats: int | None = None):
+    """Объявляет бюджет эндпоинта (включая запрос пользователя в get_current_user)"""
+    def decorator(func):
+        func.__query_budget__ = QueryBudget(max_statements, max_repeats)
+        return func
+    return decorator
+
+
+def budget_for(route) -> QueryBudget | None:
+    endpoint = getattr(route, "endpoint", None)
+    return getattr(endpoint, "__query_budget__", None)
+
+
+def statement_shape(statement: str) -> str:
+    return _PARAMS_RE.sub("?", _SPACES_RE.sub(" ", statement).strip())
+
+
+def find_violations(budget: QueryBudget | None, statements: int, shapes: Counter) -> list[str]:
+    violations = []
+    if budget is not None and statements > budget.max_statements:
+        violations.append(f"{statements} statements, budget {budget.max_statements}")
+
+    max_repeats = settings.QUERY_REPEAT_LIMIT
+    if budget is not None and budget.max_repeats is not None:
+        max_repeats = budget.max_repeats
+
+    by_shape: Counter = Counter()
+    for statement, count in shapes.items():
+        by_shape[statement_shape(statement)] += count
+    for shape, count in by_shape.most_common():
+        if count <= max_repeats:
+            break
+        violations.append(f"N+1: repeated {count}x: {shape[:200]}")
+    return violations
+
+
+def enforce(route_path: str, budget: QueryBudget | None, statements: int, shapes: Counter) -> list[str]:
+    violations = find_violations(budget, statements, shapes)
+    if violations:
+        message = f"{route_path}: " + "; ".join(violations)
+        if settings.QUERY_BUDGET_MODE == "strict":
+            raise QueryBudgetExceeded(message)
+        print(f"Query budget Warning: {message}")
+    return violations
@@ -1,10 +1,29 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min_rounds = rounds: хеши с меньшей стоимостью помечаются как устаревшие
+# и перехешируются при следующем успешном входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt отпускает GIL, поэтому хватает пула потоков.
+# Семафор ограничивает очередь: при перегрузке лучше быстро отказать (503), чем копить запросы.
+_hash_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_MAX_CONCURRENCY)
+
+
+class PasswordHasherBusy(Exception):
+    """Не дождались свободного слота для bcrypt за PASSWORD_HASH_QUEUE_TIMEOUT"""
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     #Проверяет пароль с хешем в БД
@@ -13,6 +32,33 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+
+async def _run_in_hash_pool(func, *args):
+    try:
+        await asyncio.wait_for(_hash_slots.acquire(), timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PasswordHasherBusy()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_pool, func, *args)
+    finally:
+        _hash_slots.release()
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Хеширование в пуле потоков, не блокирует event loop"""
+    return await _run_in_hash_pool(pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Проверка пароля в пуле потоков.
+    Возвращает (valid, new_hash): new_hash не None, если параметры bcrypt изменились
+    и хеш нужно сохранить заново.
+    """
+    return await _run_in_hash_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
 
@@ -25,4 +71,4 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
     #JWT токен
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
@@ -0,0 +1,108 @@
+"""
+Расчетные счета провайдеров услуг.
+
+Вместо одного общего SRV_000_000 у каждого провайдера свои N под-счетов (шардов),
+шард выбирается по хешу пользователя. id счетов резолвятся один раз на процесс
+и дальше берутся из памяти. Зачисление на эти счета делает не платеж, а
+фоновый неттинг (app/jobs/settlement.py), поэтому горячей строки нет.
+
+Баланс шарда — обычный accounts.balance (Numeric(10, 2), максимум ~100 млн ₸), а оборот
+провайдера за несколько дней больше. Поэтому баланс шарда — только "еще не выведенное":
+дойдя до SETTLEMENT_SWEEP_AT, он целиком уходит в settlement_sweeps (Numeric(18, 2)).
+Всего провайдеру = сумма балансов шардов + сумма его settlement_sweeps.
+"""
+import asyncio
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal
+from app.db.models import Account, CurrencyEnum, RoleEnum, User
+
+# Название услуги в UI -> код провайдера
+SERVICE_PROVIDERS = {
+    "Мобильный": "mobile",
+    "Коммуналка": "utilities",
+    "Транспорт": "transport",
+    "Интернет и ТВ": "internet",
+    "Образование": "education",
+    "Билеты": "tickets",
+    "Покупки": "shopping",
+    "Развлечения": "entertainment",
+    "Штрафы": "fines",
+    "Другое": "other",
+    "Eco Tree": "eco",
+    "Ortak": "ortak",
+}
+DEFAULT_PROVIDER = "other"
+
+
+def provider_code(service_name: str) -> str:
+    return SERVICE_PROVIDERS.get(service_name, DEFAULT_PROVIDER)
+
+
+def settlement_card_number(provider: str, shard: int) -> str:
+    return f"SRV_{provider.upper()}_{shard:03d}"
+
+
+class SettlementDirectory:
+    """Кэш id расчетных счетов: provider -> [account_id по шардам]"""
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._accounts: dict[str, list[int]] = {}
+        self._lock = asyncio.Lock()
+
+    async def account_for(self, service_name: str, user_id: int) -> int:
+        provider = provider_code(service_name)
+        ids = self._accounts.get(provider)
+        if ids is None:
+            ids = await self._resolve(provider)
+        shard = zlib.crc32(str(user_id).encode()) % len(ids)
+        return ids[shard]
+
+    async def _resolve(self, provider: str) -> list[int]:
+        async with self._lock:
+            if provider in self._accounts:
+                return self._accounts[provider]
+            ids = await self._get_or_create(provider)
+            self._accounts[provider] = ids
+            return ids
+
+    async def _get_or_create(self, provider: str) -> list[int]:
+        # Отдельная сессия: не смешиваем служебный коммит с транзакцией платежа
+        phone = f"srv_{provider}"
+        cards = [settlement_card_number(provider, i) for i in range(self.shards)]
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                pg_insert(User)
+                .values(phone=phone, password_hash="pass", full_name=f"Service: {provider}", role=RoleEnum.USER)
+                .on_conflict_do_nothing(index_elements=["phone"])
+            )
+            user_id = (await db.execute(select(User.id).where(User.phone == phone))).scalar_one()
+
+            await db.execute(
+                pg_insert(Account)
+                .values([
+                    {"user_id": user_id, "card_number": card, "balance": 0,
+                     "currency": CurrencyEnum.KZT, "is_blocked": False}
+                    for card in cards
+                ])
+                .on_conflict_do_nothing(index_elements=["card_number"])
+            )
+            res = await db.execute(
+                select(Account.card_number, Account.id).where(Account.card_number.in_(cards))
+            )
+            by_card = dict(res.all())
+            await db.commit()
+
+        return [by_card[card] for card in cards]
+
+    def clear(self) -> None:
+        self._accounts.clear()
+
+
+settlement_directory = SettlementDirectory(shards=settings.SETTLEMENT_SHARDS)
@@ -0,0 +1,135 @@
+"""
+Выписки по счетам: CSV / NDJSON потоком и PDF.
+
+CSV и NDJSON читаются серверным курсором (AsyncSession.stream + yield_per, см.
+routers/transactions.py) и уходят клиенту пачками по STATEMENT_FETCH_SIZE строк —
+память процесса не зависит от длины истории.
+
+PDF weasyprint собирает целиком, поэтому число строк ограничено STATEMENT_PDF_MAX_ROWS,
+а рендер идет в отдельных процессах: он грузит CPU и держит GIL, event loop ждать не должен.
+Модуль намеренно не импортирует БД и приложение — его же загружают процессы пула.
+"""
+import asyncio
+import csv
+import html
+import importlib.util
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from app.core import categories
+from app.core.config import settings
+
+CSV_COLUMNS = [
+    "id", "created_at", "type", "amount", "category", "category_code",
+    "account_id", "counterparty_account_id", "provider", "merchant",
+]
+
+_pdf_pool: ProcessPoolExecutor | None = None
+
+
+class PDFUnavailable(Exception):
+    """weasyprint (или его системные библиотеки pango) не установлен"""
+
+
+def statement_row(tx, account_ids: set[int]) -> dict:
+    outgoing = tx.from_account_id in account_ids
+    category = categories.BY_ID.get(tx.category_id) if tx.category_id else None
+    return {
+        "id": tx.id,
+        "created_at": tx.created_at.isoformat(),
+        "type": "expense" if outgoing else "income",
+        "amount": str(tx.amount),  # Строкой, чтобы не терять копейки на float
+        "category": tx.category,
+        "category_code": category.code if category else None,
+        "account_id": tx.from_account_id if outgoing else tx.to_account_id,
+        "counterparty_account_id": tx.to_account_id if outgoing else tx.from_account_id,
+        "provider": tx.provider,
+        "merchant": tx.merchant,
+    }
+
+
+def csv_header() -> str:
+    # BOM — чтобы Excel открыл кириллицу в категориях без танцев с кодировкой
+    return "\ufeff" + csv_chunk([dict(zip(CSV_COLUMNS, CSV_COLUMNS))])
+
+
+def csv_chunk(rows: list[dict]) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def ndjson_chunk(rows: list[dict]) -> str:
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+def statement_html(title: str, period: str, rows: list[dict]) -> str:
+    spent = sum((Decimal(r["amount"]) for r in rows if r["type"] == "expense"), Decimal("0"))
+    received = sum((Decimal(r["amount"]) for r in rows if r["type"] == "income"), Decimal("0"))
+    body = "".join(
+        "<tr><td>{}</td><td>{}</td><td>{}</td><td class='num'>{}{}</td></tr>".format(
+            html.escape(r["created_at"][:19].replace("T", " ")),
+            html.escape(r["category"] or ""),
+            html.escape(r["merchant"] or r["provider"] or ""),
+            "-" if r["type"] == "expense" else "+",
+            html.escape(r["amount"]),
+        )
+        for r in rows
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+@page {{ size: A4; margin: 15mm; }}
+body {{ font-family: sans-serif; font-size: 9pt; }}
+table {{ width: 100%; border-collapse: collapse; }}
+th, td {{ border-bottom: 1px solid #ddd; padding: 3px 4px; text-align: left; }}
+.num {{ text-align: right; white-space: nowrap; }}
+</style></head><body>
+<h2>{html.escape(title)}</h2>
+<p>Период: {html.escape(period)}<br>Операций: {len(rows)}<br>
+Списано: {spent} ₸<br>Зачислено: {received} ₸</p>
+<table><thead><tr><th>Дата</th><th>Категория</th><th>Получатель</th><th class="num">Сумма</th></tr></thead>
+<tbody>{body}</tbody></table>
+</body></html>"""
+
+
+def pdf_available() -> bool:
+    return importlib.util.find_spec("weasyprint") is not None
+
+
+def _render_pdf(document: str) -> bytes:
+    # Выполняется в процессе пула
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError) as e:
+        raise PDFUnavailable(str(e))
+    return HTML(string=document).write_pdf()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn, а не fork: форк процесса с event loop и открытыми соединениями ненадежен
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=settings.STATEMENT_PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+
+async def render_pdf(document: str) -> bytes:
+    if not pdf_available():
+        raise PDFUnavailable("weasyprint is not installed")
+    loop = asyncio.get_running_loop()
+    async with asyncio.timeout(settings.STATEMENT_PDF_TIMEOUT):
+        return await loop.run_in_executor(_get_pdf_pool(), _render_pdf, document)
+
+
+def shutdown_pdf_pool() -> None:
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
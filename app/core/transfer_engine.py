@@ -0,0 +1,286 @@
+"""
+Атомарный перевод одним SQL-выражением.
+
+Списание — условный UPDATE (balance >= amount, карта не заблокирована),
+зачисление и запись в transactions идут в том же выражении через CTE.
+Строки счетов блокируются заранее в порядке id, поэтому два встречных
+перевода не ловят дедлок, а параллельные переводы с одной карты
+не теряют обновления баланса.
+"""
+import asyncio
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import categories
+from app.core.analytics import CURRENT_MONTH_SQL, ROLLUP_CONFLICT_SQL
+from app.core.config import settings
+
+# 40001 — serialization_failure, 40P01 — deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+TRANSFER_SQL = text(f"""
+WITH sender AS (
+    SELECT id FROM accounts
+    WHERE user_id = :user_id
+    ORDER BY (id = CAST(:from_id AS INTEGER)) IS TRUE DESC,
+             (is_blocked IS NOT TRUE AND balance >= :amount) DESC,
+             id
+    LIMIT 1
+),
+locked AS (
+    SELECT id FROM accounts
+    WHERE id IN (SELECT id FROM sender) OR id = CAST(:to_id AS INTEGER)
+    ORDER BY id
+    FOR UPDATE
+),
+debit AS (
+    UPDATE accounts a
+    SET balance = a.balance - :amount
+    FROM locked l
+    WHERE a.id = l.id
+      AND a.id = (SELECT id FROM sender)
+      AND a.id IS DISTINCT FROM CAST(:to_id AS INTEGER)
+      AND a.balance >= :amount
+      AND a.is_blocked IS NOT TRUE
+    RETURNING a.id, a.balance
+),
+credit AS (
+    UPDATE accounts a
+    SET balance = a.balance + :amount
+    FROM locked l
+    WHERE a.id = l.id
+      AND a.id = CAST(:to_id AS INTEGER)
+      AND EXISTS (SELECT 1 FROM debit)
+    RETURNING a.id, a.user_id
+),
+posted AS (
+    INSERT INTO transactions (from_account_id, to_account_id, amount, category, created_at,
+                              category_id, provider, merchant)
+    SELECT d.id, CAST(:to_id AS INTEGER), :amount, :category, now(),
+           CAST(:category_id AS SMALLINT), CAST(:provider AS VARCHAR), CAST(:merchant AS VARCHAR)
+    FROM debit d
+    RETURNING id
+),
+rollup AS (
+    INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+    SELECT CAST(:user_id AS INTEGER), {CURRENT_MONTH_SQL}, CAST(:category_id AS SMALLINT), CAST(:amount AS NUMERIC), 1
+    FROM posted
+    UNION ALL
+    SELECT c.user_id, {CURRENT_MONTH_SQL}, CAST(:in_category_id AS SMALLINT), CAST(:amount AS NUMERIC), 1
+    FROM credit c
+    {ROLLUP_CONFLICT_SQL}
+)
+SELECT
+    (SELECT id FROM sender) AS sender_id,
+    (SELECT balance FROM debit) AS new_balance,
+    (SELECT id FROM credit) AS credited_id,
+    (SELECT id FROM posted) AS transaction_id
+""")
+
+# Оплата услуги: только списание + строка в pending_settlements.
+# Расчетный счет провайдера здесь не трогаем (его зачисляет неттинг).
+SERVICE_PAYMENT_SQL = text(f"""
+WITH sender AS (
+    SELECT id FROM accounts
+    WHERE user_id = :user_id AND is_blocked IS NOT TRUE
+    ORDER BY id
+    LIMIT 1
+),
+debit AS (
+    UPDATE accounts a
+    SET balance = a.balance - :amount
+    WHERE a.id = (SELECT id FROM sender)
+      AND a.balance >= :amount
+      AND a.is_blocked IS NOT TRUE
+    RETURNING a.id, a.balance
+),
+posted AS (
+    INSERT INTO transactions (from_account_id, to_account_id, amount, category, created_at,
+                              category_id, provider, merchant)
+    SELECT d.id, :to_id, :amount, :category, now(),
+           CAST(:category_id AS SMALLINT), CAST(:provider AS VARCHAR), CAST(:merchant AS VARCHAR)
+    FROM debit d
+    RETURNING id
+),
+rollup AS (
+    INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+    SELECT CAST(:user_id AS INTEGER), {CURRENT_MONTH_SQL}, CAST(:category_id AS SMALLINT), CAST(:amount AS NUMERIC), 1
+    FROM posted
+    {ROLLUP_CONFLICT_SQL}
+),
+pending AS (
+    INSERT INTO pending_settlements (account_id, amount, transaction_id, created_at)
+    SELECT :to_id, :amount, p.id, now()
+    FROM posted p
+    RETURNING id
+)
+SELECT
+    (SELECT id FROM sender) AS sender_id,
+    (SELECT balance FROM debit) AS new_balance,
+    CAST(NULL AS INTEGER) AS credited_id,
+    (SELECT id FROM posted) AS transaction_id
+""")
+
+SENDER_STATE_SQL = text("SELECT balance, is_blocked FROM accounts WHERE id = :id")
+
+
+class TransferRejected(Exception):
+    """Перевод не прошел бизнес-проверки (reason — машинный код причины)"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass
+class TransferResult:
+    sender_id: int
+    transaction_id: int
+    new_balance: Decimal
+    credited_id: int | None
+    attempts: int
+
+
+def is_retryable(exc: DBAPIError) -> bool:
+    orig = exc.orig
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return code in RETRYABLE_SQLSTATES
+
+
+async def run_with_retry(db: AsyncSession, operation, max_retries: int | None = None):
+    """
+    Выполняет operation(db) и коммитит; на serialization failure / deadlock
+    откатывает и повторяет с экспоненциальной задержкой.
+    Возвращает (результат, число попыток).
+    """
+    max_retries = settings.TRANSFER_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = await operation(db)
+            await db.commit()
+            return result, attempt
+        except DBAPIError as e:
+            await db.rollback()
+            if not is_retryable(e) or attempt > max_retries:
+                raise
+            backoff = settings.TRANSFER_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+            await asyncio.sleep(backoff * (1 + random.random()))
+        except Exception:
+            await db.rollback()
+            raise
+
+
+async def transfer(
+        db: AsyncSession,
+        *,
+        user_id: int,
+        amount: Decimal,
+        category: str,
+        from_account_id: int | None = None,
+        to_account_id: int | None = None,
+        category_id: int | None = None,
+        provider: str | None = None,
+        merchant: str | None = None,
+        on_posted=None,
+) -> TransferResult:
+    """
+    Переводит amount со счета пользователя на to_account_id
+    (None — внешний перевод, только списание).
+    Если from_account_id не указан или чужой, берется первая карта, где хватает денег.
+    on_posted(session, row) вызывается после проводки до коммита — для записей
+    в той же транзакции (например, уведомлений в outbox).
+    category_id по умолчанию — перевод клиенту или во внешний банк; получателю
+    в свертку трат пишется transfer_in.
+    """
+    if category_id is None:
+        category_id = categories.TRANSFER_OUT if to_account_id is not None else categories.EXTERNAL_TRANSFER
+    params = {
+        "user_id": user_id,
+        "from_id": from_account_id,
+        "to_id": to_account_id,
+        "amount": Decimal(amount),
+        "category": category,
+        "category_id": category_id,
+        "in_category_id": categories.TRANSFER_IN,
+        "provider": provider,
+        "merchant": merchant,
+        "tz": settings.ANALYTICS_TIMEZONE,
+    }
+
+    async def operation(session: AsyncSession):
+        row = (await session.execute(TRANSFER_SQL, params)).one()
+        if row.transaction_id is None:
+            # Ничего не списали — один дополнительный запрос, чтобы назвать причину
+            raise TransferRejected(await _rejection_reason(session, row.sender_id, to_account_id))
+        if on_posted is not None:
+            await on_posted(session, row)
+        return row
+
+    row, attempts = await run_with_retry(db, operation)
+    return TransferResult(
+        sender_id=row.sender_id,
+        transaction_id=row.transaction_id,
+        new_balance=row.new_balance,
+        credited_id=row.credited_id,
+        attempts=attempts,
+    )
+
+
+async def pay_to_settlement(
+        db: AsyncSession,
+        *,
+        user_id: int,
+        amount: Decimal,
+        category: str,
+        settlement_account_id: int,
+        category_id: int = categories.OTHER,
+        provider: str | None = None,
+        merchant: str | None = None,
+        on_posted=None,
+) -> TransferResult:
+    """Оплата услуги с первой активной карты пользователя на расчетный счет провайдера"""
+    params = {
+        "user_id": user_id,
+        "to_id": settlement_account_id,
+        "amount": Decimal(amount),
+        "category": category,
+        "category_id": category_id,
+        "provider": provider,
+        "merchant": merchant,
+        "tz": settings.ANALYTICS_TIMEZONE,
+    }
+
+    async def operation(session: AsyncSession):
+        row = (await session.execute(SERVICE_PAYMENT_SQL, params)).one()
+        if row.transaction_id is None:
+            raise TransferRejected("no_account" if row.sender_id is None else "insufficient_funds")
+        if on_posted is not None:
+            await on_posted(session, row)
+        return row
+
+    row, attempts = await run_with_retry(db, operation)
+    return TransferResult(
+        sender_id=row.sender_id,
+        transaction_id=row.transaction_id,
+        new_balance=row.new_balance,
+        credited_id=None,
+        attempts=attempts,
+    )
+
+
+async def _rejection_reason(db: AsyncSession, sender_id: int | None, to_account_id: int | None) -> str:
+    if sender_id is None:
+        return "no_account"
+    if sender_id == to_account_id:
+        return "same_account"
+    state = (await db.execute(SENDER_STATE_SQL, {"id": sender_id})).one()
+    if state.is_blocked:
+        return "blocked"
+    return "insufficient_funds"
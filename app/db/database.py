@@ -1,6 +1,9 @@
+import time
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import settings
+from app.core.metrics import install_db_hooks
 
 # движок (Engine)
 db_url = settings.DATABASE_URL
@@ -10,10 +13,45 @@ if db_url.startswith("postgres://"):
 elif db_url.startswith("postgresql://"):
     db_url = db_url.replace("postgresql://", "postgresql+asyncpg://", 1)
 
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """Пул, который считает время ожидания соединения (включая установку нового)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = {"checkouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_stats["checkouts"] += 1
+            self.wait_stats["wait_seconds_total"] += waited
+            self.wait_stats["wait_seconds_max"] = max(self.wait_stats["wait_seconds_max"], waited)
+
+    def recreate(self):
+        # dispose() пересоздает пул — переносим счетчики в новый
+        new_pool = super().recreate()
+        new_pool.wait_stats = self.wait_stats
+        return new_pool
+
+
 engine = create_async_engine(
     db_url,
-    echo=True
+    echo=settings.DB_ECHO,
+    poolclass=MeteredPool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
 )
+# счетчики SQL-запросов и времени в БД (для /metrics)
+install_db_hooks(engine.sync_engine)
+
 # фабрику сессий
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
@@ -21,6 +59,19 @@ AsyncSessionLocal = async_sessionmaker(
     expire_on_commit=False
 )
 
+
+def pool_stats() -> dict:
+    """Текущее состояние пула соединений (для /health и метрик)"""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        **pool.wait_stats,
+    }
+
+
 # базовый класс для моделей
 class Base(DeclarativeBase):
     pass
@@ -28,4 +79,4 @@ class Base(DeclarativeBase):
 # зависимость Dependency для получения сессии в эндпоинтах
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
@@ -1,8 +1,9 @@
 import enum
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Enum, Numeric, DateTime
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, Date, String, Boolean, ForeignKey, Enum, Numeric, DateTime, Index, LargeBinary, Text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.db.database import Base
 
 
@@ -21,15 +22,31 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    phone = Column(String, unique=True, index=True, nullable=False)
+    phone = Column(String, unique=True, index=True, nullable=False)  # Как ввел клиент
+    # Канонический номер (app/core/phones.py) — по нему идут все поиски; у служебных пользователей NULL
+    phone_e164 = Column(String(16), nullable=True)
     password_hash = Column(String, nullable=False)
     full_name = Column(String, nullable=True)
     # --- НОВОЕ ПОЛЕ ---
     avatar_url = Column(String, nullable=True)
+    # Личный чат с ботом; без него уведомления клиенту не отправляются (общего чата нет)
+    telegram_chat_id = Column(String(32), nullable=True)
     role = Column(Enum(RoleEnum), default=RoleEnum.USER)
 
     accounts = relationship("Account", back_populates="owner")
 
+    __table_args__ = (
+        Index("ix_users_phone_e164", "phone_e164", unique=True),
+    )
+
+
+class CardBinRange(Base):
+    """Последовательность номеров карт внутри BIN; процессы забирают из нее блоки (app/core/cards.py)"""
+    __tablename__ = "card_bin_ranges"
+
+    bin = Column(String(8), primary_key=True)
+    next_value = Column(BigInteger, nullable=False, server_default="0")  # Первый еще не выданный номер
+
 
 class Account(Base):
     __tablename__ = "accounts"
@@ -48,6 +65,27 @@ class Account(Base):
     incoming_transactions = relationship("Transaction", foreign_keys="Transaction.to_account_id",
                                          back_populates="to_account")
 
+class TransactionCategory(Base):
+    """Справочник категорий; id фиксированы и совпадают с app/core/categories.py"""
+    __tablename__ = "transaction_categories"
+
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    code = Column(String(32), unique=True, nullable=False)
+    name = Column(String, nullable=False)
+    kind = Column(String(16), nullable=False)  # expense, income, internal
+
+
+class SpendingRollup(Base):
+    """Сумма и число операций пользователя за месяц по категории (обновляется при проводке)"""
+    __tablename__ = "spending_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month = Column(Date, primary_key=True)  # Первое число месяца (ANALYTICS_TIMEZONE)
+    category_id = Column(SmallInteger, ForeignKey("transaction_categories.id"), primary_key=True)
+    total = Column(Numeric(14, 2), nullable=False, default=0)
+    tx_count = Column(Integer, nullable=False, default=0)
+
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
@@ -57,11 +95,89 @@ class Transaction(Base):
     amount = Column(Numeric(10, 2), nullable=False)
     category = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Для аналитики (см. app/core/categories.py): нормализованная категория и контрагент
+    category_id = Column(SmallInteger, ForeignKey("transaction_categories.id"), nullable=True)
+    provider = Column(String(64), nullable=True)
+    merchant = Column(String(64), nullable=True)
 
     # Связи (Relationships)
     from_account = relationship("Account", foreign_keys=[from_account_id], back_populates="outgoing_transactions")
     to_account = relationship("Account", foreign_keys=[to_account_id], back_populates="incoming_transactions")
 
+    # Индексы под keyset-пагинацию истории (см. routers/transactions.py)
+    __table_args__ = (
+        Index("ix_transactions_from_created_id", "from_account_id", "created_at", "id"),
+        Index("ix_transactions_to_created_id", "to_account_id", "created_at", "id"),
+    )
+
+class PendingSettlement(Base):
+    """Платеж за услугу, еще не зачисленный на расчетный счет провайдера (см. app/jobs/settlement.py)"""
+    __tablename__ = "pending_settlements"
+
+    id = Column(BigInteger, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    amount = Column(Numeric(12, 2), nullable=False)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SettlementSweep(Base):
+    """Вывод накопленного с расчетного счета провайдера (баланс шарда обнуляется, см. app/jobs/settlement.py)"""
+    __tablename__ = "settlement_sweeps"
+
+    id = Column(BigInteger, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    amount = Column(Numeric(18, 2), nullable=False)  # Шире accounts.balance: сюда уходит то, что в него не влезет
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OTPCode(Base):
+    """Код MFA (только HMAC). UNLOGGED: без WAL, после падения БД таблица пустая — это допустимо"""
+    __tablename__ = "otp_codes"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    key = Column(String, primary_key=True)
+    code_hash = Column(LargeBinary, nullable=False)
+    attempts = Column(SmallInteger, nullable=False, default=0)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class IdempotencyKey(Base):
+    """Сохраненный ответ денежной операции по Idempotency-Key (см. app/core/idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+
+    # Первичный ключ (scope, key) — он же уникальный индекс, на котором ловятся гонки повторов
+    scope = Column(String(64), primary_key=True)  # "transfers.p2p:<user_id>"
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # sha256 тела запроса
+    status_code = Column(SmallInteger, nullable=False)
+    response = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class NotificationOutbox(Base):
+    """Уведомление, ожидающее отправки (пишется в транзакции события, отправляет app/jobs/notifications.py)"""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_notification_outbox_due", "next_attempt_at", postgresql_where=text("status = 'pending'")),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    kind = Column(String, nullable=False)  # otp, transfer_out, transfer_in, loan_payout, service_payment
+    body = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, sent, dead
+    attempts = Column(SmallInteger, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+
 class Loan(Base):  # <--- ТУТ БЫЛА ОШИБКА, НУЖНО Base
     __tablename__ = "loans"
 
@@ -73,6 +189,11 @@ class Loan(Base):  # <--- ТУТ БЫЛА ОШИБКА, НУЖНО Base
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
     type = Column(String, default="credit") # "credit" или "red"
+    # Агрегаты по графику, обновляются при каждом платеже (без пересчета по loan_schedules)
+    outstanding_principal = Column(Numeric(12, 2), nullable=True)  # Остаток основного долга
+    remaining_amount = Column(Numeric(12, 2), nullable=True)       # Сумма неоплаченных платежей
+    remaining_installments = Column(Integer, nullable=True)        # Сколько платежей осталось
+    autopay = Column(Boolean, nullable=False, default=True, server_default=text("true"))  # app/jobs/scheduler.py
 
     schedule = relationship("LoanSchedule", back_populates="loan")
 
@@ -84,10 +205,18 @@ class LoanSchedule(Base):
     loan_id = Column(Integer, ForeignKey("loans.id"), nullable=False)
     due_date = Column(DateTime(timezone=True), nullable=False) # Когда платить
     amount = Column(Numeric(10, 2), nullable=False)
+    principal_amount = Column(Numeric(10, 2), nullable=True)  # Тело долга в платеже
+    interest_amount = Column(Numeric(10, 2), nullable=True)   # Проценты в платеже
     is_paid = Column(Boolean, default=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # Повтор автоплатежа, если не хватило денег
 
     loan = relationship("Loan", back_populates="schedule")
 
+    # Очередь автоплатежа: только неоплаченные
+    __table_args__ = (
+        Index("ix_loan_schedules_unpaid_due", "due_date", postgresql_where=text("is_paid IS NOT TRUE")),
+    )
+
 class Favorite(Base):
     __tablename__ = "favorites"
 
@@ -112,6 +241,15 @@ class Deposit(Base):
     start_date = Column(DateTime(timezone=True), default=datetime.utcnow)
     end_date = Column(DateTime(timezone=True), nullable=False)
     is_active = Column(Boolean, default=True)
+    # Начисленные проценты (app/jobs/deposits.py), считаются от start_date по accrued_through
+    accrued_interest = Column(Numeric(12, 2), nullable=False, server_default="0", default=0)
+    accrued_through = Column(DateTime(timezone=True), nullable=True)
+    on_maturity = Column(String(16), nullable=False, server_default="payout", default="payout")  # payout, capitalize
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)  # Куда вернуть деньги по окончании срока
+
+    __table_args__ = (
+        Index("ix_deposits_active_end_date", "end_date", postgresql_where=text("is_active IS TRUE")),
+    )
 
 
 class Insurance(Base):
@@ -126,4 +264,15 @@ class Insurance(Base):
     term_months = Column(Integer, nullable=False)
     start_date = Column(DateTime(timezone=True), default=datetime.utcnow)
     end_date = Column(DateTime(timezone=True), nullable=False)
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+    # upfront — вся стоимость при оформлении, monthly — списания раз в период (app/jobs/scheduler.py)
+    payment_mode = Column(String(16), nullable=False, default="upfront", server_default="upfront")
+    next_billing_at = Column(DateTime(timezone=True), nullable=True)
+    billing_retry_at = Column(DateTime(timezone=True), nullable=True)  # Повтор после неудачного списания
+
+    __table_args__ = (
+        Index("ix_insurances_billing_due", "next_billing_at",
+              postgresql_where=text("payment_mode = 'monthly' AND is_active IS TRUE")),
+        Index("ix_insurances_active_end_date", "end_date", postgresql_where=text("is_active IS TRUE")),
+        Index("ix_insurances_user_active", "user_id", "is_active"),
+    )
\ No newline at end of file
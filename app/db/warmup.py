@@ -0,0 +1,71 @@
+"""
+Прогрев пула при старте: открываем DB_POOL_SIZE соединений параллельно и на каждом
+выполняем горячие запросы, чтобы asyncpg закешировал их prepared statements.
+Пишущие запросы выполняются с заведомо пустыми параметрами и откатываются.
+"""
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from app.core import categories, transfer_engine
+from app.core.config import settings
+from app.db.database import engine
+from app.db.models import Account, User
+
+
+def _hot_statements():
+    return [
+        # get_current_user / login
+        (select(User).where(User.phone_e164 == ""), {}),
+        # списки счетов, выбор карты
+        (select(Account).where(Account.user_id == -1), {}),
+        (select(Account.id).where(Account.card_number == ""), {}),
+        # переводы и оплата услуг (user_id=-1 — ничего не найдется и не изменится)
+        (transfer_engine.TRANSFER_SQL, {
+            "user_id": -1, "from_id": None, "to_id": None, "amount": Decimal("0"), "category": "",
+            "category_id": categories.TRANSFER_OUT, "in_category_id": categories.TRANSFER_IN,
+            "provider": None, "merchant": None, "tz": settings.ANALYTICS_TIMEZONE,
+        }),
+        (transfer_engine.SERVICE_PAYMENT_SQL, {
+            "user_id": -1, "to_id": -1, "amount": Decimal("0"), "category": "",
+            "category_id": categories.OTHER, "provider": None, "merchant": None,
+            "tz": settings.ANALYTICS_TIMEZONE,
+        }),
+    ]
+
+
+async def _prepare_connection(barrier: asyncio.Barrier):
+    try:
+        async with engine.connect() as conn:
+            trans = await conn.begin()
+            try:
+                for statement, params in _hot_statements():
+                    await conn.execute(statement, params)
+            finally:
+                await trans.rollback()
+            # Держим соединение, пока остальные не откроют свои — иначе пул отдаст одно и то же
+            await barrier.wait()
+    except BaseException:
+        await barrier.abort()
+        raise
+
+
+async def warm_up_pool() -> None:
+    size = settings.DB_POOL_SIZE
+    barrier = asyncio.Barrier(size)
+    try:
+        async with asyncio.timeout(settings.DB_POOL_TIMEOUT):
+            results = await asyncio.gather(
+                *(_prepare_connection(barrier) for _ in range(size)),
+                return_exceptions=True,
+            )
+    except TimeoutError as e:
+        results = [e]
+    errors = [r for r in results if isinstance(r, BaseException) and not isinstance(r, asyncio.BrokenBarrierError)]
+    errors = errors or [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        # Старт не роняем: БД может подняться позже, первые запросы просто будут медленнее
+        print(f"DB warm-up Error: {errors[0]!r}")
+    else:
+        print(f"DB pool warmed up: {size} connections")
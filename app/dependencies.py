@@ -4,7 +4,9 @@ from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.core.auth_cache import Principal, auth_cache
 from app.core.config import settings
+from app.core.phones import to_e164
 from app.db.database import get_db
 from app.db.models import User
 
@@ -15,30 +17,39 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 async def get_current_user(
         token: str = Depends(oauth2_scheme),
         db: AsyncSession = Depends(get_db)
-) -> User:
+) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Невалидный токен или истек срок действия",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    try:
-        # 1. Декодируем токен
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        phone: str = payload.get("sub")  # Достаем номер телефона (мы его туда положили при логине)
-
-        if phone is None:
+    # 1. Декодируем токен (или берем уже проверенные claims из кэша)
+    payload = auth_cache.get_claims(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError:
             raise credentials_exception
+        auth_cache.put_claims(token, payload)
 
-    except JWTError:
+    # Номер телефона (мы его туда положили при логине); старые токены несут номер как его ввели
+    phone = to_e164(payload.get("sub"))
+    if phone is None:
         raise credentials_exception
 
-    # 2. Ищем пользователя в базе
-    query = select(User).where(User.phone == phone)
+    # 2. Снимок пользователя из кэша, иначе ищем в базе
+    principal = auth_cache.get_principal(phone)
+    if principal is not None:
+        return principal
+
+    query = select(User).where(User.phone_e164 == phone)
     result = await db.execute(query)
     user = result.scalar_one_or_none()
 
     if user is None:
         raise credentials_exception
 
-    return user
\ No newline at end of file
+    principal = Principal.from_user(user)
+    auth_cache.put_principal(principal)
+    return principal
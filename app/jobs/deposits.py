@@ -0,0 +1,286 @@
+"""
+Вклады: ежедневное начисление процентов и окончание срока.
+
+accrue_deposits — проходит все активные вклады пачками по DEPOSIT_ACCRUAL_CHUNK_SIZE (keyset по id):
+одна выборка целыми числами (копейки, ставка, epoch), расчет в numpy (app/core/deposit_interest.py)
+и один UPDATE через unnest только для вкладов, у которых сумма изменилась.
+Каждая пачка — своя короткая транзакция, строки не блокируются заранее: если вклад за это время
+закрыли или переоформили, UPDATE его пропустит (условие на is_active и start_date).
+
+process_matured_deposits — вклады с наступившим end_date (FOR UPDATE SKIP LOCKED, как в scheduler):
+- payout: тело и проценты зачисляются на счет вклада (или первый счет клиента), вклад закрывается;
+- capitalize: проценты прибавляются к сумме, вклад переоформляется на тот же срок от end_date.
+  Вклады без счета для выплаты тоже переоформляются — деньги остаются у клиента.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import categories
+from app.core.analytics import MONTH_AT_SQL, ROLLUP_CONFLICT_SQL
+from app.core.clock import system_clock
+from app.core.config import settings
+from app.core.deposit_interest import accrue, elapsed_days, interest_for, days_between
+from app.core.metrics import SCHEDULER_ITEMS, SCHEDULER_RUN_SECONDS, SCHEDULER_THROUGHPUT
+from app.core.notifications import enqueue_notifications
+from app.db.database import AsyncSessionLocal
+from app.jobs.scheduler import RunReport, run_batches
+
+ACCRUAL_CHUNK_SQL = text("""
+SELECT id,
+       CAST(amount * 100 AS BIGINT) AS amount_kopecks,
+       CAST(rate * 10000 AS BIGINT) AS rate_units,
+       CAST(extract(epoch FROM start_date) AS BIGINT) AS start_s,
+       CAST(extract(epoch FROM end_date) AS BIGINT) AS end_s,
+       CAST(accrued_interest * 100 AS BIGINT) AS accrued_kopecks
+FROM deposits
+WHERE is_active IS TRUE AND id > :after_id
+ORDER BY id
+LIMIT :chunk_size
+""")
+
+ACCRUAL_UPDATE_SQL = text("""
+UPDATE deposits d
+SET accrued_interest = CAST(u.accrued AS NUMERIC) / 100,
+    accrued_through = to_timestamp(u.through_s)
+FROM unnest(
+    CAST(:ids AS INTEGER[]), CAST(:accrued AS BIGINT[]),
+    CAST(:through_s AS BIGINT[]), CAST(:start_s AS BIGINT[])
+) AS u(id, accrued, through_s, start_s)
+WHERE d.id = u.id
+  AND d.is_active IS TRUE
+  AND CAST(extract(epoch FROM d.start_date) AS BIGINT) = u.start_s
+""")
+
+# Счет для выплаты: указанный при открытии, иначе первый счет клиента (как в /deposits/{id}/close)
+CLAIM_MATURED_SQL = text("""
+SELECT d.id, d.user_id, d.amount, d.rate, d.type, d.term_months, d.start_date, d.end_date, d.on_maturity,
+       COALESCE(d.account_id, a.id) AS account_id
+FROM deposits d
+LEFT JOIN LATERAL (
+    SELECT id FROM accounts WHERE user_id = d.user_id ORDER BY id LIMIT 1
+) a ON d.account_id IS NULL
+WHERE d.is_active IS TRUE AND d.end_date <= :now
+ORDER BY d.end_date, d.id
+LIMIT :batch_size
+FOR UPDATE OF d SKIP LOCKED
+""")
+
+LOCK_PAYOUT_ACCOUNTS_SQL = text("""
+SELECT id FROM accounts
+WHERE id = ANY(CAST(:ids AS INTEGER[]))
+ORDER BY id
+FOR UPDATE
+""")
+
+APPLY_MATURED_SQL = text(f"""
+WITH credits AS (
+    UPDATE accounts a
+    SET balance = a.balance + c.amount
+    FROM unnest(CAST(:credit_ids AS INTEGER[]), CAST(:credit_amounts AS NUMERIC[])) AS c(id, amount)
+    WHERE a.id = c.id
+    RETURNING a.id
+),
+closed AS (
+    UPDATE deposits d
+    SET is_active = FALSE, accrued_interest = p.interest, accrued_through = d.end_date
+    FROM unnest(CAST(:payout_ids AS INTEGER[]), CAST(:payout_interest AS NUMERIC[])) AS p(id, interest)
+    WHERE d.id = p.id
+    RETURNING d.id
+),
+rolled AS (
+    UPDATE deposits d
+    SET amount = d.amount + r.interest,
+        start_date = d.end_date,
+        end_date = d.end_date + make_interval(days => 30 * d.term_months),
+        accrued_interest = 0,
+        accrued_through = d.end_date
+    FROM unnest(CAST(:rollover_ids AS INTEGER[]), CAST(:rollover_interest AS NUMERIC[])) AS r(id, interest)
+    WHERE d.id = r.id
+    RETURNING d.id
+),
+posted AS (
+    INSERT INTO transactions (from_account_id, to_account_id, amount, category, created_at,
+                              category_id, provider, merchant)
+    SELECT NULL, t.account_id, t.amount, t.category, CAST(:now AS TIMESTAMPTZ), t.category_id, NULL, NULL
+    FROM unnest(
+        CAST(:tx_accounts AS INTEGER[]), CAST(:tx_amounts AS NUMERIC[]),
+        CAST(:tx_categories AS VARCHAR[]), CAST(:tx_category_ids AS SMALLINT[])
+    ) AS t(account_id, amount, category, category_id)
+    RETURNING id
+),
+rollup AS (
+    INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+    SELECT r.user_id, {MONTH_AT_SQL}, r.category_id, r.total, r.n
+    FROM unnest(
+        CAST(:rollup_users AS INTEGER[]), CAST(:rollup_categories AS SMALLINT[]),
+        CAST(:rollup_totals AS NUMERIC[]), CAST(:rollup_counts AS INTEGER[])
+    ) AS r(user_id, category_id, total, n)
+    {ROLLUP_CONFLICT_SQL}
+)
+SELECT (SELECT count(*) FROM closed) AS closed, (SELECT count(*) FROM rolled) AS rolled
+""")
+
+
+@dataclass
+class AccrualReport:
+    as_of: datetime
+    scanned: int = 0
+    updated: int = 0
+    chunks: int = 0
+    duration_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.scanned / self.duration_seconds if self.duration_seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "as_of": self.as_of.isoformat(),
+            "scanned": self.scanned,
+            "updated": self.updated,
+            "chunks": self.chunks,
+            "throughput_per_second": round(self.throughput, 1),
+            "duration_seconds": round(self.duration_seconds, 3),
+        }
+
+
+def accrual_updates(rows, as_of_s: int) -> dict:
+    """
+    Строки ACCRUAL_CHUNK_SQL -> параметры ACCRUAL_UPDATE_SQL (только изменившиеся вклады).
+    Отдельно от БД — его же гоняет benchmarks/deposit_accrual.py.
+    """
+    data = np.asarray(rows, dtype=np.int64).reshape(-1, 6)
+    ids, amount, rate, start_s, end_s, accrued_before = data.T
+    days = elapsed_days(start_s, end_s, as_of_s)
+    accrued = accrue(amount, rate, days)
+    changed = accrued != accrued_before
+    return {
+        "ids": ids[changed].tolist(),
+        "accrued": accrued[changed].tolist(),
+        "through_s": (start_s + days * 86400)[changed].tolist(),
+        "start_s": start_s[changed].tolist(),
+    }
+
+
+async def accrue_deposits(clock=None, chunk_size: int | None = None) -> AccrualReport:
+    """Фоновая задача: пересчитывает начисленные проценты всех активных вкладов на сегодня"""
+    clock = clock or system_clock
+    chunk_size = chunk_size or settings.DEPOSIT_ACCRUAL_CHUNK_SIZE
+    report = AccrualReport(as_of=clock.now())
+    as_of_s = int(report.as_of.timestamp())
+    started = time.perf_counter()
+
+    after_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = (await db.execute(ACCRUAL_CHUNK_SQL, {"after_id": after_id, "chunk_size": chunk_size})).all()
+            if not rows:
+                await db.rollback()
+                break
+            after_id = rows[-1][0]
+            params = accrual_updates(rows, as_of_s)
+            if params["ids"]:
+                result = await db.execute(ACCRUAL_UPDATE_SQL, params)
+                report.updated += result.rowcount
+            await db.commit()
+            report.scanned += len(rows)
+            report.chunks += 1
+            if len(rows) < chunk_size:
+                break
+
+    report.duration_seconds = time.perf_counter() - started
+    SCHEDULER_RUN_SECONDS.observe("deposit_accrual", value=report.duration_seconds)
+    SCHEDULER_THROUGHPUT.set("deposit_accrual", value=report.throughput)
+    SCHEDULER_ITEMS.inc("deposit_accrual", "updated", amount=report.updated)
+    if report.updated:
+        print(f"Deposit accrual: {report.as_dict()}")
+    return report
+
+
+def _add(totals: dict, key, amount: Decimal) -> None:
+    entry = totals.setdefault(key, [Decimal("0"), 0])
+    entry[0] += amount
+    entry[1] += 1
+
+
+async def _mature_batch(db: AsyncSession, now: datetime, batch_size: int, report: RunReport) -> None:
+    rows = (await db.execute(CLAIM_MATURED_SQL, {"now": now, "batch_size": batch_size})).all()
+    if not rows:
+        return
+
+    report.claimed = len(rows)
+    payouts = [r for r in rows if r.on_maturity != "capitalize" and r.account_id is not None]
+    rollovers = [r for r in rows if r.on_maturity == "capitalize" or r.account_id is None]
+    interest = {r.id: interest_for(r.amount, r.rate, days_between(r.start_date, r.end_date)) for r in rows}
+
+    credits: dict[int, Decimal] = {}
+    tx_accounts, tx_amounts, tx_categories, tx_category_ids = [], [], [], []
+    rollups: dict[tuple[int, int], list] = {}
+    for r in payouts:
+        credits[r.account_id] = credits.get(r.account_id, Decimal("0")) + r.amount + interest[r.id]
+        tx_accounts.append(r.account_id)
+        tx_amounts.append(r.amount)
+        tx_categories.append(f"Закрытие вклада ({r.type.upper()}): срок истек")
+        tx_category_ids.append(categories.DEPOSIT_CLOSE)
+        _add(rollups, (r.user_id, categories.DEPOSIT_CLOSE), r.amount)
+        if interest[r.id] > 0:
+            tx_accounts.append(r.account_id)
+            tx_amounts.append(interest[r.id])
+            tx_categories.append(f"Проценты по вкладу ({r.type.upper()})")
+            tx_category_ids.append(categories.DEPOSIT_INTEREST)
+            _add(rollups, (r.user_id, categories.DEPOSIT_INTEREST), interest[r.id])
+
+    if credits:
+        await db.execute(LOCK_PAYOUT_ACCOUNTS_SQL, {"ids": sorted(credits)})
+    result = (await db.execute(APPLY_MATURED_SQL, {
+        "now": now,
+        "tz": settings.ANALYTICS_TIMEZONE,
+        "credit_ids": list(credits),
+        "credit_amounts": list(credits.values()),
+        "payout_ids": [r.id for r in payouts],
+        "payout_interest": [interest[r.id] for r in payouts],
+        "rollover_ids": [r.id for r in rollovers],
+        "rollover_interest": [interest[r.id] for r in rollovers],
+        "tx_accounts": tx_accounts,
+        "tx_amounts": tx_amounts,
+        "tx_categories": tx_categories,
+        "tx_category_ids": tx_category_ids,
+        "rollup_users": [k[0] for k in rollups],
+        "rollup_categories": [k[1] for k in rollups],
+        "rollup_totals": [v[0] for v in rollups.values()],
+        "rollup_counts": [v[1] for v in rollups.values()],
+    })).one()
+
+    await enqueue_notifications(db, [
+        {"user_id": r.user_id, "kind": "deposit_matured",
+         "body": f"Срок вклада истек: на счет зачислено {r.amount + interest[r.id]} ₸ (проценты {interest[r.id]} ₸)"}
+        for r in payouts
+    ] + [
+        {"user_id": r.user_id, "kind": "deposit_capitalized",
+         "body": f"Вклад продлен: проценты {interest[r.id]} ₸ добавлены к сумме, новый срок до "
+                 f"{(r.end_date + timedelta(days=30 * r.term_months)).date().isoformat()}"}
+        for r in rollovers
+    ])
+
+    report.paid += int(result.closed) + int(result.rolled)
+    report.closed += int(result.closed)
+    report.amount += sum((interest[r.id] for r in rows), Decimal("0"))
+    for r in rows:
+        report.observe_lag((now - r.end_date).total_seconds())
+
+
+async def process_matured_deposits(clock=None, batch_size: int | None = None) -> RunReport:
+    """Фоновая задача: выплата или капитализация вкладов с истекшим сроком"""
+    return await run_batches("deposit_maturity", _mature_batch, clock, batch_size)
+
+
+async def run_deposit_jobs(clock=None) -> None:
+    """Сначала закрываем истекшие вклады, потом начисляем остальным — одна задача в планировщике"""
+    await process_matured_deposits(clock)
+    await accrue_deposits(clock)
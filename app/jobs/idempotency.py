@@ -0,0 +1,15 @@
+"""
+Очистка idempotency_keys: просроченный ключ уже не возвращается (условие expires_at > now()),
+но строка и запись в уникальном индексе остаются, пока их не удалить.
+"""
+from sqlalchemy import text
+
+from app.db.database import engine
+
+PURGE_SQL = text("DELETE FROM idempotency_keys WHERE expires_at <= now()")
+
+
+async def purge_expired_idempotency_keys() -> int:
+    async with engine.begin() as conn:
+        result = await conn.execute(PURGE_SQL)
+    return result.rowcount
@@ -0,0 +1,56 @@
+"""
+Окончание срока страховых полисов.
+
+Полис с истекшим end_date выключается пачками по INSURANCE_EXPIRY_BATCH_SIZE: одна команда
+выбирает наступившие полисы по частичному индексу ix_insurances_active_end_date
+(FOR UPDATE SKIP LOCKED — не мешаем ежемесячному списанию и ручной отмене) и сразу их обновляет.
+До прогона чтения и так не показывают истекшие полисы (фильтр по end_date в routers/insurance.py).
+
+Метрики — общие с плановыми списаниями (scheduler_*{job="insurance_expiry"}).
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.notifications import enqueue_notifications
+from app.jobs.scheduler import RunReport, run_batches
+
+EXPIRE_SQL = text("""
+WITH due AS (
+    SELECT id FROM insurances
+    WHERE is_active IS TRUE AND end_date <= :now
+    ORDER BY end_date, id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE insurances i
+SET is_active = FALSE, next_billing_at = NULL, billing_retry_at = NULL
+FROM due
+WHERE i.id = due.id
+RETURNING i.id, i.user_id, i.insurance_type, i.end_date
+""")
+
+
+async def _expire_batch(db: AsyncSession, now: datetime, batch_size: int, report: RunReport) -> None:
+    rows = (await db.execute(EXPIRE_SQL, {"now": now, "batch_size": batch_size})).all()
+    if not rows:
+        return
+
+    await enqueue_notifications(db, [
+        {"user_id": r.user_id, "kind": "insurance_expired",
+         "body": f"Срок полиса {r.insurance_type.upper()} истек"}
+        for r in rows
+    ])
+    report.claimed = len(rows)
+    report.closed = len(rows)
+    for r in rows:
+        report.observe_lag((now - r.end_date).total_seconds())
+
+
+async def expire_insurances(clock=None, batch_size: int | None = None) -> RunReport:
+    """Фоновая задача: выключает полисы с истекшим сроком"""
+    return await run_batches(
+        "insurance_expiry", _expire_batch, clock, batch_size or settings.INSURANCE_EXPIRY_BATCH_SIZE,
+    )
@@ -0,0 +1,182 @@
+"""
+Диспетчер notification_outbox.
+
+1. Забирает пачку готовых строк (FOR UPDATE SKIP LOCKED — можно в нескольких воркерах)
+   и сразу сдвигает им next_attempt_at на время аренды. Блокировки на время отправки
+   не держим: если воркер упал, строки вернутся в очередь, когда аренда истечет.
+   Аренда покрывает худший случай: ceil(пачка / NOTIFY_CONCURRENCY) волн по таймауту плюс запас.
+2. Отправляет параллельно (не больше NOTIFY_CONCURRENCY), у каждого вызова таймаут,
+   у всей пачки — общий срок короче аренды: недосланное к сроку уходит на повтор,
+   и другой воркер не заберет строки, пока эта пачка еще отправляет.
+3. Успешные — status = 'sent'; ошибки — повтор с экспоненциальной задержкой,
+   после NOTIFY_MAX_ATTEMPTS (или при PermanentSendError, в т.ч. у клиента не привязан
+   Telegram) — status = 'dead'.
+4. Строки kind = 'otp' удаляются сразу, как только стали sent или dead: код в открытом виде
+   не должен лежать в БД дольше, чем нужно для отправки (в otp_store он хранится только хешем).
+   Неотправленные OTP старше OTP_TTL_SECONDS удаляются перед каждым захватом пачки: код уже
+   не примут, а повторы (до NOTIFY_RETRY_MAX_DELAY) иначе доставили бы его после истечения.
+"""
+import asyncio
+import math
+import random
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.notifications import NotificationSender, PermanentSendError, sender as default_sender
+from app.db.database import engine
+
+# Просроченный код не досылаем: dead + удаление сразу, одной командой
+EXPIRE_OTP_SQL = text("""
+DELETE FROM notification_outbox
+WHERE kind = 'otp' AND status = 'pending' AND created_at <= now() - make_interval(secs => :ttl)
+""")
+
+CLAIM_SQL = text("""
+UPDATE notification_outbox o
+SET attempts = o.attempts + 1,
+    next_attempt_at = now() + make_interval(secs => :lease)
+WHERE o.id IN (
+    SELECT id FROM notification_outbox
+    WHERE status = 'pending' AND next_attempt_at <= now()
+    ORDER BY next_attempt_at
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING o.id, o.kind, o.body, o.attempts,
+          (SELECT u.telegram_chat_id FROM users u WHERE u.id = o.user_id) AS chat_id
+""")
+
+MARK_SENT_SQL = text("""
+UPDATE notification_outbox
+SET status = 'sent', sent_at = now(), last_error = NULL
+WHERE id = ANY(CAST(:ids AS BIGINT[]))
+""")
+
+MARK_FAILED_SQL = text("""
+UPDATE notification_outbox o
+SET status = CASE WHEN f.dead THEN 'dead' ELSE 'pending' END,
+    next_attempt_at = now() + make_interval(secs => f.delay),
+    last_error = f.error
+FROM unnest(
+    CAST(:ids AS BIGINT[]), CAST(:delays AS DOUBLE PRECISION[]),
+    CAST(:errors AS TEXT[]), CAST(:dead AS BOOLEAN[])
+) AS f(id, delay, error, dead)
+WHERE o.id = f.id
+""")
+
+# Без окна хранения и без разбора dead: тело OTP содержит сам код
+SCRUB_OTP_SQL = text("""
+DELETE FROM notification_outbox
+WHERE id = ANY(CAST(:ids AS BIGINT[])) AND kind = 'otp' AND status IN ('sent', 'dead')
+""")
+
+PURGE_SENT_SQL = text("""
+DELETE FROM notification_outbox
+WHERE (status = 'sent' AND sent_at < now() - make_interval(secs => :retention))
+   OR (kind = 'otp' AND status IN ('sent', 'dead'))
+""")
+
+
+def batch_deadline(batch_size: int) -> float:
+    """Сколько может идти отправка пачки: волны по NOTIFY_CONCURRENCY, каждая до таймаута"""
+    return math.ceil(batch_size / settings.NOTIFY_CONCURRENCY) * settings.NOTIFY_TIMEOUT_SECONDS
+
+
+def lease_seconds(batch_size: int) -> float:
+    return batch_deadline(batch_size) + settings.NOTIFY_LEASE_MARGIN_SECONDS
+
+
+def retry_delay(attempts: int) -> float:
+    delay = settings.NOTIFY_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+    delay = min(delay, settings.NOTIFY_RETRY_MAX_DELAY)
+    return delay * (0.5 + random.random() / 2)
+
+
+async def _send_one(sender: NotificationSender, slots: asyncio.Semaphore, row) -> str | None:
+    """None — отправлено, иначе текст ошибки; PermanentSendError пробрасывается"""
+    async with slots:
+        try:
+            async with asyncio.timeout(settings.NOTIFY_TIMEOUT_SECONDS):
+                await sender.send(row.chat_id, row.body)
+            return None
+        except PermanentSendError:
+            raise
+        except TimeoutError:
+            return "timeout"
+        except Exception as e:
+            return str(e)[:500] or type(e).__name__
+
+
+async def dispatch_batch(sender: NotificationSender, batch_size: int) -> dict:
+    async with engine.begin() as conn:
+        expired = (await conn.execute(EXPIRE_OTP_SQL, {"ttl": settings.OTP_TTL_SECONDS})).rowcount
+        rows = (await conn.execute(CLAIM_SQL, {
+            "batch_size": batch_size,
+            "lease": lease_seconds(batch_size),
+        })).all()
+    if not rows:
+        return {"claimed": 0, "sent": 0, "retried": 0, "dead": 0, "expired": expired}
+
+    slots = asyncio.Semaphore(settings.NOTIFY_CONCURRENCY)
+    tasks = [asyncio.create_task(_send_one(sender, slots, row)) for row in rows]
+    _, pending = await asyncio.wait(tasks, timeout=batch_deadline(batch_size))
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    results = [
+        "batch deadline" if task.cancelled() else (task.exception() or task.result())
+        for task in tasks
+    ]
+
+    sent_ids, failed = [], []
+    for row, result in zip(rows, results):
+        if result is None:
+            sent_ids.append(row.id)
+        elif isinstance(result, PermanentSendError):
+            failed.append((row.id, 0.0, str(result)[:500], True))
+        else:
+            error = repr(result)[:500] if isinstance(result, BaseException) else result
+            failed.append((row.id, retry_delay(row.attempts), error, row.attempts >= settings.NOTIFY_MAX_ATTEMPTS))
+
+    async with engine.begin() as conn:
+        if sent_ids:
+            await conn.execute(MARK_SENT_SQL, {"ids": sent_ids})
+        if failed:
+            ids, delays, errors, dead = (list(col) for col in zip(*failed))
+            await conn.execute(MARK_FAILED_SQL, {"ids": ids, "delays": delays, "errors": errors, "dead": dead})
+        finished = set(sent_ids) | {f[0] for f in failed if f[3]}
+        otp_ids = [row.id for row in rows if row.kind == "otp" and row.id in finished]
+        if otp_ids:
+            await conn.execute(SCRUB_OTP_SQL, {"ids": otp_ids})
+
+    dead_count = sum(1 for f in failed if f[3])
+    return {
+        "claimed": len(rows), "sent": len(sent_ids), "retried": len(failed) - dead_count, "dead": dead_count,
+        "expired": expired,
+    }
+
+
+async def dispatch_notifications(sender: NotificationSender | None = None, batch_size: int | None = None) -> dict:
+    """Фоновая задача: отправляет все, что готово к отправке; возвращает статистику прогона"""
+    sender = sender or default_sender
+    batch_size = batch_size or settings.NOTIFY_BATCH_SIZE
+    stats = {"claimed": 0, "sent": 0, "retried": 0, "dead": 0, "expired": 0}
+    while True:
+        batch = await dispatch_batch(sender, batch_size)
+        for key, value in batch.items():
+            stats[key] += value
+        if batch["claimed"] < batch_size:
+            break
+    return stats
+
+
+async def purge_sent_notifications() -> int:
+    """
+    Фоновая задача: удаляет отправленные уведомления старше NOTIFY_RETENTION_SECONDS (dead остаются для разбора).
+    OTP в sent/dead удаляются без окна — подчищает строки, записанные до того, как их стал удалять dispatch_batch.
+    """
+    async with engine.begin() as conn:
+        result = await conn.execute(PURGE_SENT_SQL, {"retention": settings.NOTIFY_RETENTION_SECONDS})
+    return result.rowcount
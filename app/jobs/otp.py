@@ -0,0 +1,15 @@
+"""
+Очистка otp_codes: просроченные коды не мешают проверке (там условие expires_at > now()),
+но занимают место, если их так и не проверили.
+"""
+from sqlalchemy import text
+
+from app.db.database import engine
+
+PURGE_SQL = text("DELETE FROM otp_codes WHERE expires_at <= now()")
+
+
+async def purge_expired_otps() -> int:
+    async with engine.begin() as conn:
+        result = await conn.execute(PURGE_SQL)
+    return result.rowcount
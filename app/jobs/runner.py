@@ -0,0 +1,47 @@
+"""
+Простой планировщик периодических фоновых задач внутри процесса API.
+Задачи должны быть безопасны для параллельного запуска в нескольких
+воркерах (FOR UPDATE SKIP LOCKED и т.п.).
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+
+@dataclass
+class PeriodicJob:
+    name: str
+    interval: float  # Секунды между запусками
+    func: Callable[[], Awaitable[object]]
+
+
+class JobRunner:
+    def __init__(self):
+        self._jobs: list[PeriodicJob] = []
+        self._tasks: list[asyncio.Task] = []
+
+    def register(self, name: str, interval: float, func: Callable[[], Awaitable[object]]) -> None:
+        self._jobs.append(PeriodicJob(name=name, interval=interval, func=func))
+
+    async def _loop(self, job: PeriodicJob):
+        while True:
+            try:
+                await job.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job '{job.name}' Error: {e}")
+            await asyncio.sleep(job.interval)
+
+    def start(self) -> None:
+        for job in self._jobs:
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+jobs = JobRunner()
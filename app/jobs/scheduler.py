@@ -0,0 +1,436 @@
+"""
+Плановые списания: автоплатеж по кредитам и ежемесячная оплата страховок.
+
+Каждая пачка — одна транзакция:
+1. Забираем до SCHEDULER_BATCH_SIZE наступивших позиций (FOR UPDATE SKIP LOCKED —
+   несколько воркеров делят очередь и не спишут одно и то же дважды).
+2. Блокируем счета владельцев в порядке id (как переводы, без дедлоков).
+3. Решаем в Python, что хватает денег оплатить; платежи по одному кредиту — строго по порядку.
+4. Пишем результат одним выражением: списания, отметки об оплате, агрегаты, transactions,
+   свертки трат — все через unnest. Чеки — в outbox одним INSERT.
+
+Не хватило денег: платеж по кредиту повторяется через AUTOPAY_RETRY_SECONDS;
+страховка ждет оплату INSURANCE_GRACE_SECONDS после срока, потом полис прекращается.
+
+Время берется из clock (app/core/clock.py) и передается в SQL как :now,
+поэтому прогон можно проверить на FakeClock, сдвигая его на месяцы вперед.
+"""
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import categories
+from app.core.analytics import MONTH_AT_SQL, ROLLUP_CONFLICT_SQL
+from app.core.clock import system_clock
+from app.core.config import settings
+from app.core.metrics import SCHEDULER_ITEMS, SCHEDULER_LAG_SECONDS, SCHEDULER_RUN_SECONDS, SCHEDULER_THROUGHPUT
+from app.core.notifications import enqueue_notifications
+from app.core.transfer_engine import run_with_retry
+from app.db.database import AsyncSessionLocal
+
+# Строки кредита блокируются вместе с платежом: ручная оплата (/loans/{id}/pay) берет ту же
+# блокировку первой, поэтому кредит, который сейчас гасят вручную, пачка просто пропустит.
+# Платеж не берется, пока более ранний платеж того же кредита ждет повтора.
+CLAIM_LOAN_SQL = text("""
+SELECT s.id, s.loan_id, s.amount, s.principal_amount, s.due_date, l.user_id, l.type
+FROM loan_schedules s
+JOIN loans l ON l.id = s.loan_id
+WHERE s.is_paid IS NOT TRUE
+  AND s.due_date <= :now
+  AND COALESCE(s.next_attempt_at, s.due_date) <= :now
+  AND l.is_active IS TRUE
+  AND l.autopay IS TRUE
+  AND NOT EXISTS (
+      SELECT 1 FROM loan_schedules e
+      WHERE e.loan_id = s.loan_id
+        AND e.is_paid IS NOT TRUE
+        AND e.due_date < s.due_date
+        AND e.next_attempt_at > :now
+  )
+ORDER BY s.due_date, s.id
+LIMIT :batch_size
+FOR UPDATE OF s, l SKIP LOCKED
+""")
+
+CLAIM_INSURANCE_SQL = text("""
+SELECT id, user_id, insurance_type, monthly_cost, next_billing_at, end_date
+FROM insurances
+WHERE payment_mode = 'monthly'
+  AND is_active IS TRUE
+  AND next_billing_at <= :now
+  AND COALESCE(billing_retry_at, next_billing_at) <= :now
+ORDER BY next_billing_at, id
+LIMIT :batch_size
+FOR UPDATE SKIP LOCKED
+""")
+
+LOCK_ACCOUNTS_SQL = text("""
+SELECT id, user_id, balance FROM accounts
+WHERE user_id = ANY(CAST(:user_ids AS INTEGER[])) AND is_blocked IS NOT TRUE
+ORDER BY id
+FOR UPDATE
+""")
+
+# Общая часть записи: списания, transactions, свертки трат
+_POSTING_CTES = f"""
+debits AS (
+    UPDATE accounts a
+    SET balance = a.balance - d.amount
+    FROM unnest(CAST(:debit_ids AS INTEGER[]), CAST(:debit_amounts AS NUMERIC[])) AS d(id, amount)
+    WHERE a.id = d.id
+    RETURNING a.id
+),
+posted AS (
+    INSERT INTO transactions (from_account_id, to_account_id, amount, category, created_at,
+                              category_id, provider, merchant)
+    SELECT t.account_id, NULL, t.amount, t.category, CAST(:now AS TIMESTAMPTZ),
+           CAST(:category_id AS SMALLINT), t.provider, NULL
+    FROM unnest(
+        CAST(:tx_accounts AS INTEGER[]), CAST(:tx_amounts AS NUMERIC[]),
+        CAST(:tx_categories AS VARCHAR[]), CAST(:tx_providers AS VARCHAR[])
+    ) AS t(account_id, amount, category, provider)
+    RETURNING id
+),
+rollup AS (
+    INSERT INTO spending_rollups (user_id, month, category_id, total, tx_count)
+    SELECT r.user_id, {MONTH_AT_SQL}, CAST(:category_id AS SMALLINT), r.total, r.n
+    FROM unnest(
+        CAST(:rollup_users AS INTEGER[]), CAST(:rollup_totals AS NUMERIC[]), CAST(:rollup_counts AS INTEGER[])
+    ) AS r(user_id, total, n)
+    {ROLLUP_CONFLICT_SQL}
+)"""
+
+APPLY_LOANS_SQL = text(f"""
+WITH {_POSTING_CTES},
+paid AS (
+    UPDATE loan_schedules
+    SET is_paid = TRUE, next_attempt_at = NULL
+    WHERE id = ANY(CAST(:paid_ids AS INTEGER[]))
+    RETURNING id
+),
+retry AS (
+    UPDATE loan_schedules
+    SET next_attempt_at = CAST(:retry_at AS TIMESTAMPTZ)
+    WHERE id = ANY(CAST(:failed_ids AS INTEGER[]))
+    RETURNING id
+),
+loan_totals AS (
+    -- Те же правила, что apply_installment_payment в routers/loans.py
+    UPDATE loans l
+    SET remaining_installments = GREATEST(COALESCE(l.remaining_installments, 0) - u.n, 0),
+        remaining_amount = GREATEST(COALESCE(l.remaining_amount, 0) - u.amount, 0),
+        outstanding_principal = GREATEST(l.outstanding_principal - u.principal, 0),
+        is_active = COALESCE(l.remaining_installments, 0) - u.n > 0
+    FROM unnest(
+        CAST(:loan_ids AS INTEGER[]), CAST(:loan_counts AS INTEGER[]),
+        CAST(:loan_amounts AS NUMERIC[]), CAST(:loan_principals AS NUMERIC[])
+    ) AS u(id, n, amount, principal)
+    WHERE l.id = u.id
+    RETURNING l.id, l.is_active
+)
+SELECT (SELECT count(*) FROM posted) AS posted,
+       (SELECT count(*) FROM loan_totals WHERE NOT is_active) AS closed
+""")
+
+APPLY_INSURANCE_SQL = text(f"""
+WITH {_POSTING_CTES},
+billed AS (
+    UPDATE insurances i
+    SET next_billing_at = CASE WHEN b.next_at < i.end_date THEN b.next_at END,
+        billing_retry_at = NULL
+    FROM unnest(CAST(:paid_ids AS INTEGER[]), CAST(:paid_next AS TIMESTAMPTZ[])) AS b(id, next_at)
+    WHERE i.id = b.id
+    RETURNING i.id
+),
+retry AS (
+    UPDATE insurances
+    SET billing_retry_at = CAST(:retry_at AS TIMESTAMPTZ)
+    WHERE id = ANY(CAST(:failed_ids AS INTEGER[]))
+    RETURNING id
+),
+lapsed AS (
+    UPDATE insurances
+    SET is_active = FALSE, next_billing_at = NULL, billing_retry_at = NULL
+    WHERE id = ANY(CAST(:lapsed_ids AS INTEGER[]))
+    RETURNING id
+)
+SELECT (SELECT count(*) FROM posted) AS posted
+""")
+
+
+@dataclass
+class RunReport:
+    """Итог прогона; throughput и lag уходят и в /metrics"""
+    job: str
+    started_at: datetime
+    batches: int = 0
+    claimed: int = 0
+    paid: int = 0
+    failed: int = 0
+    closed: int = 0  # Кредиты, погашенные полностью / полисы, прекращенные за неуплату
+    amount: Decimal = Decimal("0")
+    max_lag_seconds: float = 0.0
+    total_lag_seconds: float = 0.0
+    duration_seconds: float = 0.0
+    lags: list[float] = field(default_factory=list, repr=False)  # Для гистограммы после коммита
+
+    @property
+    def throughput(self) -> float:
+        """Позиций в секунду (по реальному времени, не по clock)"""
+        return self.claimed / self.duration_seconds if self.duration_seconds else 0.0
+
+    @property
+    def avg_lag_seconds(self) -> float:
+        return self.total_lag_seconds / self.claimed if self.claimed else 0.0
+
+    def observe_lag(self, lag_seconds: float) -> None:
+        lag_seconds = max(lag_seconds, 0.0)
+        self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+        self.total_lag_seconds += lag_seconds
+        self.lags.append(lag_seconds)
+
+    def merge(self, batch: "RunReport") -> None:
+        self.batches += 1
+        self.claimed += batch.claimed
+        self.paid += batch.paid
+        self.failed += batch.failed
+        self.closed += batch.closed
+        self.amount += batch.amount
+        self.max_lag_seconds = max(self.max_lag_seconds, batch.max_lag_seconds)
+        self.total_lag_seconds += batch.total_lag_seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "job": self.job,
+            "started_at": self.started_at.isoformat(),
+            "batches": self.batches,
+            "claimed": self.claimed,
+            "paid": self.paid,
+            "failed": self.failed,
+            "closed": self.closed,
+            "amount": str(self.amount),
+            "throughput_per_second": round(self.throughput, 1),
+            "avg_lag_seconds": round(self.avg_lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3),
+            "duration_seconds": round(self.duration_seconds, 3),
+        }
+
+
+@dataclass
+class _Charge:
+    item_id: int
+    user_id: int
+    amount: Decimal
+    due_at: datetime
+    account_id: int | None = None  # None — не хватило денег
+
+
+def _allocate(charges: list[_Charge], accounts, blocked_groups: dict[int, object] | None = None) -> None:
+    """
+    Раскладывает списания по счетам владельцев: первая по id карта, где хватает остатка.
+    blocked_groups: item_id -> ключ группы; после первой неудачи в группе остальные
+    позиции группы не оплачиваются (платежи по кредиту — только по порядку).
+    """
+    balances: dict[int, list] = {}
+    for acc in accounts:
+        balances.setdefault(acc.user_id, []).append([acc.id, acc.balance])
+
+    failed_groups = set()
+    for charge in charges:
+        group = blocked_groups.get(charge.item_id) if blocked_groups else None
+        if group is not None and group in failed_groups:
+            continue
+        for slot in balances.get(charge.user_id, []):
+            if slot[1] >= charge.amount:
+                slot[1] -= charge.amount
+                charge.account_id = slot[0]
+                break
+        if charge.account_id is None and group is not None:
+            failed_groups.add(group)
+
+
+def _posting_params(charges: list[_Charge], now: datetime, category_id: int, describe) -> dict:
+    paid = [c for c in charges if c.account_id is not None]
+    debits: dict[int, Decimal] = {}
+    rollups: dict[int, list] = {}
+    for c in paid:
+        debits[c.account_id] = debits.get(c.account_id, Decimal("0")) + c.amount
+        total = rollups.setdefault(c.user_id, [Decimal("0"), 0])
+        total[0] += c.amount
+        total[1] += 1
+    described = [describe(c) for c in paid]
+    return {
+        "now": now,
+        "tz": settings.ANALYTICS_TIMEZONE,
+        "category_id": category_id,
+        "debit_ids": list(debits),
+        "debit_amounts": list(debits.values()),
+        "tx_accounts": [c.account_id for c in paid],
+        "tx_amounts": [c.amount for c in paid],
+        "tx_categories": [d[0] for d in described],
+        "tx_providers": [d[1] for d in described],
+        "rollup_users": list(rollups),
+        "rollup_totals": [r[0] for r in rollups.values()],
+        "rollup_counts": [r[1] for r in rollups.values()],
+    }
+
+
+async def _collect_loan_batch(db: AsyncSession, now: datetime, batch_size: int, report: RunReport) -> None:
+    rows = (await db.execute(CLAIM_LOAN_SQL, {"now": now, "batch_size": batch_size})).all()
+    if not rows:
+        return
+
+    report.claimed = len(rows)
+    by_id = {r.id: r for r in rows}
+    charges = [_Charge(r.id, r.user_id, r.amount, r.due_date) for r in rows]
+    accounts = (await db.execute(LOCK_ACCOUNTS_SQL, {"user_ids": sorted({r.user_id for r in rows})})).all()
+    _allocate(charges, accounts, blocked_groups={r.id: r.loan_id for r in rows})
+
+    paid = [c for c in charges if c.account_id is not None]
+    failed = [c for c in charges if c.account_id is None]
+    loans: dict[int, list] = {}
+    for c in paid:
+        row = by_id[c.item_id]
+        totals = loans.setdefault(row.loan_id, [0, Decimal("0"), Decimal("0")])
+        totals[0] += 1
+        totals[1] += row.amount
+        totals[2] += row.principal_amount or Decimal("0")
+
+    params = _posting_params(
+        charges, now, categories.LOAN_REPAYMENT,
+        lambda c: (f"Автоплатеж по кредиту ({by_id[c.item_id].type})", None),
+    )
+    params.update({
+        "paid_ids": [c.item_id for c in paid],
+        "failed_ids": [c.item_id for c in failed],
+        "retry_at": now + timedelta(seconds=settings.AUTOPAY_RETRY_SECONDS),
+        "loan_ids": list(loans),
+        "loan_counts": [t[0] for t in loans.values()],
+        "loan_amounts": [t[1] for t in loans.values()],
+        "loan_principals": [t[2] for t in loans.values()],
+    })
+    result = (await db.execute(APPLY_LOANS_SQL, params)).one()
+
+    receipts = [
+        {"user_id": c.user_id, "kind": "loan_autopay", "body": f"Автоплатеж по кредиту: -{c.amount} ₸"}
+        for c in paid
+    ] + [
+        {"user_id": c.user_id, "kind": "loan_autopay_failed",
+         "body": f"Не удалось списать платеж по кредиту {c.amount} ₸: пополните счет"}
+        for c in failed
+    ]
+    await enqueue_notifications(db, receipts)
+
+    report.paid += len(paid)
+    report.failed += len(failed)
+    report.closed += int(result.closed)
+    report.amount += sum((c.amount for c in paid), Decimal("0"))
+    for c in charges:
+        report.observe_lag((now - c.due_at).total_seconds())
+
+
+async def _bill_insurance_batch(db: AsyncSession, now: datetime, batch_size: int, report: RunReport) -> None:
+    rows = (await db.execute(CLAIM_INSURANCE_SQL, {"now": now, "batch_size": batch_size})).all()
+    if not rows:
+        return
+
+    report.claimed = len(rows)
+    by_id = {r.id: r for r in rows}
+    charges = [_Charge(r.id, r.user_id, r.monthly_cost, r.next_billing_at) for r in rows]
+    accounts = (await db.execute(LOCK_ACCOUNTS_SQL, {"user_ids": sorted({r.user_id for r in rows})})).all()
+    _allocate(charges, accounts)
+
+    period = timedelta(days=settings.INSURANCE_BILLING_PERIOD_DAYS)
+    grace = timedelta(seconds=settings.INSURANCE_GRACE_SECONDS)
+    paid = [c for c in charges if c.account_id is not None]
+    lapsed = [c for c in charges if c.account_id is None and now - c.due_at >= grace]
+    retry = [c for c in charges if c.account_id is None and now - c.due_at < grace]
+
+    params = _posting_params(
+        charges, now, categories.INSURANCE,
+        lambda c: (f"Страхование: {by_id[c.item_id].insurance_type.upper()} (ежемесячно)",
+                   by_id[c.item_id].insurance_type[:64]),
+    )
+    params.update({
+        "paid_ids": [c.item_id for c in paid],
+        "paid_next": [c.due_at + period for c in paid],
+        "failed_ids": [c.item_id for c in retry],
+        "lapsed_ids": [c.item_id for c in lapsed],
+        "retry_at": now + timedelta(seconds=settings.AUTOPAY_RETRY_SECONDS),
+    })
+    await db.execute(APPLY_INSURANCE_SQL, params)
+
+    receipts = [
+        {"user_id": c.user_id, "kind": "insurance_billing",
+         "body": f"Оплата страховки {by_id[c.item_id].insurance_type.upper()}: -{c.amount} ₸"}
+        for c in paid
+    ] + [
+        {"user_id": c.user_id, "kind": "insurance_billing_failed",
+         "body": f"Не удалось оплатить страховку {by_id[c.item_id].insurance_type.upper()}: пополните счет"}
+        for c in retry
+    ] + [
+        {"user_id": c.user_id, "kind": "insurance_lapsed",
+         "body": f"Полис {by_id[c.item_id].insurance_type.upper()} прекращен из-за неуплаты"}
+        for c in lapsed
+    ]
+    await enqueue_notifications(db, receipts)
+
+    report.paid += len(paid)
+    report.failed += len(retry) + len(lapsed)
+    report.closed += len(lapsed)
+    report.amount += sum((c.amount for c in paid), Decimal("0"))
+    for c in charges:
+        report.observe_lag((now - c.due_at).total_seconds())
+
+
+async def run_batches(job: str, process_batch, clock, batch_size: int | None) -> RunReport:
+    """
+    Гоняет process_batch(session, now, batch_size, batch_report) пачками до пустой очереди;
+    каждая пачка — своя транзакция с повтором при serialization failure.
+    """
+    clock = clock or system_clock
+    batch_size = batch_size or settings.SCHEDULER_BATCH_SIZE
+    now = clock.now()
+    report = RunReport(job=job, started_at=now)
+    started = time.perf_counter()
+
+    async def operation(session: AsyncSession) -> RunReport:
+        # Свой отчет на каждую попытку: после отката пачка пересчитывается с нуля
+        batch = RunReport(job=job, started_at=now)
+        await process_batch(session, now, batch_size, batch)
+        return batch
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            batch, _ = await run_with_retry(db, operation)
+            if not batch.claimed:
+                break
+            report.merge(batch)
+            for lag in batch.lags:
+                SCHEDULER_LAG_SECONDS.observe(job, value=lag)
+            if batch.claimed < batch_size:
+                break
+
+    report.duration_seconds = time.perf_counter() - started
+    SCHEDULER_RUN_SECONDS.observe(job, value=report.duration_seconds)
+    SCHEDULER_THROUGHPUT.set(job, value=report.throughput)
+    SCHEDULER_ITEMS.inc(job, "paid", amount=report.paid)
+    SCHEDULER_ITEMS.inc(job, "failed", amount=report.failed)
+    SCHEDULER_ITEMS.inc(job, "closed", amount=report.closed)
+    if report.claimed:
+        print(f"Scheduler '{job}': {report.as_dict()}")
+    return report
+
+
+async def collect_loan_autopay(clock=None, batch_size: int | None = None) -> RunReport:
+    """Фоновая задача: списывает наступившие платежи по кредитам с автоплатежом"""
+    return await run_batches("loan_autopay", _collect_loan_batch, clock, batch_size)
+
+
+async def bill_insurances(clock=None, batch_size: int | None = None) -> RunReport:
+    """Фоновая задача: ежемесячные списания по полисам с payment_mode = 'monthly'"""
+    return await run_batches("insurance_billing", _bill_insurance_batch, clock, batch_size)
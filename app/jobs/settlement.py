@@ -0,0 +1,82 @@
+"""
+Неттинг платежей за услуги.
+
+Платеж только списывает деньги у клиента и пишет строку в pending_settlements.
+Эта задача пачками забирает строки (SKIP LOCKED — можно запускать в нескольких
+воркерах), суммирует по расчетным счетам и делает по одному UPDATE на счет.
+
+Новый баланс считается в numeric без ограничения; если он дошел до SETTLEMENT_SWEEP_AT,
+счет обнуляется, а вся сумма пишется в settlement_sweeps — так accounts.balance
+(Numeric(10, 2)) не переполняется и пачки не падают (см. app/core/settlement.py).
+"""
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.transfer_engine import run_with_retry
+from app.db.database import AsyncSessionLocal
+
+NET_BATCH_SQL = text("""
+WITH batch AS (
+    DELETE FROM pending_settlements
+    WHERE id IN (
+        SELECT id FROM pending_settlements
+        ORDER BY id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING account_id, amount
+),
+totals AS (
+    SELECT account_id, SUM(amount) AS total, COUNT(*) AS entries
+    FROM batch
+    GROUP BY account_id
+),
+netted AS (
+    SELECT a.id, a.balance + t.total AS balance
+    FROM accounts a
+    JOIN totals t ON t.account_id = a.id
+    ORDER BY a.id
+    FOR UPDATE OF a
+),
+applied AS (
+    UPDATE accounts a
+    SET balance = CASE WHEN c.balance >= :sweep_at THEN 0 ELSE c.balance END
+    FROM netted c
+    WHERE a.id = c.id
+    RETURNING a.id
+),
+swept AS (
+    INSERT INTO settlement_sweeps (account_id, amount)
+    SELECT id, balance FROM netted WHERE balance >= :sweep_at
+    RETURNING id
+)
+SELECT COALESCE(SUM(entries), 0) AS entries,
+       COUNT(*) AS accounts,
+       COALESCE(SUM(total), 0) AS amount,
+       (SELECT count(*) FROM swept) AS swept
+FROM totals
+""")
+
+
+async def net_pending_settlements(batch_size: int | None = None) -> dict:
+    """Сводит все накопившиеся платежи; возвращает статистику прогона"""
+    batch_size = batch_size or settings.SETTLEMENT_BATCH_SIZE
+    stats = {"entries": 0, "accounts": 0, "amount": 0, "swept": 0}
+
+    async def net_batch(db):
+        return (await db.execute(NET_BATCH_SQL, {
+            "batch_size": batch_size,
+            "sweep_at": settings.SETTLEMENT_SWEEP_AT,
+        })).one()
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            row, _ = await run_with_retry(db, net_batch)
+            stats["entries"] += int(row.entries)
+            stats["accounts"] += int(row.accounts)
+            stats["amount"] += row.amount
+            stats["swept"] += int(row.swept)
+            if row.entries < batch_size:
+                break
+
+    return stats
@@ -1,11 +1,61 @@
 from fastapi import FastAPI
-from app.core.config import settings
-from app.routers import auth, accounts, transfers, transactions, services, mfa, ai, loans, settings, deposits, insurance
+from app.core.config import settings as app_settings
+from app.routers import auth, accounts, transfers, transactions, services, mfa, ai, loans, settings, deposits, insurance, metrics, analytics
+from app.core.metrics import MetricsMiddleware
+from app.jobs.runner import jobs
+from app.jobs.settlement import net_pending_settlements
+from app.jobs.otp import purge_expired_otps
+from app.jobs.idempotency import purge_expired_idempotency_keys
+from app.jobs.scheduler import collect_loan_autopay, bill_insurances
+from app.jobs.deposits import run_deposit_jobs
+from app.jobs.insurance import expire_insurances
+from app.jobs.notifications import dispatch_notifications, purge_sent_notifications
+from app.core.notifications import sender as notification_sender
+from app.core.statements import shutdown_pdf_pool
+from app.core.cards import card_allocator
+from app.db.database import engine, pool_stats
+from app.db.warmup import warm_up_pool
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 import uvicorn
 
-app = FastAPI(title="Bank Super App")
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+jobs.register("settlement_netting", app_settings.SETTLEMENT_INTERVAL_SECONDS, net_pending_settlements)
+jobs.register("notification_dispatch", app_settings.NOTIFY_INTERVAL_SECONDS, dispatch_notifications)
+jobs.register("notification_purge", app_settings.NOTIFY_PURGE_INTERVAL_SECONDS, purge_sent_notifications)
+jobs.register("loan_autopay", app_settings.SCHEDULER_INTERVAL_SECONDS, collect_loan_autopay)
+jobs.register("insurance_billing", app_settings.SCHEDULER_INTERVAL_SECONDS, bill_insurances)
+jobs.register("deposit_accrual", app_settings.DEPOSIT_ACCRUAL_INTERVAL_SECONDS, run_deposit_jobs)
+jobs.register("insurance_expiry", app_settings.INSURANCE_EXPIRY_INTERVAL_SECONDS, expire_insurances)
+jobs.register("idempotency_purge", app_settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS, purge_expired_idempotency_keys)
+if app_settings.OTP_STORE == "postgres":
+    jobs.register("otp_purge", app_settings.OTP_PURGE_INTERVAL_SECONDS, purge_expired_otps)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Старт: прогреваем пул, чтобы первый запрос после деплоя не платил за соединение
+    if app_settings.DB_POOL_WARMUP:
+        await warm_up_pool()
+    try:
+        await card_allocator.warm_up()
+    except Exception as e:
+        # Не критично: первый новый счет зарезервирует блок сам
+        print(f"Card Allocator Error: {e}")
+    if app_settings.BACKGROUND_JOBS_ENABLED:
+        jobs.start()
+
+    yield
+
+    # Остановка: сначала задачи, потом закрываем соединения
+    await jobs.stop()
+    await notification_sender.aclose()
+    shutdown_pdf_pool()
+    await engine.dispose()
+
+
+app = FastAPI(title="Bank Super App", lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -26,6 +76,8 @@ app.include_router(loans.router)
 app.include_router(settings.router)
 app.include_router(deposits.router)
 app.include_router(insurance.router)
+app.include_router(analytics.router)
+app.include_router(metrics.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,6 +86,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Добавлен последним — внешний слой, меряет запрос целиком
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 async def root():
@@ -43,6 +97,11 @@ async def root():
     }
 
 
+@app.get("/health")
+async def health():
+    return {"status": "ok", "db_pool": pool_stats()}
+
+
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))  # Railway даст PORT=8080
@@ -1,5 +1,4 @@
-import random
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
@@ -10,6 +9,11 @@ from pydantic import BaseModel
 
 from decimal import Decimal
 from app.db.models import Transaction
+from app.core.query_budget import query_budget
+from app.core.idempotency import IdempotencyGuard, IdempotencyConflict
+from app.core import categories
+from app.core.analytics import add_to_rollup
+from app.core.cards import card_allocator
 from datetime import datetime
 
 router = APIRouter(prefix="/accounts", tags=["Accounts"])
@@ -35,22 +39,15 @@ class DepositRequest(BaseModel):
     card_number: str
     amount: float
 
-def generate_card_number():
-    """Генерирует случайный 16-значный номер, начинающийся с 4 (Visa)"""
-    # нужен алгоритм Луна.
-    prefix = "4000"
-    suffix = "".join([str(random.randint(0, 9)) for _ in range(12)])
-    return prefix + suffix
-
 @router.post("/create", response_model=AccountResponse)
+@query_budget(3)  # Третий — резерв блока номеров, если фоновая подгрузка не успела
 async def create_account(
         account_data: AccountCreate,
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
-    # Генерируем уникальный номер карты
-    # (в идеале надо проверять в цикле, нет ли такой карты в БД, но для MVP пропустим)
-    card_number = generate_card_number()
+    # Номер из зарезервированного процессом блока: уникален без проверки в БД
+    card_number = await card_allocator.allocate()
 
     # Создаем счет
     new_account = Account(
@@ -63,12 +60,12 @@ async def create_account(
 
     db.add(new_account)
     await db.commit()
-    await db.refresh(new_account)
 
     return new_account
 
 
 @router.get("/", response_model=list[AccountResponse])
+@query_budget(2)
 async def get_my_accounts(
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
@@ -80,6 +77,7 @@ async def get_my_accounts(
 
 
 @router.patch("/{account_id}/block")  # [cite: 88]
+@query_budget(3)
 async def block_account(
         account_id: int,
         db: AsyncSession = Depends(get_db),
@@ -100,6 +98,7 @@ async def block_account(
 
 
 @router.patch("/{account_id}/unblock")  # [cite: 90]
+@query_budget(3)
 async def unblock_account(
         account_id: int,
         db: AsyncSession = Depends(get_db),
@@ -119,8 +118,10 @@ async def unblock_account(
 
 
 @router.post("/deposit")
+@query_budget(6)
 async def deposit_money(
         deposit: DepositRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
         db: AsyncSession = Depends(get_db),
         # current_user: User = Depends(get_current_user) # Можно убрать, если хотим, чтобы это был "Публичный банкомат"
 ):
@@ -128,6 +129,11 @@ async def deposit_money(
     Эмуляция пополнения через банкомат/терминал.
     Не требует авторизации (или можно оставить, если нужно).
     """
+    # 0. Повтор с тем же Idempotency-Key (терминал без авторизации — ключи общие, тело сверяется)
+    guard = IdempotencyGuard("accounts.deposit:atm", idempotency_key, deposit)
+    if replay := await guard.replay(db):
+        return replay
+
     # 1. Ищем карту по номеру
     query = select(Account).where(Account.card_number == deposit.card_number)
     result = await db.execute(query)
@@ -155,15 +161,24 @@ async def deposit_money(
         to_account_id=account.id,
         amount=amount_decimal,
         category="ATM Deposit",  # Красивая категория для истории
+        category_id=categories.TOPUP,
         created_at=datetime.utcnow()
     )
 
     db.add(new_transaction)
-    await db.commit()
-    await db.refresh(account)
+    await add_to_rollup(db, user_id=account.user_id, category_id=categories.TOPUP, amount=amount_decimal)
 
-    return {
+    response = {
         "status": "success",
         "message": f"Зачислено {deposit.amount} {account.currency}",
         "new_balance": account.balance
-    }
\ No newline at end of file
+    }
+    try:
+        await guard.save(db, response)
+    except IdempotencyConflict:
+        await db.rollback()
+        return await guard.replay_after_conflict(db)
+    await db.commit()
+    guard.committed()
+
+    return response
\ No newline at end of file
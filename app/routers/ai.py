@@ -1,20 +1,42 @@
-import os
+import io
 import json
-import shutil
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import time
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from groq import Groq
+
+from cachetools import LRUCache
+from python_multipart.multipart import MultipartParser, parse_options_header
 
 from app.core.config import settings
+from app.core.intent import normalize_text, parse_transfer
+from app.core.llm import llm, LLMUnavailable
 from app.db.database import get_db
 from app.db.models import User, Account
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
 
 router = APIRouter(prefix="/ai", tags=["AI Assistant"])
 
-client = Groq(api_key=settings.GROQ_API_KEY)
+VOICE_FALLBACK_REPLY = "Не удалось распознать голос."
+CHAT_FALLBACK_REPLY = "Произошла ошибка при обработке команды."
+VOICE_FIELD = "file"
+VOICE_FORM_OVERHEAD = 16 * 1024  # Заголовки частей и boundary сверх самого аудио
+# Тело читается самим обработчиком, поэтому схему multipart для /docs описываем вручную
+VOICE_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "properties": {VOICE_FIELD: {"type": "string", "format": "binary"}},
+    "required": [VOICE_FIELD],
+}}}}}
+
+# Модель работает с temperature=0, поэтому ответ зависит только от текста и контекста баланса
+reply_cache = LRUCache(maxsize=settings.AI_CACHE_SIZE)
+# Распознанный текст по sha256 аудио
+transcription_cache = LRUCache(maxsize=settings.AI_CACHE_SIZE)
+
+ai_stats = {"fast_path": 0, "reply_cache_hits": 0, "transcription_cache_hits": 0, "llm_calls": 0}
 
 
 # --- Новая модель ответа ---
@@ -24,41 +46,126 @@ class ChatResponse(BaseModel):
     data: dict | None = None  # Данные для действия: {amount, phone}
 
 
-@router.post("/voice", response_model=ChatResponse)
+async def read_upload_limited(request: Request, max_bytes: int) -> tuple[str | None, io.BytesIO, bytes]:
+    """
+    Разбирает multipart прямо из request.stream() и копит поле "file" в памяти, не больше max_bytes.
+    UploadFile не используется: Starlette сбрасывает загрузки больше 1 МБ во временный файл
+    и отдает их обработчику только целиком. Здесь лимит срабатывает на первом лишнем куске.
+    Возвращает имя файла, буфер (позиция в начале) и sha256 содержимого, посчитанный по ходу чтения.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + VOICE_FORM_OVERHEAD:
+        raise HTTPException(status_code=413, detail="Аудио слишком большое")
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Ожидается multipart/form-data с полем file")
+
+    buffer = io.BytesIO()
+    digest = hashlib.sha256()
+    state = {"total": 0, "capture": False, "found": False, "filename": None}
+    headers: dict[bytes, bytes] = {}
+    field, value = bytearray(), bytearray()
+
+    def on_part_begin():
+        headers.clear()
+        state["capture"] = False
+
+    def on_header_field(data, start, end):
+        field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(field).lower()] = bytes(value)
+        field.clear()
+        value.clear()
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        if options.get(b"name") == VOICE_FIELD.encode() and not state["found"]:
+            state["capture"] = state["found"] = True
+            filename = options.get(b"filename")
+            state["filename"] = filename.decode("utf-8", errors="ignore") if filename else None
+
+    def on_part_data(data, start, end):
+        if not state["capture"]:
+            return
+        chunk = data[start:end]
+        state["total"] += len(chunk)
+        if state["total"] > max_bytes:
+            raise HTTPException(status_code=413, detail="Аудио слишком большое")
+        digest.update(chunk)
+        buffer.write(chunk)
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Voice Upload Error: {e}")
+        raise HTTPException(status_code=400, detail="Некорректное тело multipart")
+
+    if not state["found"]:
+        raise HTTPException(status_code=422, detail="Поле file не передано")
+    buffer.seek(0)
+    return state["filename"], buffer, digest.digest()
+
+
+@router.post("/voice", response_model=ChatResponse, openapi_extra=VOICE_OPENAPI)
+@query_budget(2)
 async def voice_chat(
-        file: UploadFile = File(...),
+        request: Request,
+        response: Response,
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
-    # 1. Сохраняем аудио файл временно
-    temp_filename = f"voice_{current_user.id}.m4a"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    try:
-        # 2. Распознавание речи (Whisper через Groq)
-        with open(temp_filename, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                file=(temp_filename, audio_file.read()),
-                model="whisper-large-v3",
-                response_format="json",
-                language="ru"  # Или auto
-            )
-        user_text = transcription.text
-        print(f"User said: {user_text}")
-
-        # Обрабатываем текст как команду
-        return await process_command(user_text, db, current_user)
-
-    except Exception as e:
-        print(f"Voice Error: {e}")
-        return {"reply": "Не удалось распознать голос."}
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+    timings = {}
+
+    # 1. Читаем аудио из потока запроса в память (без временных файлов на диске)
+    t0 = time.perf_counter()
+    filename, audio, audio_digest = await read_upload_limited(request, settings.AI_VOICE_MAX_BYTES)
+    timings["upload"] = time.perf_counter() - t0
+
+    # 2. Распознавание речи (Whisper через провайдера), повторное аудио — из кэша
+    t0 = time.perf_counter()
+    user_text = transcription_cache.get(audio_digest)
+    if user_text is None:
+        try:
+            user_text = await llm.transcribe(filename or "voice.m4a", audio)
+        except LLMUnavailable as e:
+            print(f"Voice Error: {e}")
+            return {"reply": VOICE_FALLBACK_REPLY}
+        transcription_cache[audio_digest] = user_text
+    else:
+        ai_stats["transcription_cache_hits"] += 1
+    timings["transcription"] = time.perf_counter() - t0
+    print(f"User said: {user_text}")
+
+    # 3. Обрабатываем текст как команду
+    t0 = time.perf_counter()
+    result = await process_command(user_text, db, current_user)
+    timings["intent"] = time.perf_counter() - t0
+
+    response.headers["Server-Timing"] = ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
+    return result
 
 
 @router.post("/chat", response_model=ChatResponse)
+@query_budget(2)
 async def text_chat(
         request: dict,  # Простой wrapper {message: str}
         db: AsyncSession = Depends(get_db),
@@ -68,6 +175,12 @@ async def text_chat(
 
 
 async def process_command(user_text: str, db: AsyncSession, user: User):
+    # 0. Быстрый путь: однозначная команда перевода разбирается локально, без БД и LLM
+    intent = parse_transfer(user_text)
+    if intent:
+        ai_stats["fast_path"] += 1
+        return intent.as_response()
+
     # Получаем контекст (баланс)
     query = select(Account).where(Account.user_id == user.id)
     result = await db.execute(query)
@@ -95,21 +208,18 @@ async def process_command(user_text: str, db: AsyncSession, user: User):
         "Всегда возвращай только валидный JSON."
     )
 
+    cache_key = (normalize_text(user_text), hashlib.sha256(finance_context.encode()).hexdigest())
+    cached = reply_cache.get(cache_key)
+    if cached is not None:
+        ai_stats["reply_cache_hits"] += 1
+        return cached
+
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_text}
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-
-        response_content = chat_completion.choices[0].message.content
+        ai_stats["llm_calls"] += 1
+        response_content = await llm.chat_json(system_prompt, user_text)
         ai_data = json.loads(response_content)
 
-        return {
+        reply = {
             "reply": ai_data.get("reply", "Готово"),
             "action": ai_data.get("action"),
             "data": {
@@ -117,7 +227,11 @@ async def process_command(user_text: str, db: AsyncSession, user: User):
                 "phone": ai_data.get("phone")
             } if ai_data.get("action") == "transfer" else None
         }
+        # Кэшируем только настоящие ответы модели, не запасные
+        reply_cache[cache_key] = reply
+        return reply
 
-    except Exception as e:
+    except (LLMUnavailable, ValueError) as e:
+        # ValueError — модель вернула невалидный JSON
         print(f"AI Error: {e}")
-        return {"reply": "Произошла ошибка при обработке команды."}
+        return {"reply": CHAT_FALLBACK_REPLY}
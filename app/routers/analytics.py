@@ -0,0 +1,86 @@
+from datetime import date, datetime
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core import categories
+from app.core.config import settings
+from app.core.query_budget import query_budget
+from app.db.database import get_db
+from app.db.models import User, SpendingRollup
+from app.dependencies import get_current_user
+
+router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+
+class CategorySpending(BaseModel):
+    code: str
+    name: str
+    kind: str
+    total: float
+    count: int
+    share: float  # Доля среди операций того же kind, 0..1
+
+
+class SpendingReport(BaseModel):
+    month: str
+    total_spent: float
+    total_income: float
+    categories: list[CategorySpending]
+
+
+def parse_month(month: str | None) -> date:
+    """'2026-03' -> date(2026, 3, 1); по умолчанию — текущий месяц в ANALYTICS_TIMEZONE"""
+    if not month:
+        now = datetime.now(ZoneInfo(settings.ANALYTICS_TIMEZONE))
+        return date(now.year, now.month, 1)
+    try:
+        parsed = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Месяц в формате ГГГГ-ММ")
+    return date(parsed.year, parsed.month, 1)
+
+
+@router.get("/spending", response_model=SpendingReport)
+@query_budget(2)
+async def get_spending(
+        month: str | None = None,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """Траты и поступления за месяц по категориям (из готовых сверток, без сканирования истории)"""
+    month_start = parse_month(month)
+    q = select(SpendingRollup.category_id, SpendingRollup.total, SpendingRollup.tx_count).where(
+        SpendingRollup.user_id == current_user.id,
+        SpendingRollup.month == month_start,
+    )
+    rows = (await db.execute(q)).all()
+
+    totals_by_kind: dict[str, Decimal] = {}
+    for category_id, total, _ in rows:
+        kind = categories.BY_ID[category_id].kind
+        totals_by_kind[kind] = totals_by_kind.get(kind, Decimal("0")) + total
+
+    items = []
+    for category_id, total, tx_count in sorted(rows, key=lambda r: r[1], reverse=True):
+        category = categories.BY_ID[category_id]
+        kind_total = totals_by_kind[category.kind]
+        items.append(CategorySpending(
+            code=category.code,
+            name=category.name,
+            kind=category.kind,
+            total=float(total),
+            count=tx_count,
+            share=float(total / kind_total) if kind_total else 0.0,
+        ))
+
+    return SpendingReport(
+        month=month_start.strftime("%Y-%m"),
+        total_spent=float(totals_by_kind.get("expense", 0)),
+        total_income=float(totals_by_kind.get("income", 0)),
+        categories=items,
+    )
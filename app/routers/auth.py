@@ -3,23 +3,31 @@ from app import routers
 from datetime import timedelta
 from app.core.config import settings
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.db.database import get_db
 from app.db.models import User
 from app.schemas.user import UserCreate, UserResponse
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash_async, verify_and_update_password, PasswordHasherBusy
 from app.dependencies import get_current_user
-from app.core.security import verify_password, create_access_token
+from app.core.security import create_access_token
 from app.schemas.token import Token, LoginRequest
+from app.core.query_budget import query_budget
+from app.core.phones import to_e164
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 @router.post("/register", response_model=UserResponse)
+@query_budget(2)
 async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
-    # Проверяем есть ли такой номер в базе
-    query = select(User).where(User.phone == user_data.phone)
+    phone_e164 = to_e164(user_data.phone)
+    if phone_e164 is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Некорректный номер телефона")
+
+    # Проверяем есть ли такой номер в базе (в любом написании)
+    query = select(User).where(User.phone_e164 == phone_e164)
     result = await db.execute(query)
     existing_user = result.scalar_one_or_none()
 
@@ -29,48 +37,76 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
             detail="Пользователь с таким номером уже существует"
         )
 
-    # Хешируем пароль
-    hashed_password = get_password_hash(user_data.password)
+    # Хешируем пароль (в пуле потоков, чтобы не блокировать остальные запросы)
+    try:
+        hashed_password = await get_password_hash_async(user_data.password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Сервис перегружен, попробуйте позже")
 
     # Создаем пользователя
     new_user = User(
         phone=user_data.phone,
+        phone_e164=phone_e164,
         password_hash=hashed_password,
         full_name=user_data.full_name,
         role="user"
     )
 
     db.add(new_user)
-    await db.commit()
-    await db.refresh(new_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Тот же номер параллельно зарегистрировал другой запрос
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Пользователь с таким номером уже существует"
+        )
 
     return new_user
 
 @router.post("/login", response_model=Token)
+@query_budget(2)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db)
 ):
 
-    query = select(User).where(User.phone == form_data.username)
-    result = await db.execute(query)
-    user = result.scalar_one_or_none()
+    phone_e164 = to_e164(form_data.username)
+    user = None
+    if phone_e164 is not None:
+        query = select(User).where(User.phone_e164 == phone_e164)
+        result = await db.execute(query)
+        user = result.scalar_one_or_none()
 
-    if not user or not verify_password(form_data.password, user.password_hash):
+    valid, new_hash = False, None
+    if user:
+        try:
+            valid, new_hash = await verify_and_update_password(form_data.password, user.password_hash)
+        except PasswordHasherBusy:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Сервис перегружен, попробуйте позже")
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный номер телефона или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Параметры bcrypt поменялись — сохраняем хеш с новой стоимостью
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.phone},
+        data={"sub": user.phone_e164},
         expires_delta=access_token_expires
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/users/me", response_model=UserResponse)
+@query_budget(1)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
\ No newline at end of file
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from typing import Literal
 
 from app.db.database import get_db
 from app.db.models import User, Account, Transaction, Deposit
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
+from app.core.idempotency import IdempotencyGuard, IdempotencyConflict
+from app.core import categories
+from app.core.analytics import add_to_rollup
+from app.core.deposit_interest import days_between, interest_for
 
 router = APIRouter(prefix="/deposits", tags=["Deposits"])
 
@@ -16,15 +22,23 @@ class DepositRequest(BaseModel):
     amount: float
     term_months: int
     type: str = "standard"  # standard, premium, vip
+    # По окончании срока: payout — вернуть с процентами на счет, capitalize — продлить с процентами
+    on_maturity: Literal["payout", "capitalize"] = "payout"
 
 
 @router.post("/create")
+@query_budget(8)
 async def create_deposit(
     req: DepositRequest,
+    idempotency_key: str | None = Header(None, max_length=255),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Открытие вклада"""
+
+    guard = IdempotencyGuard(f"deposits.create:{current_user.id}", idempotency_key, req)
+    if replay := await guard.replay(db):
+        return replay
     
     # 1. Определяем ставку по типу
     rates = {
@@ -55,7 +69,8 @@ async def create_deposit(
         acc.balance -= amount_dec
         
         # 4. Создаем запись о вкладе
-        end_date = datetime.utcnow() + timedelta(days=30 * req.term_months)
+        start_date = datetime.utcnow()
+        end_date = start_date + timedelta(days=30 * req.term_months)
         
         new_deposit = Deposit(
             user_id=current_user.id,
@@ -63,9 +78,13 @@ async def create_deposit(
             rate=Decimal(str(rate)),
             term_months=req.term_months,
             type=req.type,
-            start_date=datetime.utcnow(),
+            start_date=start_date,
             end_date=end_date,
-            is_active=True
+            is_active=True,
+            accrued_interest=Decimal("0"),
+            accrued_through=start_date,
+            on_maturity=req.on_maturity,
+            account_id=acc.id,
         )
         db.add(new_deposit)
         
@@ -75,23 +94,33 @@ async def create_deposit(
             to_account_id=None,
             amount=amount_dec,
             category=f"Открытие вклада ({req.type.upper()})",
+            category_id=categories.DEPOSIT_OPEN,
             created_at=datetime.utcnow()
         )
         db.add(tx)
+        await add_to_rollup(db, user_id=current_user.id, category_id=categories.DEPOSIT_OPEN, amount=amount_dec)
+        await db.flush()  # id вклада нужен в ответе, который сохраняется до коммита
         
-        await db.commit()
-        await db.refresh(new_deposit)
-        
-        # Рассчитываем будущий доход
-        total_income = amount_dec * Decimal(str(rate)) * Decimal(str(req.term_months / 12))
+        # Будущий доход — по той же формуле, что начисляет app/jobs/deposits.py
+        total_income = interest_for(amount_dec, Decimal(str(rate)), 30 * req.term_months)
         
-        return {
+        response = {
             "status": "success",
             "message": "Вклад открыт!",
             "deposit_id": new_deposit.id,
-            "estimated_income": float(total_income)
+            "estimated_income": float(total_income),
+            "on_maturity": req.on_maturity,
         }
-        
+        await guard.save(db, response)
+
+        await db.commit()
+        guard.committed()
+
+        return response
+
+    except IdempotencyConflict:
+        await db.rollback()
+        return await guard.replay_after_conflict(db)
     except Exception as e:
         await db.rollback()
         print(f"Deposit Error: {e}")
@@ -99,6 +128,7 @@ async def create_deposit(
 
 
 @router.get("/my")
+@query_budget(2)
 async def get_my_deposits(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -108,13 +138,9 @@ async def get_my_deposits(
     res = await db.execute(q)
     deposits = res.scalars().all()
     
+    # Доход не пересчитывается на чтении: его раз в сутки начисляет app/jobs/deposits.py
     result = []
     for dep in deposits:
-        # Считаем текущий доход
-        days_passed = (datetime.utcnow() - dep.start_date).days
-        months_passed = days_passed / 30
-        current_income = dep.amount * dep.rate * Decimal(str(months_passed / 12))
-        
         result.append({
             "id": dep.id,
             "amount": float(dep.amount),
@@ -123,55 +149,86 @@ async def get_my_deposits(
             "type": dep.type,
             "start_date": dep.start_date.isoformat(),
             "end_date": dep.end_date.isoformat(),
-            "current_income": float(current_income)
+            "current_income": float(dep.accrued_interest or 0),
+            "accrued_through": dep.accrued_through.isoformat() if dep.accrued_through else None,
+            "on_maturity": dep.on_maturity,
         })
     
     return result
 
 
 @router.post("/{deposit_id}/close")
+@query_budget(8)
 async def close_deposit(
     deposit_id: int,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Досрочное закрытие вклада (с потерей процентов)"""
+    """
+    Закрытие вклада. До окончания срока — досрочно, с потерей процентов.
+    Срок истек, а фоновая выплата (app/jobs/deposits.py) еще не дошла — выплачиваем как она:
+    сумма плюс проценты за весь срок.
+    """
     
-    q = select(Deposit).where(Deposit.id == deposit_id, Deposit.user_id == current_user.id)
+    # Блокировка — чтобы не разминуться с выплатой по окончании срока (app/jobs/deposits.py)
+    q = select(Deposit).where(Deposit.id == deposit_id, Deposit.user_id == current_user.id).with_for_update()
     res = await db.execute(q)
     deposit = res.scalar_one_or_none()
     
     if not deposit or not deposit.is_active:
         raise HTTPException(status_code=404, detail="Вклад не найден")
     
-    # Находим счет для возврата средств
-    q_acc = select(Account).where(Account.user_id == current_user.id).limit(1)
-    res_acc = await db.execute(q_acc)
+    matured = deposit.end_date <= datetime.now(timezone.utc)
+
+    # Находим счет для возврата средств (по окончании срока — как в фоновой выплате: указанный при открытии)
+    q_acc = select(Account).where(Account.user_id == current_user.id)
+    if matured and deposit.account_id is not None:
+        q_acc = q_acc.where(Account.id == deposit.account_id)
+    res_acc = await db.execute(q_acc.order_by(Account.id).limit(1))
     acc = res_acc.scalar_one_or_none()
     
     if not acc:
         raise HTTPException(status_code=400, detail="Счет не найден")
     
     try:
-        # Возвращаем только основную сумму (без процентов при досрочном закрытии)
-        acc.balance += deposit.amount
+        # Досрочно — только основная сумма; по окончании срока — плюс проценты за весь срок
+        interest = Decimal("0")
+        if matured:
+            interest = interest_for(deposit.amount, deposit.rate, days_between(deposit.start_date, deposit.end_date))
+            deposit.accrued_interest = interest
+            deposit.accrued_through = deposit.end_date
+        acc.balance += deposit.amount + interest
         deposit.is_active = False
+        now = datetime.utcnow()
         
         tx = Transaction(
             from_account_id=None,
             to_account_id=acc.id,
             amount=deposit.amount,
-            category="Закрытие вклада (досрочно)",
-            created_at=datetime.utcnow()
+            category=f"Закрытие вклада ({deposit.type.upper()}): срок истек" if matured else "Закрытие вклада (досрочно)",
+            category_id=categories.DEPOSIT_CLOSE,
+            created_at=now
         )
         db.add(tx)
+        await add_to_rollup(db, user_id=current_user.id, category_id=categories.DEPOSIT_CLOSE, amount=deposit.amount)
+        if interest > 0:
+            db.add(Transaction(
+                from_account_id=None,
+                to_account_id=acc.id,
+                amount=interest,
+                category=f"Проценты по вкладу ({deposit.type.upper()})",
+                category_id=categories.DEPOSIT_INTEREST,
+                created_at=now
+            ))
+            await add_to_rollup(db, user_id=current_user.id, category_id=categories.DEPOSIT_INTEREST, amount=interest)
         
         await db.commit()
         
         return {
             "status": "success",
             "message": "Вклад закрыт. Средства возвращены на счет.",
-            "returned_amount": float(deposit.amount)
+            "returned_amount": float(deposit.amount + interest),
+            "interest": float(interest)
         }
         
     except Exception as e:
@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func
 from sqlalchemy.future import select
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from typing import Literal
 
 from app.db.database import get_db
 from app.db.models import User, Account, Transaction, Insurance
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
+from app.core.config import settings
+from app.core.idempotency import IdempotencyGuard, IdempotencyConflict
+from app.core import categories
+from app.core.analytics import add_to_rollup
 
 router = APIRouter(prefix="/insurance", tags=["Insurance"])
 
@@ -16,15 +23,23 @@ class InsuranceRequest(BaseModel):
     insurance_type: str  # life, health, property, auto, travel
     coverage_amount: float = 1000000  # Сумма покрытия
     term_months: int = 12
+    # upfront — вся стоимость сразу, monthly — первый месяц сейчас, дальше списывает app/jobs/scheduler.py
+    payment_mode: Literal["upfront", "monthly"] = "upfront"
 
 
 @router.post("/apply")
+@query_budget(8)
 async def apply_insurance(
     req: InsuranceRequest,
+    idempotency_key: str | None = Header(None, max_length=255),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Оформление страхования"""
+
+    guard = IdempotencyGuard(f"insurance.apply:{current_user.id}", idempotency_key, req)
+    if replay := await guard.replay(db):
+        return replay
     
     # Тарифы (месячная стоимость на 1 млн покрытия)
     rates = {
@@ -41,6 +56,7 @@ async def apply_insurance(
     coverage_millions = req.coverage_amount / 1000000
     monthly_cost = Decimal(str(base_cost * coverage_millions))
     total_cost = monthly_cost * Decimal(str(req.term_months))
+    charge_now = monthly_cost if req.payment_mode == "monthly" else total_cost
     
     # Находим счет
     q = select(Account).where(Account.user_id == current_user.id, Account.is_blocked == False)
@@ -50,15 +66,21 @@ async def apply_insurance(
     if not acc:
         raise HTTPException(status_code=400, detail="Нет активного счета")
     
-    if acc.balance < total_cost:
+    if acc.balance < charge_now:
         raise HTTPException(status_code=400, detail="Недостаточно средств для оплаты страховки")
     
     try:
         # Списываем деньги
-        acc.balance -= total_cost
+        acc.balance -= charge_now
         
         # Создаем полис
-        end_date = datetime.utcnow() + timedelta(days=30 * req.term_months)
+        start_date = datetime.utcnow()
+        end_date = start_date + timedelta(days=30 * req.term_months)
+        next_billing_at = None
+        if req.payment_mode == "monthly":
+            next_billing_at = start_date + timedelta(days=settings.INSURANCE_BILLING_PERIOD_DAYS)
+            if next_billing_at >= end_date:
+                next_billing_at = None
         
         new_insurance = Insurance(
             user_id=current_user.id,
@@ -66,9 +88,11 @@ async def apply_insurance(
             coverage_amount=Decimal(str(req.coverage_amount)),
             monthly_cost=monthly_cost,
             term_months=req.term_months,
-            start_date=datetime.utcnow(),
+            start_date=start_date,
             end_date=end_date,
-            is_active=True
+            is_active=True,
+            payment_mode=req.payment_mode,
+            next_billing_at=next_billing_at,
         )
         db.add(new_insurance)
         
@@ -76,23 +100,36 @@ async def apply_insurance(
         tx = Transaction(
             from_account_id=acc.id,
             to_account_id=None,
-            amount=total_cost,
+            amount=charge_now,
             category=f"Страхование: {req.insurance_type.upper()}",
+            category_id=categories.INSURANCE,
+            provider=req.insurance_type[:64],
             created_at=datetime.utcnow()
         )
         db.add(tx)
+        await add_to_rollup(db, user_id=current_user.id, category_id=categories.INSURANCE, amount=charge_now)
+        await db.flush()  # id полиса нужен в ответе, который сохраняется до коммита
         
-        await db.commit()
-        await db.refresh(new_insurance)
-        
-        return {
+        response = {
             "status": "success",
             "message": "Страховка оформлена!",
             "policy_id": new_insurance.id,
             "total_cost": float(total_cost),
-            "monthly_cost": float(monthly_cost)
+            "monthly_cost": float(monthly_cost),
+            "charged_now": float(charge_now),
+            "payment_mode": req.payment_mode,
+            "next_billing_at": next_billing_at.isoformat() if next_billing_at else None,
         }
-        
+        await guard.save(db, response)
+
+        await db.commit()
+        guard.committed()
+
+        return response
+
+    except IdempotencyConflict:
+        await db.rollback()
+        return await guard.replay_after_conflict(db)
     except Exception as e:
         await db.rollback()
         print(f"Insurance Error: {e}")
@@ -100,12 +137,18 @@ async def apply_insurance(
 
 
 @router.get("/my")
+@query_budget(2)
 async def get_my_insurances(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Список активных полисов"""
-    q = select(Insurance).where(Insurance.user_id == current_user.id, Insurance.is_active == True)
+    # Истекшие, но еще не выключенные app/jobs/insurance.py, тоже не показываем
+    q = select(Insurance).where(
+        Insurance.user_id == current_user.id,
+        Insurance.is_active == True,
+        Insurance.end_date > func.now(),
+    ).order_by(Insurance.end_date)
     res = await db.execute(q)
     insurances = res.scalars().all()
     
@@ -118,13 +161,16 @@ async def get_my_insurances(
             "monthly_cost": float(ins.monthly_cost),
             "term_months": ins.term_months,
             "start_date": ins.start_date.isoformat(),
-            "end_date": ins.end_date.isoformat()
+            "end_date": ins.end_date.isoformat(),
+            "payment_mode": ins.payment_mode,
+            "next_billing_at": ins.next_billing_at.isoformat() if ins.next_billing_at else None,
         })
     
     return result
 
 
 @router.post("/{insurance_id}/cancel")
+@query_budget(3)
 async def cancel_insurance(
     insurance_id: int,
     db: AsyncSession = Depends(get_db),
@@ -136,7 +182,7 @@ async def cancel_insurance(
     res = await db.execute(q)
     insurance = res.scalar_one_or_none()
     
-    if not insurance or not insurance.is_active:
+    if not insurance or not insurance.is_active or insurance.end_date <= datetime.now(timezone.utc):
         raise HTTPException(status_code=404, detail="Полис не найден")
     
     insurance.is_active = False
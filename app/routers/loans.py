@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import insert
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import datetime
 from decimal import Decimal
 
+from app.core.amortization import build_schedule
+from app.core.idempotency import IdempotencyGuard, IdempotencyConflict
+from app.core.notifications import enqueue_notification
 from app.db.database import get_db
 from app.db.models import User, Account, Transaction, Loan, LoanSchedule
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
+from app.core import categories
+from app.core.analytics import add_to_rollup
 
 router = APIRouter(prefix="/loans", tags=["Loans"])
 
@@ -21,13 +28,31 @@ class LoanRequest(BaseModel):
     # Для автокредита
     vehicle_price: float | None = None
 
+def apply_installment_payment(loan: Loan, installment: LoanSchedule) -> None:
+    """Инкрементально уменьшает остатки кредита после оплаты одного платежа"""
+    installment.is_paid = True
+    loan.remaining_installments = max((loan.remaining_installments or 0) - 1, 0)
+    loan.remaining_amount = max((loan.remaining_amount or Decimal("0")) - installment.amount, Decimal("0"))
+    if loan.outstanding_principal is not None and installment.principal_amount is not None:
+        loan.outstanding_principal = max(loan.outstanding_principal - installment.principal_amount, Decimal("0"))
+    if loan.remaining_installments == 0:
+        loan.is_active = False
+
+
 @router.post("/apply")
+@query_budget(10)
 async def apply_loan(
         req: LoanRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
     """Оформление кредита"""
+
+    # 0. Повтор с тем же Idempotency-Key — второй кредит не выдаем
+    guard = IdempotencyGuard(f"loans.apply:{current_user.id}", idempotency_key, req)
+    if replay := await guard.replay(db):
+        return replay
     
     # 1. Определяем процентную ставку по типу кредита
     rates = {
@@ -40,10 +65,12 @@ async def apply_loan(
     }
     
     rate = rates.get(req.type, 0.15)
-    m_rate = rate / 12 if rate > 0 else 0
     
     amount_dec = Decimal(str(req.amount))
     
+    if amount_dec <= 0 or req.term_months < 1:
+        raise HTTPException(status_code=400, detail="Некорректная сумма или срок кредита")
+    
     # 2. Проверка дохода (Mock-скоринг)
     min_income_ratio = {
         "cash": 0.3,
@@ -56,11 +83,10 @@ async def apply_loan(
     
     ratio = min_income_ratio.get(req.type, 0.3)
     
-    # Расчет платежа
-    if m_rate > 0:
-        payment = amount_dec * Decimal(m_rate / (1 - (1 + m_rate) ** -req.term_months))
-    else:
-        payment = amount_dec / Decimal(req.term_months)
+    # Расчет платежа и всего графика (NumPy, за один проход)
+    now = datetime.utcnow()
+    schedule = build_schedule(amount_dec, rate, req.term_months, start=now)
+    payment = schedule.payment
     
     # Проверка платежеспособности
     if float(payment) > req.income * ratio:
@@ -94,24 +120,17 @@ async def apply_loan(
             term_months=req.term_months,
             monthly_payment=payment,
             type=req.type,
-            created_at=datetime.utcnow(),
-            is_active=True
+            created_at=now,
+            is_active=True,
+            outstanding_principal=amount_dec,
+            remaining_amount=schedule.total_amount,
+            remaining_installments=req.term_months
         )
         db.add(new_loan)
-        await db.commit()
-        await db.refresh(new_loan)
+        await db.flush()  # Нужен id кредита, коммит будет один в конце
 
-        # 6. Генерируем график платежей
-        curr = datetime.utcnow()
-        for i in range(1, req.term_months + 1):
-            due_date = curr + timedelta(days=30 * i)
-            schedule_item = LoanSchedule(
-                loan_id=new_loan.id,
-                due_date=due_date,
-                amount=payment,
-                is_paid=False
-            )
-            db.add(schedule_item)
+        # 6. График платежей одним bulk INSERT
+        await db.execute(insert(LoanSchedule), schedule.rows(new_loan.id))
 
         # 7. Зачисляем деньги на счет
         acc.balance += amount_dec
@@ -131,20 +150,36 @@ async def apply_loan(
             to_account_id=acc.id,
             amount=amount_dec,
             category=f"Зачисление: {category_names.get(req.type, 'Кредит')}",
-            created_at=datetime.utcnow()
+            category_id=categories.LOAN_PAYOUT,
+            created_at=now
         )
         db.add(tx)
-        
-        await db.commit()
-        
-        return {
+        await add_to_rollup(db, user_id=current_user.id, category_id=categories.LOAN_PAYOUT, amount=amount_dec)
+
+        await enqueue_notification(
+            db,
+            user_id=current_user.id,
+            kind="loan_payout",
+            body=f"{tx.category}: +{amount_dec} ₸. Ежемесячный платеж: {payment} ₸",
+        )
+
+        response = {
             "status": "approved",
             "message": "Кредит одобрен и зачислен на счет!",
             "loan_id": new_loan.id,
             "monthly_payment": float(payment),
-            "total_amount": float(amount_dec * (1 + Decimal(str(rate * req.term_months / 12))))
+            "total_amount": float(schedule.total_amount)
         }
+        await guard.save(db, response)
+        
+        await db.commit()
+        guard.committed()
+        
+        return response
 
+    except IdempotencyConflict:
+        await db.rollback()
+        return await guard.replay_after_conflict(db)
     except Exception as e:
         await db.rollback()
         print(f"Loan Error: {e}")
@@ -152,34 +187,27 @@ async def apply_loan(
 
 
 @router.get("/my")
+@query_budget(2)
 async def get_my_loans(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Список активных кредитов"""
+    """Список активных кредитов (один запрос: остатки хранятся в самом Loan)"""
     q = select(Loan).where(Loan.user_id == current_user.id, Loan.is_active == True)
     res = await db.execute(q)
     loans = res.scalars().all()
     
     result = []
     for loan in loans:
-        # Считаем остаток долга
-        q_paid = select(LoanSchedule).where(
-            LoanSchedule.loan_id == loan.id,
-            LoanSchedule.is_paid == False
-        )
-        res_paid = await db.execute(q_paid)
-        unpaid = res_paid.scalars().all()
-        
-        remaining_amount = sum(float(p.amount) for p in unpaid)
-        
         result.append({
             "id": loan.id,
             "type": loan.type,
             "amount": float(loan.amount),
             "monthly_payment": float(loan.monthly_payment),
             "term_months": loan.term_months,
-            "remaining_amount": remaining_amount,
+            "remaining_amount": float(loan.remaining_amount or 0),
+            "remaining_installments": loan.remaining_installments or 0,
+            "outstanding_principal": float(loan.outstanding_principal) if loan.outstanding_principal is not None else None,
             "created_at": loan.created_at.isoformat()
         })
     
@@ -187,6 +215,7 @@ async def get_my_loans(
 
 
 @router.get("/calendar")
+@query_budget(3)
 async def get_payment_calendar(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -221,6 +250,7 @@ async def get_payment_calendar(
 
 
 @router.post("/{loan_id}/pay")
+@query_budget(9)
 async def pay_loan_installment(
     loan_id: int,
     db: AsyncSession = Depends(get_db),
@@ -228,8 +258,8 @@ async def pay_loan_installment(
 ):
     """Погашение ближайшего платежа"""
     
-    # Проверяем кредит
-    q_loan = select(Loan).where(Loan.id == loan_id, Loan.user_id == current_user.id)
+    # Проверяем кредит (блокируем строку, чтобы параллельные оплаты не задели один платеж)
+    q_loan = select(Loan).where(Loan.id == loan_id, Loan.user_id == current_user.id).with_for_update()
     res_loan = await db.execute(q_loan)
     loan = res_loan.scalar_one_or_none()
     
@@ -259,7 +289,6 @@ async def pay_loan_installment(
     try:
         # Списываем деньги
         acc.balance -= next_payment.amount
-        next_payment.is_paid = True
         
         # Транзакция
         tx = Transaction(
@@ -267,20 +296,15 @@ async def pay_loan_installment(
             to_account_id=None,
             amount=next_payment.amount,
             category=f"Погашение кредита ({loan.type})",
+            category_id=categories.LOAN_REPAYMENT,
             created_at=datetime.utcnow()
         )
         db.add(tx)
+        await add_to_rollup(db, user_id=current_user.id, category_id=categories.LOAN_REPAYMENT, amount=next_payment.amount)
         
-        # Проверяем, все ли платежи погашены
-        q_check = select(LoanSchedule).where(
-            LoanSchedule.loan_id == loan_id,
-            LoanSchedule.is_paid == False
-        )
-        res_check = await db.execute(q_check)
-        remaining = res_check.scalars().all()
-        
-        if not remaining:
-            loan.is_active = False
+        # Обновляем агрегаты кредита вместо повторного чтения графика
+        apply_installment_payment(loan, next_payment)
+        loan_closed = not loan.is_active
         
         await db.commit()
         
@@ -288,7 +312,7 @@ async def pay_loan_installment(
             "status": "success",
             "message": "Платеж проведен успешно!",
             "paid_amount": float(next_payment.amount),
-            "loan_closed": not bool(remaining)
+            "loan_closed": loan_closed
         }
         
     except Exception as e:
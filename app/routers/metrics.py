@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.auth_cache import auth_cache
+from app.core.cards import card_allocator
+from app.core import idempotency
+from app.core.llm import llm
+from app.core.metrics import registry, render_stats
+from app.db.database import pool_stats
+from app.routers.ai import ai_stats
+
+router = APIRouter(tags=["Monitoring"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    lines = registry.render()
+    lines += render_stats("db_pool", pool_stats(), "Состояние пула соединений")
+    lines += render_stats("auth_cache", auth_cache.stats, "Кэш аутентификации")
+    lines += render_stats("idempotency_cache", idempotency.cache_stats(), "LRU ключей идемпотентности")
+    lines += render_stats("card_allocator", card_allocator.stats, "Выдача номеров карт")
+    lines += render_stats("llm", llm.stats, "Вызовы AI-провайдера")
+    lines += render_stats("llm_breaker", {"open": int(llm.breaker.state != "closed")}, "Breaker AI разомкнут")
+    lines += render_stats("ai", ai_stats, "Быстрый путь и кэши /ai")
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
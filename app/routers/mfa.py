@@ -1,54 +1,31 @@
-import random
-import urllib.request
-import json
+import secrets
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import settings
+from app.core.notifications import enqueue_notification
+from app.core.query_budget import query_budget
+from app.db.database import get_db
+from app.core.otp_store import otp_store, OTP_OK, OTP_LOCKED, OTP_MISSING
 from app.db.models import User
 from app.dependencies import get_current_user
 
 router = APIRouter(prefix="/mfa", tags=["MFA (Security)"])
 
-# Временное хранилище кодов (в проде используют Redis)
-otp_storage = {}
-
 
 class OTPVerify(BaseModel):
     code: str
 
 
-# --- НАСТРОЙКИ TELEGRAM (Опционально) ---
-TELEGRAM_BOT_TOKEN = ""
-TELEGRAM_CHAT_ID = ""
-
-
-def send_telegram_message(text: str):
-    """Отправляет сообщение в Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return
-
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        data = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
-
-        req = urllib.request.Request(
-            url,
-            data=json.dumps(data).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
-        with urllib.request.urlopen(req) as response:
-            print(f"Telegram status: {response.getcode()}")
-    except Exception as e:
-        print(f"Telegram Error: {e}")
-
-
 @router.post("/generate")
-async def generate_otp(current_user: User = Depends(get_current_user)):
+@query_budget(3)  # + запрос хранилища кодов при OTP_STORE=postgres
+async def generate_otp(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     # 1. Генерируем код
-    code = str(random.randint(1000, 9999))
+    code = str(1000 + secrets.randbelow(9000))
 
-    # 2. Сохраняем в память
-    otp_storage[current_user.phone] = code
+    # 2. Сохраняем (TTL и лимит попыток — в хранилище, см. OTP_STORE)
+    await otp_store.issue(str(current_user.id), code)
 
     # 3. Логирование в консоль (для истории)
     print(f"\n========== SMS SERVICE ==========")
@@ -56,9 +33,10 @@ async def generate_otp(current_user: User = Depends(get_current_user)):
     print(f"Code: {code}")
     print(f"=================================\n")
 
-    # 4. Отправка в Telegram (если настроен)
-    if TELEGRAM_BOT_TOKEN:
-        send_telegram_message(f"BellyBank Code: {code}")
+    # 4. Отправка в Telegram (если настроен) — через outbox, ответ Telegram не ждем
+    if settings.TELEGRAM_BOT_TOKEN:
+        await enqueue_notification(db, user_id=current_user.id, kind="otp", body=f"BellyBank Code: {code}")
+        await db.commit()
 
     # 5. ВОЗВРАЩАЕМ КОД ВО ФРОНТЕНД (Эмуляция Push)
     return {
@@ -72,16 +50,16 @@ async def verify_otp(
         otp_data: OTPVerify,
         current_user: User = Depends(get_current_user)
 ):
-    # Получаем сохраненный код
-    saved_code = otp_storage.get(current_user.phone)
+    # Код удаляется хранилищем после успеха или после исчерпания попыток
+    result = await otp_store.verify(str(current_user.id), otp_data.code)
 
-    if not saved_code:
+    if result == OTP_MISSING:
         raise HTTPException(status_code=400, detail="Код не был запрошен или истек")
 
-    if saved_code != otp_data.code:
-        raise HTTPException(status_code=400, detail="Неверный код")
+    if result == OTP_LOCKED:
+        raise HTTPException(status_code=429, detail="Слишком много попыток. Запросите новый код")
 
-    # Удаляем код после успеха
-    del otp_storage[current_user.phone]
+    if result != OTP_OK:
+        raise HTTPException(status_code=400, detail="Неверный код")
 
     return {"status": "success", "message": "MFA пройден успешно"}
\ No newline at end of file
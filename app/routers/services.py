@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from pydantic import BaseModel
 from decimal import Decimal
-from datetime import datetime
 from typing import Dict, Optional, Any
 
+from app.core import transfer_engine
+from app.core.idempotency import IdempotencyGuard, IdempotencyConflict
+from app.core.settlement import settlement_directory, provider_code
+from app.core.notifications import enqueue_notification
 from app.db.database import get_db
-from app.db.models import User, Account, Transaction, RoleEnum, CurrencyEnum
+from app.db.models import User
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
+from app.core import categories
 
 router = APIRouter(prefix="/services", tags=["Services"])
 
@@ -17,51 +21,28 @@ class PayServiceRequest(BaseModel):
     amount: float
     details: Optional[Dict[str, Any]] = None
 
-async def get_or_create_service_account(db: AsyncSession, service_name: str) -> Account:
-    # Для упрощения все деньги уходят на один "технический" аккаунт сервисов
-    # В реальности тут была бы сложная логика маршрутизации
-    service_phone = "srv_general"
-    
-    q = select(User).where(User.phone == service_phone)
-    res = await db.execute(q)
-    user = res.scalars().first()
-
-    if not user:
-        user = User(phone=service_phone, password_hash="pass", full_name="Service Hub", role=RoleEnum.USER)
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
-
-    q_acc = select(Account).where(Account.user_id == user.id)
-    res_acc = await db.execute(q_acc)
-    acc = res_acc.scalars().first()
-
-    if not acc:
-        acc = Account(user_id=user.id, card_number="SRV_000_000", balance=0, currency=CurrencyEnum.KZT)
-        db.add(acc)
-        await db.commit()
-        await db.refresh(acc)
-
-    return acc
-
 @router.post("/pay")
+@query_budget(8)
 async def pay_service(
         req: PayServiceRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
-    q = select(Account).where(Account.user_id == current_user.id, Account.is_blocked == False)
-    res = await db.execute(q)
-    user_acc = res.scalars().first()
-
-    if not user_acc:
-        raise HTTPException(status_code=400, detail="Нет активного счета")
+    guard = IdempotencyGuard(f"services.pay:{current_user.id}", idempotency_key, req)
+    if replay := await guard.replay(db):
+        return replay
 
     amount = Decimal(str(req.amount))
-    if user_acc.balance < amount:
-        raise HTTPException(status_code=400, detail="Недостаточно средств")
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Сумма должна быть больше 0")
 
-    service_acc = await get_or_create_service_account(db, req.service_name)
+    # id расчетного счета провайдера берется из кэша процесса (без запросов в БД)
+    service_acc_id = await settlement_directory.account_for(req.service_name, current_user.id)
+
+    # Нормализованная категория и контрагент для аналитики трат
+    code = provider_code(req.service_name)
+    analytics_provider, analytics_merchant = categories.service_counterparty(code, req.details or {})
 
     # --- ФОРМИРОВАНИЕ КРАСИВОГО ОПИСАНИЯ ---
     desc = f"Оплата: {req.service_name}"
@@ -111,23 +92,39 @@ async def pay_service(
     elif req.service_name == "Ortak":
         desc = "Ortak: Разделение счета 🍕"
 
-    try:
-        user_acc.balance -= amount
-        service_acc.balance += amount
+    response = {"status": "success", "message": desc}
+
+    async def on_posted(session: AsyncSession, posted):
+        await enqueue_notification(
+            session,
+            user_id=current_user.id,
+            kind="service_payment",
+            body=f"{desc}: -{amount} ₸. Баланс: {posted.new_balance} ₸",
+        )
+        response["new_balance"] = float(posted.new_balance)
+        await guard.save(session, response)
 
-        tx = Transaction(
-            from_account_id=user_acc.id,
-            to_account_id=service_acc.id,
+    try:
+        result = await transfer_engine.pay_to_settlement(
+            db,
+            user_id=current_user.id,
             amount=amount,
             category=desc,
-            created_at=datetime.utcnow()
+            settlement_account_id=service_acc_id,
+            category_id=categories.service_category(code),
+            provider=analytics_provider,
+            merchant=analytics_merchant,
+            on_posted=on_posted,
         )
-        db.add(tx)
-        await db.commit()
-        
-        return {"status": "success", "message": desc, "new_balance": float(user_acc.balance)}
+        guard.committed()
+        return {**response, "new_balance": float(result.new_balance)}
 
+    except transfer_engine.TransferRejected as e:
+        if e.reason == "no_account":
+            raise HTTPException(status_code=400, detail="Нет активного счета")
+        raise HTTPException(status_code=400, detail="Недостаточно средств")
+    except IdempotencyConflict:
+        return await guard.replay_after_conflict(db)
     except Exception as e:
-        await db.rollback()
         print(f"Payment Error: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при проведении платежа")
\ No newline at end of file
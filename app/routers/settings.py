@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
 from app.db.models import User
 from app.dependencies import get_current_user
+from app.core.auth_cache import Principal, auth_cache
+from app.core.query_budget import query_budget
 
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
@@ -23,26 +25,35 @@ class UserProfile(BaseModel):
 class UpdateProfileRequest(BaseModel):
     full_name: str | None = None
     avatar_url: str | None = None
+    telegram_chat_id: str | None = Field(default=None, max_length=32)  # Личный чат с ботом для уведомлений
 
 
 @router.get("/me", response_model=UserProfile)
+@query_budget(1)
 async def get_profile_settings(current_user: User = Depends(get_current_user)):
     """Получить данные профиля для экрана настроек"""
     return current_user
 
 
 @router.patch("/me", response_model=UserProfile)
+@query_budget(3)
 async def update_profile_settings(
         req: UpdateProfileRequest,
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
     """Обновить фото или имя в настройках"""
+    # current_user — снимок из кэша, поэтому изменяем саму запись в БД
+    user = await db.get(User, current_user.id)
     if req.full_name is not None:
-        current_user.full_name = req.full_name
+        user.full_name = req.full_name
     if req.avatar_url is not None:
-        current_user.avatar_url = req.avatar_url
+        user.avatar_url = req.avatar_url
+    if req.telegram_chat_id is not None:
+        user.telegram_chat_id = req.telegram_chat_id or None  # Пустая строка — отвязать
 
     await db.commit()
-    await db.refresh(current_user)
-    return current_user
\ No newline at end of file
+
+    # Старый снимок больше не актуален
+    auth_cache.invalidate_principal(user.phone_e164)
+    return Principal.from_user(user)
\ No newline at end of file
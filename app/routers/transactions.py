@@ -1,16 +1,25 @@
-from fastapi import APIRouter, Depends
+import base64
+from typing import Literal
+from zoneinfo import ZoneInfo
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import or_, desc
+from sqlalchemy import or_, desc, tuple_, union_all
 
-from app.db.database import get_db
+from app.core import statements
+from app.core.config import settings
+from app.db.database import get_db, AsyncSessionLocal
 from app.db.models import User, Transaction, Account
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 
 router = APIRouter(prefix="/transactions", tags=["History"])
 
+MAX_PAGE_SIZE = 100
+
 
 class TransactionSchema(BaseModel):
     id: int
@@ -23,33 +32,100 @@ class TransactionSchema(BaseModel):
         from_attributes = True
 
 
-@router.get("/", response_model=list[TransactionSchema])
-async def get_history(
-        limit: int = 20,
-        offset: int = 0,
-        db: AsyncSession = Depends(get_db),
-        current_user: User = Depends(get_current_user)
-):
-    query_accounts = select(Account.id).where(Account.user_id == current_user.id)
-    result_accounts = await db.execute(query_accounts)
-    user_account_ids = result_accounts.scalars().all()
+class TransactionPage(BaseModel):
+    items: list[TransactionSchema]
+    next_cursor: str | None = None
+
+
+# --- КУРСОР ---
+# Непрозрачная строка для клиента: base64("<created_at ISO>|<id>")
+def encode_cursor(created_at: datetime, tx_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{tx_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-    if not user_account_ids:
-        return []
 
-    query = select(Transaction).where(
-        or_(
-            Transaction.from_account_id.in_(user_account_ids),
-            Transaction.to_account_id.in_(user_account_ids)
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, tx_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(tx_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+def history_branches(
+        account_ids: list[int],
+        cols,
+        per_branch_limit: int | None = None,
+        cursor: tuple[datetime, int] | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+):
+    """
+    По две ветки на счет: исходящие по индексу (from_account_id, created_at, id)
+    и входящие по (to_account_id, created_at, id), каждая уже в порядке убывания.
+    """
+    branches = []
+    for acc_id in account_ids:
+        outgoing = select(*cols).where(Transaction.from_account_id == acc_id)
+        # Переводы между своими счетами уже попали в исходящие — не дублируем
+        incoming = select(*cols).where(
+            Transaction.to_account_id == acc_id,
+            or_(Transaction.from_account_id.is_(None), Transaction.from_account_id.not_in(account_ids))
         )
-    ).order_by(desc(Transaction.created_at)).limit(limit).offset(offset)
+        for q in (outgoing, incoming):
+            if cursor:
+                q = q.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(*cursor))
+            if since:
+                q = q.where(Transaction.created_at >= since)
+            if until:
+                q = q.where(Transaction.created_at < until)
+            q = q.order_by(desc(Transaction.created_at), desc(Transaction.id))
+            if per_branch_limit is not None:
+                q = q.limit(per_branch_limit)
+            branches.append(q)
+    return branches
+
+
+async def fetch_history(
+        db: AsyncSession,
+        account_ids: list[int],
+        limit: int,
+        cursor: tuple[datetime, int] | None = None,
+        offset: int = 0
+):
+    """
+    История как UNION ALL упорядоченных сканов по индексам
+    (from_account_id, created_at, id) и (to_account_id, created_at, id).
+    Каждая ветка читает не больше limit + offset строк, внешняя сортировка
+    сливает их — цена страницы не зависит от глубины при курсоре.
+    """
+    cols = (
+        Transaction.id,
+        Transaction.from_account_id,
+        Transaction.to_account_id,
+        Transaction.amount,
+        Transaction.category,
+        Transaction.created_at,
+    )
+    branches = history_branches(account_ids, cols, per_branch_limit=limit + offset, cursor=cursor)
+
+    merged = union_all(*branches).subquery()
+    query = (
+        select(merged)
+        .order_by(desc(merged.c.created_at), desc(merged.c.id))
+        .limit(limit)
+        .offset(offset)
+    )
 
     result = await db.execute(query)
-    transactions = result.scalars().all()
+    return result.all()
 
+
+def _to_history(rows, account_ids: list[int]) -> list[dict]:
     history = []
-    for tx in transactions:
-        tx_type = "expense" if tx.from_account_id in user_account_ids else "income"
+    for tx in rows:
+        tx_type = "expense" if tx.from_account_id in account_ids else "income"
         history.append({
             "id": tx.id,
             "amount": tx.amount,
@@ -57,5 +133,180 @@ async def get_history(
             "created_at": tx.created_at,
             "type": tx_type
         })
+    return history
+
+
+async def _user_account_ids(db: AsyncSession, user_id: int) -> list[int]:
+    query_accounts = select(Account.id).where(Account.user_id == user_id)
+    result_accounts = await db.execute(query_accounts)
+    return list(result_accounts.scalars().all())
+
+
+@router.get("/", response_model=list[TransactionSchema])
+@query_budget(3)
+async def get_history(
+        limit: int = 20,
+        offset: int = 0,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """Старый постраничный вариант (offset). Для длинной истории используйте /transactions/page"""
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    user_account_ids = await _user_account_ids(db, current_user.id)
+
+    if not user_account_ids:
+        return []
+
+    rows = await fetch_history(db, user_account_ids, limit, offset=max(offset, 0))
+    return _to_history(rows, user_account_ids)
+
+
+@router.get("/page", response_model=TransactionPage)
+@query_budget(3)
+async def get_history_page(
+        limit: int = 20,
+        cursor: str | None = None,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """История с курсором: передайте next_cursor из предыдущего ответа"""
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    position = decode_cursor(cursor) if cursor else None
+
+    user_account_ids = await _user_account_ids(db, current_user.id)
+    if not user_account_ids:
+        return {"items": [], "next_cursor": None}
+
+    rows = await fetch_history(db, user_account_ids, limit, cursor=position)
+
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return {"items": _to_history(rows, user_account_ids), "next_cursor": next_cursor}
+
+
+# --- ВЫПИСКА ---
+EXPORT_COLUMNS = (
+    Transaction.id,
+    Transaction.from_account_id,
+    Transaction.to_account_id,
+    Transaction.amount,
+    Transaction.category,
+    Transaction.created_at,
+    Transaction.category_id,
+    Transaction.provider,
+    Transaction.merchant,
+)
+EXPORT_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson", "pdf": "application/pdf"}
+
+
+def _period_bounds(date_from: date | None, date_to: date | None) -> tuple[datetime | None, datetime | None]:
+    """Даты включительно, границы суток — в ANALYTICS_TIMEZONE"""
+    tz = ZoneInfo(settings.ANALYTICS_TIMEZONE)
+    since = datetime.combine(date_from, time.min, tzinfo=tz) if date_from else None
+    until = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=tz) if date_to else None
+    if since and until and since >= until:
+        raise HTTPException(status_code=400, detail="date_from позже date_to")
+    return since, until
+
+
+def export_query(account_ids: list[int], since: datetime | None, until: datetime | None, limit: int | None = None):
+    """Без LIMIT ветки сливаются Merge Append по индексам — сортировки всей истории нет"""
+    branches = history_branches(account_ids, EXPORT_COLUMNS, per_branch_limit=limit, since=since, until=until)
+    merged = union_all(*branches).subquery()
+    query = select(merged).order_by(desc(merged.c.created_at), desc(merged.c.id))
+    return query.limit(limit) if limit is not None else query
+
+
+async def _stream_statement(query, account_ids: set[int], fmt: str):
+    """
+    Генератор работает уже после выхода из обработчика, поэтому у него своя сессия.
+    Серверный курсор отдает по STATEMENT_FETCH_SIZE строк — в памяти всегда одна пачка.
+    """
+    chunk = statements.csv_chunk if fmt == "csv" else statements.ndjson_chunk
+    if fmt == "csv":
+        yield statements.csv_header()
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(query.execution_options(yield_per=settings.STATEMENT_FETCH_SIZE))
+            async for rows in result.partitions():
+                yield chunk([statements.statement_row(tx, account_ids) for tx in rows])
+    except Exception as e:
+        # Заголовки уже отправлены — статус не поменять, клиент получит обрезанный файл
+        print(f"Statement Export Error: {e}")
+        raise
+
+
+@router.get("/export")
+@query_budget(3)
+async def export_history(
+        format: Literal["csv", "ndjson", "pdf"] = "csv",
+        date_from: date | None = None,
+        date_to: date | None = None,
+        account_id: int | None = None,
+        user_id: int | None = None,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Полная выписка: CSV / NDJSON потоком (любой объем), PDF — до STATEMENT_PDF_MAX_ROWS операций.
+    user_id — выписка другого клиента, только для поддержки (role=admin).
+    """
+    owner_id = current_user.id
+    if user_id is not None and user_id != current_user.id:
+        if current_user.role != "admin":
+            raise HTTPException(status_code=403, detail="Выписки других клиентов доступны только поддержке")
+        owner_id = user_id
+
+    since, until = _period_bounds(date_from, date_to)
+
+    user_account_ids = await _user_account_ids(db, owner_id)
+    if account_id is not None:
+        if account_id not in user_account_ids:
+            raise HTTPException(status_code=404, detail="Счет не найден")
+        user_account_ids = [account_id]
+
+    period = f"{date_from or 'начало'} — {date_to or date.today()}"
+    filename = f"statement_{owner_id}_{date_from or 'all'}_{date_to or date.today()}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format == "pdf":
+        if not statements.pdf_available():
+            raise HTTPException(status_code=501, detail="PDF-выписки не настроены на сервере")
+        rows = []
+        if user_account_ids:
+            query = export_query(user_account_ids, since, until, limit=settings.STATEMENT_PDF_MAX_ROWS + 1)
+            rows = (await db.execute(query)).all()
+        if len(rows) > settings.STATEMENT_PDF_MAX_ROWS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Больше {settings.STATEMENT_PDF_MAX_ROWS} операций: сузьте период или выберите format=csv"
+            )
+
+        account_set = set(user_account_ids)
+        if owner_id == current_user.id:
+            title = f"Выписка: {current_user.full_name or current_user.phone}"
+        else:
+            title = f"Выписка: клиент #{owner_id}"
+        document = statements.statement_html(title, period, [statements.statement_row(tx, account_set) for tx in rows])
+        try:
+            pdf = await statements.render_pdf(document)
+        except statements.PDFUnavailable as e:
+            print(f"Statement PDF Error: {e}")
+            raise HTTPException(status_code=501, detail="PDF-выписки не настроены на сервере")
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail="PDF не успел сформироваться, попробуйте позже")
+        return Response(content=pdf, media_type=EXPORT_MEDIA_TYPES["pdf"], headers=headers)
+
+    if not user_account_ids:
+        empty = statements.csv_header() if format == "csv" else ""
+        return Response(content=empty, media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
 
-    return history
\ No newline at end of file
+    query = export_query(user_account_ids, since, until)
+    return StreamingResponse(
+        _stream_statement(query, set(user_account_ids), format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers,
+    )
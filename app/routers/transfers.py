@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from decimal import Decimal
+
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 from pydantic import BaseModel
 
+from app.core import transfer_engine, batch_transfers
+from app.core.idempotency import IdempotencyGuard, IdempotencyConflict
+from app.core.config import settings
+from app.core.notifications import enqueue_notifications
 from app.db.database import get_db
 from app.db.models import User, Account, Transaction, Favorite
-from app.schemas.transfer import TransferRequest
+from app.schemas.transfer import TransferRequest, BatchTransferRequest
 from app.dependencies import get_current_user
+from app.core.query_budget import query_budget
+from app.core.phones import to_e164
 
 router = APIRouter(prefix="/transfers", tags=["Transfers & Favorites"])
 
@@ -19,6 +27,7 @@ class FavoriteCreate(BaseModel):
 
 # --- ИЗБРАННОЕ ---
 @router.get("/favorites")
+@query_budget(2)
 async def get_favorites(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     try:
         res = await db.execute(select(Favorite).where(Favorite.user_id == current_user.id))
@@ -27,6 +36,7 @@ async def get_favorites(db: AsyncSession = Depends(get_db), current_user: User =
         return [] 
 
 @router.post("/favorites")
+@query_budget(2)
 async def add_favorite(fav: FavoriteCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Сохраняем избранное с дефолтными цветами (можно рандомизировать)
     new_fav = Favorite(
@@ -42,6 +52,7 @@ async def add_favorite(fav: FavoriteCreate, db: AsyncSession = Depends(get_db),
     return {"status": "ok", "id": new_fav.id}
 
 @router.delete("/favorites/{fav_id}")
+@query_budget(3)
 async def delete_favorite(fav_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     res = await db.execute(select(Favorite).where(Favorite.id == fav_id, Favorite.user_id == current_user.id))
     if fav := res.scalar_one_or_none():
@@ -50,110 +61,204 @@ async def delete_favorite(fav_id: int, db: AsyncSession = Depends(get_db), curre
     return {"status": "ok"}
 
 # --- ПЕРЕВОДЫ ---
+TRANSFER_ERRORS = {
+    "no_account": (400, "Нет карты для списания"),
+    "blocked": (403, "Карта списания заблокирована"),
+    "insufficient_funds": (400, "Недостаточно средств"),
+    "same_account": (400, "Перевод на ту же карту невозможен"),
+}
+
+
 @router.post("/p2p")
+@query_budget(7, max_repeats=settings.TRANSFER_MAX_RETRIES + 1)
 async def make_transfer(
         transfer: TransferRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
-    # 1. ОТПРАВИТЕЛЬ
-    sender_account = None
-    
-    # Если карта выбрана явно (из UI)
-    if transfer.from_account_id:
-        res = await db.execute(select(Account).where(Account.id == transfer.from_account_id, Account.user_id == current_user.id))
-        sender_account = res.scalar_one_or_none()
-    
-    # Если карта НЕ выбрана (например, через AI), ищем подходящую
-    if not sender_account:
-        # Получаем все активные карты пользователя
-        res = await db.execute(select(Account).where(Account.user_id == current_user.id, Account.is_blocked == False))
-        accounts = res.scalars().all()
-        
-        # Ищем первую карту, где хватает денег
-        for acc in accounts:
-            if acc.balance >= transfer.amount:
-                sender_account = acc
-                break
-        
-        # Если подходящей нет, берем первую (чтобы вернуть ошибку "Недостаточно средств" именно по ней)
-        if not sender_account and accounts:
-            sender_account = accounts[0]
-
-    if not sender_account:
-        raise HTTPException(status_code=400, detail="Нет карты для списания")
-    if sender_account.is_blocked:
-        raise HTTPException(status_code=403, detail="Карта списания заблокирована")
-    if sender_account.balance < transfer.amount:
-        raise HTTPException(status_code=400, detail="Недостаточно средств")
-
-    # 2. ПОЛУЧАТЕЛЬ
-    recipient_account = None
-    
-    # Улучшенная очистка номера
-    clean_phone = None
-    if transfer.to_phone:
-        # Убираем все лишнее
-        clean_phone = transfer.to_phone.replace(" ", "").replace("+", "").replace("-", "").replace("(", "").replace(")", "")
-        # Нормализуем к виду 8777...
-        if len(clean_phone) == 11 and clean_phone.startswith("7"):
-            clean_phone = "8" + clean_phone[1:]
-        elif len(clean_phone) == 10:
-            clean_phone = "8" + clean_phone
+    # 0. ПОВТОР: тот же Idempotency-Key — отдаем сохраненный ответ, ничего не списывая
+    guard = IdempotencyGuard(f"transfers.p2p:{current_user.id}", idempotency_key, transfer)
+    if replay := await guard.replay(db):
+        return replay
 
+    # 1. ПОЛУЧАТЕЛЬ (один запрос)
+    recipient_account_id = None
+    recipient_user_id = None
+    
+    clean_phone = to_e164(transfer.to_phone) if transfer.to_phone else None
     clean_card = transfer.to_card.replace(" ", "") if transfer.to_card else None
 
+    if transfer.to_phone and not clean_phone:
+        raise HTTPException(status_code=404, detail="Клиент не найден")
+
     if clean_phone:
-        # Поиск по телефону
-        res = await db.execute(select(User).where(User.phone == clean_phone).options(selectinload(User.accounts)))
-        recipient_user = res.scalar_one_or_none()
+        # Поиск по телефону: сразу берем незаблокированную карту (если все заблокированы — первую)
+        res = await db.execute(
+            select(User.id, Account.id)
+            .outerjoin(Account, Account.user_id == User.id)
+            .where(User.phone_e164 == clean_phone)
+            .order_by(Account.is_blocked.is_(True), Account.id)
+            .limit(1)
+        )
+        row = res.first()
         
-        if not recipient_user:
+        if not row:
             raise HTTPException(status_code=404, detail="Клиент не найден")
-            
-        # Ищем у получателя карту для зачисления (не заблокированную)
-        for acc in recipient_user.accounts:
-            if not acc.is_blocked:
-                recipient_account = acc
-                break
-        
-        if not recipient_account and recipient_user.accounts:
-             # Если все заблокированы, берем первую
-             recipient_account = recipient_user.accounts[0]
-             
-        if not recipient_account:
+        if row[1] is None:
             raise HTTPException(status_code=400, detail="У получателя нет активных карт")
+        recipient_user_id, recipient_account_id = row
 
     elif clean_card:
         # Поиск по карте
-        res = await db.execute(select(Account).where(Account.card_number == clean_card))
-        recipient_account = res.scalar_one_or_none()
+        res = await db.execute(select(Account.id, Account.user_id).where(Account.card_number == clean_card))
+        row = res.first()
+        if row:
+            recipient_account_id, recipient_user_id = row
+
+    if recipient_account_id:
+        desc = "Перевод клиенту"
+    else:
+        # Внешний перевод
+        desc = f"Перевод на карту др. банка (*{clean_card[-4:] if clean_card else 'EXT'})"
 
-    # 3. ПРОВЕРКА (Нельзя самому себе на ту же карту)
-    if recipient_account and sender_account.id == recipient_account.id:
-        raise HTTPException(status_code=400, detail="Перевод на ту же карту невозможен")
+    response = {"status": "success", "message": "Перевод отправлен"}
 
-    # 4. ТРАНЗАКЦИЯ
+    # Чеки и ключ идемпотентности пишутся в той же транзакции, что и перевод
+    async def on_posted(session: AsyncSession, posted):
+        receipts = [{
+            "user_id": current_user.id,
+            "kind": "transfer_out",
+            "body": f"{desc}: -{transfer.amount} ₸. Баланс: {posted.new_balance} ₸",
+        }]
+        if posted.credited_id is not None and recipient_user_id is not None:
+            receipts.append({
+                "user_id": recipient_user_id,
+                "kind": "transfer_in",
+                "body": f"Поступление перевода: +{transfer.amount} ₸",
+            })
+        await enqueue_notifications(session, receipts)
+        await guard.save(session, response)
+
+    # 2. ТРАНЗАКЦИЯ: списание, зачисление и запись в историю одним выражением
     try:
-        sender_account.balance -= transfer.amount
-        
-        if recipient_account:
-            recipient_account.balance += transfer.amount
-            desc = "Перевод клиенту"
-        else:
-            # Внешний перевод
-            desc = f"Перевод на карту др. банка (*{clean_card[-4:] if clean_card else 'EXT'})"
-
-        tx = Transaction(
-            from_account_id=sender_account.id,
-            to_account_id=recipient_account.id if recipient_account else None,
+        await transfer_engine.transfer(
+            db,
+            user_id=current_user.id,
             amount=transfer.amount,
-            category=desc
+            category=desc,
+            from_account_id=transfer.from_account_id,
+            to_account_id=recipient_account_id,
+            on_posted=on_posted,
         )
-        db.add(tx)
-        await db.commit()
-        return {"status": "success", "message": "Перевод отправлен"}
+        guard.committed()
+        return response
+    except transfer_engine.TransferRejected as e:
+        status_code, detail = TRANSFER_ERRORS[e.reason]
+        raise HTTPException(status_code=status_code, detail=detail)
+    except IdempotencyConflict:
+        # Параллельный повтор с тем же ключом успел первым — наш перевод откатился
+        return await guard.replay_after_conflict(db)
     except Exception as e:
-        await db.rollback()
         print(f"Transfer Error: {e}")
-        raise HTTPException(status_code=500, detail="Ошибка транзакции")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Ошибка транзакции")
+
+
+# --- МАССОВЫЕ ПЕРЕВОДЫ ---
+BATCH_ERRORS = {
+    "invalid_lines": "Есть строки с ошибками — пачка не проведена",
+    "insufficient_funds": "Недостаточно средств на всю пачку",
+    "nothing_posted": "Ни одна строка не проведена",
+}
+
+
+def _batch_report(lines) -> list[dict]:
+    return [
+        {"index": r.index, "reference": r.reference, "amount": r.amount, "status": r.status, "error": r.error}
+        for r in lines
+    ]
+
+
+@router.post("/batch")
+@query_budget(7, max_repeats=settings.TRANSFER_MAX_RETRIES + 1)
+async def make_batch_transfer(
+        batch: BatchTransferRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Зарплатная ведомость / массовая выплата: до BATCH_TRANSFER_MAX_ITEMS получателей за один запрос.
+    mode=atomic — все или ничего, mode=best_effort — проводится все, что можно; в ответе отчет по строкам.
+    """
+    guard = IdempotencyGuard(f"transfers.batch:{current_user.id}", idempotency_key, batch)
+    if replay := await guard.replay(db):
+        return replay
+
+    lines = [
+        batch_transfers.BatchLine(
+            amount=item.amount,
+            to_phone=to_e164(item.to_phone) if item.to_phone else None,
+            to_card=item.to_card.replace(" ", "") if item.to_card else None,
+            reference=item.reference,
+        )
+        for item in batch.items
+    ]
+    desc = batch.description or "Массовая выплата"
+    response = {}
+
+    async def on_posted(session: AsyncSession, result: batch_transfers.BatchResult):
+        posted = result.posted
+        # Один чек отправителю и по одному каждому получателю (строки на одного человека складываются)
+        received: dict[int, Decimal] = {}
+        for line in posted:
+            received[line.to_user_id] = received.get(line.to_user_id, Decimal("0")) + line.amount
+        receipts = [{
+            "user_id": current_user.id,
+            "kind": "transfer_out",
+            "body": f"{desc}: {len(posted)} получателей, -{result.total_posted} ₸. Баланс: {result.new_balance} ₸",
+        }]
+        receipts += [
+            {"user_id": user_id, "kind": "transfer_in", "body": f"{desc}: +{amount} ₸"}
+            for user_id, amount in received.items()
+        ]
+        await enqueue_notifications(session, receipts)
+
+        response.update({
+            "status": "success" if len(posted) == len(result.lines) else "partial",
+            "mode": result.mode,
+            "posted": len(posted),
+            "failed": len(result.lines) - len(posted),
+            "total_amount": result.total_posted,
+            "new_balance": result.new_balance,
+            "items": _batch_report(result.lines),
+        })
+        await guard.save(session, response)
+
+    try:
+        await batch_transfers.batch_transfer(
+            db,
+            user_id=current_user.id,
+            lines=lines,
+            mode=batch.mode,
+            category=desc,
+            from_account_id=batch.from_account_id,
+            on_posted=on_posted,
+        )
+        guard.committed()
+        return response
+    except batch_transfers.BatchRejected as e:
+        raise HTTPException(status_code=400, detail={
+            "status": "rejected",
+            "reason": e.reason,
+            "message": BATCH_ERRORS[e.reason],
+            "items": jsonable_encoder(_batch_report(e.lines)),
+        })
+    except transfer_engine.TransferRejected as e:
+        status_code, detail = TRANSFER_ERRORS[e.reason]
+        raise HTTPException(status_code=status_code, detail=detail)
+    except IdempotencyConflict:
+        return await guard.replay_after_conflict(db)
+    except Exception as e:
+        print(f"Batch Transfer Error: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка транзакции")
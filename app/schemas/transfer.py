@@ -1,5 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from decimal import Decimal
+from typing import Literal
+
+from app.core.config import settings
 
 class TransferRequest(BaseModel):
     amount: Decimal = Field(..., gt=0, description="Сумма перевода больше 0")
@@ -7,4 +10,24 @@ class TransferRequest(BaseModel):
     to_phone: str | None = None
     from_account_id: int | None = None
 
-    # Валидация: должен быть указан ЛИБО номер карты, ЛИБО телефон
\ No newline at end of file
+    # Валидация: должен быть указан ЛИБО номер карты, ЛИБО телефон
+
+
+class BatchTransferItem(BaseModel):
+    amount: Decimal = Field(..., gt=0, max_digits=10, decimal_places=2)
+    to_card: str | None = None
+    to_phone: str | None = None
+    reference: str | None = Field(None, max_length=64, description="Идентификатор строки у клиента")
+
+    @model_validator(mode="after")
+    def one_recipient(self):
+        if bool(self.to_card) == bool(self.to_phone):
+            raise ValueError("Укажите либо to_card, либо to_phone")
+        return self
+
+
+class BatchTransferRequest(BaseModel):
+    items: list[BatchTransferItem] = Field(..., min_length=1, max_length=settings.BATCH_TRANSFER_MAX_ITEMS)
+    mode: Literal["atomic", "best_effort"] = "atomic"
+    from_account_id: int | None = None
+    description: str | None = Field(None, max_length=100, description="Назначение, например «Зарплата за март»")
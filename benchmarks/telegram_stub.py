@@ -0,0 +1,63 @@
+"""
+Локальная замена Telegram Bot API для тестов диспетчера уведомлений.
+
+Отвечает на POST /bot{token}/sendMessage с настраиваемой задержкой и долей ошибок,
+GET /stats — сколько сообщений принято и сколько ответов было с ошибкой.
+
+    python -m benchmarks.telegram_stub --port 8099 --latency 0.2 --failure-rate 0.1
+
+    TELEGRAM_BOT_TOKEN=test TELEGRAM_API_URL=http://127.0.0.1:8099 \\
+        uvicorn app.main:app
+
+Уведомления получают только пользователи с users.telegram_chat_id (PATCH /settings/me).
+"""
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(latency: float = 0.0, failure_rate: float = 0.0, failure_status: int = 502) -> FastAPI:
+    app = FastAPI(title="Telegram stub")
+    app.state.stats = {"received": 0, "failed": 0}
+    app.state.messages = []
+
+    @app.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        payload = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        if failure_rate and random.random() < failure_rate:
+            app.state.stats["failed"] += 1
+            return JSONResponse({"ok": False, "description": "stub failure"}, status_code=failure_status)
+
+        app.state.stats["received"] += 1
+        app.state.messages.append(payload)
+        del app.state.messages[:-1000]  # Храним только последние
+        return {"ok": True, "result": {"message_id": app.state.stats["received"]}}
+
+    @app.get("/stats")
+    async def stats():
+        return {**app.state.stats, "last_messages": app.state.messages[-10:]}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Telegram Bot API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, секунды")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля ответов с ошибкой, 0..1")
+    parser.add_argument("--failure-status", type=int, default=502)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.failure_rate, args.failure_status)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()